@@ -1,23 +1,476 @@
-import json, os, re
+import json, os, re, sqlite3, threading, time
+from bisect import bisect_left
+
+from core import fingerprint
+from system import db, nvd_import
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
 
 DB_FILE = os.path.join("system", "local_cve_db.json")
 
-def load_db():
-    if not os.path.exists(DB_FILE):
+TOKEN_MIN_LEN = 3  # литералы короче слишком неселективны для префильтра
+
+# Поля диапазона в "versions" структурной записи (как versionStart*/versionEnd* в NVD);
+# пустая граница — без ограничения, {"version": "3.0"} — ровно одна версия
+RANGE_FIELDS = ("start_including", "start_excluding", "end_including", "end_excluding")
+
+NVD_CHECK_INTERVAL = 30  # сек: как часто проверять, не было ли нового импорта NVD
+
+_VERSION_PART_RE = re.compile(r"\d+|[a-z]+")
+
+# Буквенные части-предрелизы: 3.0rc1 и 3.0b2 — раньше 3.0; прочие буквы (8.2p1, 15.1(4)M4) — позже
+PRE_RELEASE = {"a", "alpha", "b", "beta", "c", "pre", "preview", "rc", "dev"}
+
+def load_db(path=DB_FILE):
+    if not os.path.exists(path):
         return []
-    with open(DB_FILE, "r", encoding="utf-8") as f:
+    with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def match_sysdescr(sysdescr):
-    if not sysdescr:
+def _literal_runs(pattern):
+    """Обязательные литеральные куски верхнего уровня регулярки (в нижнем регистре)."""
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except (re.error, OverflowError, RecursionError):
         return []
-    db = load_db()
-    matches = []
-    for e in db:
-        patt = e.get("match_regex")
-        try:
-            if patt and re.search(patt, sysdescr, re.IGNORECASE):
-                matches.append(e)
-        except re.error:
+    runs, cur = [], []
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL:
+            cur.append(chr(arg))
+            continue
+        if op is sre_parse.AT:
+            continue  # ^ $ \b — не разрывают соседние литералы по смыслу, но и не входят в них
+        if cur:
+            runs.append("".join(cur))
+            cur = []
+    if cur:
+        runs.append("".join(cur))
+    return [r.lower() for r in runs]
+
+def pattern_token(pattern):
+    """
+    Литерал, без которого регулярка заведомо не совпадёт: из обязательных кусков берём
+    самый "буквенный" (ESR, MES лучше отбирают записи, чем номер версии), потом самый длинный.
+    None — подходящего нет, регулярку пробуем всегда.
+    """
+    runs = [r for r in _literal_runs(pattern) if len(r) >= TOKEN_MIN_LEN]
+    if not runs:
+        return None
+    return max(runs, key=lambda r: (sum(ch.isalpha() for ch in r), len(r)))
+
+def version_key(version):
+    """
+    Ключ сравнения версий: "3.0.1" → ((3, 3), (3, 0), (3, 1), (1,)); числа сравниваются как числа,
+    буквенные части ("15.1(4)M4") — как строки, нули в конце числовой серии не значимы
+    (3.0 == 3.0.0, 3.0rc1 == 3.0.0rc1). (1,) — конец версии: предрелиз (PRE_RELEASE) меньше
+    него, остальные буквы и числа — больше, так что 3.0rc1 < 3.0 < 3.0p1 < 3.0.1.
+    None — в строке нет ни одной части версии.
+    """
+    raw = _VERSION_PART_RE.findall(str(version or "").lower())
+    if not raw:
+        return None
+    parts = []
+    for p in raw + [None]:
+        if p is not None and p.isdigit():
+            parts.append((3, int(p)))
             continue
-    return matches
+        while parts and parts[-1] == (3, 0):
+            parts.pop()
+        if p is None:
+            parts.append((1,))
+        else:
+            parts.append((0, p) if p in PRE_RELEASE else (2, p))
+    return tuple(parts)
+
+def product_key(name):
+    return " ".join(str(name or "").lower().split())
+
+CPE_ALIASES = nvd_import.load_aliases()
+
+def product_names(name):
+    """
+    Имена, под которыми продукт из сигнатур ищется в базах: само имя и "vendor product"
+    по таблице псевдонимов CPE ("Apache httpd" → "apache http server").
+    """
+    key = product_key(name)
+    names = [key]
+    for vendor, product in CPE_ALIASES.get(key, ()):
+        alias = f"{vendor} {product}"
+        if alias not in names:
+            names.append(alias)
+    return names
+
+def _entry_products(e):
+    """Имена, под которыми структурная запись ищется: "product" и "vendor product"."""
+    product, vendor = product_key(e.get("product")), product_key(e.get("vendor"))
+    keys = {product} if product else set()
+    if vendor and product and not product.startswith(vendor + " "):
+        keys.add(f"{vendor} {product}")
+    return keys
+
+class _VersionIndex:
+    """
+    Интервальный индекс версий одного продукта. Границы всех диапазонов делят ось версий
+    на элементарные куски — сами граничные точки и промежутки между ними; для каждого куска
+    заранее известен список записей, которые его покрывают. Поиск — bisect по точкам, O(log n).
+    """
+
+    def __init__(self, ranges):
+        # ranges: [(n, (start, start_incl), (end, end_incl))], граница None — открыто
+        self.points = sorted({b for _, lo, hi in ranges for b, _ in (lo, hi) if b is not None})
+        pos = {p: i for i, p in enumerate(self.points)}
+        last = 2 * len(self.points)
+        # кусок 2i — промежуток перед points[i], 2i+1 — сама points[i], last — после последней
+        opened = [[] for _ in range(last + 2)]
+        for n, (lo, lo_incl), (hi, hi_incl) in ranges:
+            first = 0 if lo is None else 2 * pos[lo] + (1 if lo_incl else 2)
+            end = last if hi is None else 2 * pos[hi] + (1 if hi_incl else 0)
+            if first <= end:
+                opened[first].append(n)
+                opened[end + 1].append(~n)  # закрытие диапазона после куска end
+        # проход слева направо: у соседних кусков с одинаковым покрытием — общий кортеж
+        self.slots = []
+        active, current = {}, ()  # n -> сколько диапазонов записи покрывают кусок
+        for events in opened[:last + 1]:
+            if events:
+                for n in events:
+                    if n >= 0:
+                        active[n] = active.get(n, 0) + 1
+                    elif active[~n] > 1:
+                        active[~n] -= 1
+                    else:
+                        del active[~n]
+                current = tuple(sorted(active))
+            self.slots.append(current)
+
+    def lookup(self, key):
+        i = bisect_left(self.points, key)
+        return self.slots[2 * i + 1 if i < len(self.points) and self.points[i] == key else 2 * i]
+
+def _entry_ranges(e):
+    """Диапазоны структурной записи: [((start, incl), (end, incl)), ...]; некорректные пропускаются."""
+    out = []
+    for r in e.get("versions") or []:
+        if not isinstance(r, dict):
+            continue
+        if r.get("version") not in (None, "", "*", "-"):
+            k = version_key(r["version"])
+            if k is not None:
+                out.append(((k, True), (k, True)))
+            continue
+        bounds = {f: version_key(r[f]) for f in RANGE_FIELDS if r.get(f) not in (None, "", "*", "-")}
+        if None in bounds.values():
+            continue
+        lo = (bounds["start_including"], True) if "start_including" in bounds else (bounds.get("start_excluding"), False)
+        hi = (bounds["end_including"], True) if "end_including" in bounds else (bounds.get("end_excluding"), False)
+        out.append((lo, hi))
+    return out
+
+def identified_products(sysdescr=None, port_fingerprints=None):
+    """(product, version) устройства: из sysDescr по сигнатурам баннеров и из fingerprint'а портов."""
+    found = []
+    if sysdescr:
+        m = fingerprint.match_banner(sysdescr, "snmp")
+        if m:
+            found.append(m)
+    found += [fp for fp in (port_fingerprints or {}).values() if fp]
+    out = []
+    for fp in found:
+        pair = (fp.get("product"), fp.get("version"))
+        if all(pair) and pair not in out:
+            out.append(pair)
+    return out
+
+class _TokenAutomaton:
+    """Ахо–Корасик по токенам: все токены, встречающиеся в строке, за один проход по ней."""
+
+    def __init__(self, tokens):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for token in tokens:
+            node = 0
+            for ch in token:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] += (token,)
+        # суффиксные ссылки обходом в ширину; выходы наследуются по ним
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if node else 0
+                self.out[nxt] += self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def search(self, text):
+        found = set()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+class NvdStore:
+    """
+    CVE из импортированных фидов NVD (system/nvd_import.py, таблица nvd_ranges).
+    Диапазоны продукта читаются из БД по индексу при первом запросе — под всеми его именами
+    (product_names) — и превращаются в _VersionIndex; кэш сбрасывается, когда после импорта
+    меняется db.get_nvd_stamp().
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._stamp = None
+        self._checked = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked and now - self._checked < NVD_CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            stamp = db.get_nvd_stamp()
+        except sqlite3.Error:
+            stamp = None  # таблиц ещё нет — база не инициализирована
+        if stamp != self._stamp:
+            self._cache = {}
+            self._stamp = stamp
+
+    def _load(self, name):
+        rows = []
+        try:
+            for alias in product_names(name):
+                rows += db.get_nvd_ranges(alias)
+        except sqlite3.Error:
+            rows = []
+        rows.sort(key=lambda r: r[0])  # строки одной CVE — подряд
+        entries, ranges = [], []
+        for cve, severity, desc, vendor, product, *bounds in rows:
+            if not entries or entries[-1]["cve"] != cve:
+                entries.append({"cve": cve, "severity": severity, "desc": desc, "vendor": vendor,
+                                "product": product, "source": "nvd"})
+            for lo, hi in _entry_ranges({"versions": [dict(zip(db.NVD_RANGE_COLUMNS, bounds))]}):
+                ranges.append((len(entries) - 1, lo, hi))
+        return entries, _VersionIndex(ranges)
+
+    def stamp(self):
+        self._refresh()
+        return self._stamp
+
+    def lookup(self, product, key):
+        self._refresh()
+        name = product_key(product)
+        cached = self._cache.get(name)
+        if cached is None:
+            cached = self._cache[name] = self._load(name)
+        entries, index = cached
+        return [entries[n] for n in index.lookup(key)]
+
+class CveMatcher:
+    """
+    Сопоставление устройства с локальной базой CVE (DB_FILE). Записи двух видов:
+
+    - структурные: "vendor", "product" и "versions" — диапазоны затронутых версий
+      (RANGE_FIELDS или {"version": ...}). По каждому продукту строится _VersionIndex;
+      продукт и версия устройства берутся из sysDescr и баннеров (identified_products),
+      поиск — O(log n), и 3.0 не совпадает с 3.0.1;
+    - CVE из фидов NVD в SQLite (NvdStore) — ищутся так же по продукту и версии, после
+      записей файла;
+    - с "match_regex" по sysDescr. Регулярки компилируются один раз, у каждой есть
+      литерал-токен ("token" в записи или pattern_token), все токены ищутся одним проходом
+      автомата Ахо–Корасик, и регулярки пробуются только у записей, чей токен в строке есть.
+      У структурной записи регулярка — запасной путь: она пробуется, только если версия
+      её продукта по sysDescr и баннерам не определилась.
+
+    Файл перечитывается, только если изменились его mtime/размер.
+    """
+
+    def __init__(self, path=DB_FILE, store=None):
+        self.path = path
+        self.store = store
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._index = self._build([])
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def maybe_reload(self):
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            self._index = self._build(load_db(self.path) if stamp else [])
+            self._stamp = stamp
+
+    @staticmethod
+    def _build(entries):
+        """
+        (записи, автомат, {token: [(n, regex), ...]}, [(n, regex)] без токена, {продукт: _VersionIndex},
+        {n: продукты структурной записи}).
+        """
+        by_token, always, ranges, structured = {}, [], {}, {}
+        for n, e in enumerate(entries):
+            if "versions" in e:
+                structured[n] = _entry_products(e)
+                for lo, hi in _entry_ranges(e):
+                    for key in structured[n]:
+                        ranges.setdefault(key, []).append((n, lo, hi))
+            patt = e.get("match_regex")
+            if not patt:
+                continue
+            try:
+                rx = re.compile(patt, re.IGNORECASE)
+            except re.error:
+                continue
+            token = (e.get("token") or "").lower() or pattern_token(patt)
+            if token and len(token) >= TOKEN_MIN_LEN:
+                by_token.setdefault(token, []).append((n, rx))
+            else:
+                always.append((n, rx))
+        products = {key: _VersionIndex(r) for key, r in ranges.items()}
+        return entries, _TokenAutomaton(by_token), by_token, always, products, structured
+
+    def _match(self, sysdescr, products, index):
+        entries, automaton, by_token, always, versions, structured = index
+        hits = {}  # n -> "продукт версия" (None — совпала регулярка)
+        identified = set()  # продукты, версия которых известна
+        for product, version in products:
+            key = version_key(version)
+            if key is None:
+                continue
+            for name in product_names(product):
+                identified.add(name)
+                vi = versions.get(name)
+                if vi is not None:
+                    for n in vi.lookup(key):
+                        hits.setdefault(n, f"{product} {version}")
+        if sysdescr:
+            candidates = list(always)
+            for token in automaton.search(sysdescr.lower()):
+                candidates += by_token[token]
+            for n, rx in candidates:
+                if n in hits or (n in structured and structured[n] & identified):
+                    continue  # версия продукта известна — решает диапазон, а не регулярка
+                if rx.search(sysdescr):
+                    hits[n] = None
+        found = [(entries[n], hits[n]) for n in sorted(hits)]  # порядок — как в базе
+        if self.store is not None:
+            for product, version in products:
+                key = version_key(version)
+                if key is not None:
+                    found += [(e, f"{product} {version}") for e in self.store.lookup(product, key)]
+        out, seen = [], set()
+        for e, matched in found:
+            if e.get("cve") in seen:
+                continue  # одна CVE — один раз, запись локальной базы важнее
+            seen.add(e.get("cve"))
+            e = dict(e)
+            if matched:
+                e["matched"] = matched
+            out.append(e)
+        return out
+
+    def stamp(self):
+        """Версия базы (файл + импорт NVD): меняется, когда результаты сопоставления могут измениться."""
+        self.maybe_reload()
+        return self._stamp, self.store.stamp() if self.store is not None else None
+
+    def match(self, sysdescr, port_fingerprints=None):
+        products = identified_products(sysdescr, port_fingerprints)
+        if not sysdescr and not products:
+            return []
+        self.maybe_reload()
+        return self._match(sysdescr, products, self._index)
+
+    def match_many(self, sysdescrs):
+        """Пачка строк: список результатов в том же порядке; одинаковые строки сопоставляются один раз."""
+        self.maybe_reload()
+        index = self._index
+        cache = {}
+        out = []
+        for s in sysdescrs:
+            if not s:
+                out.append([])
+                continue
+            if s not in cache:
+                cache[s] = self._match(s, identified_products(s), index)
+            out.append([dict(e) for e in cache[s]])
+        return out
+
+MATCHER = CveMatcher(store=NvdStore())
+
+class MatchCache:
+    """
+    Сопоставления на один прогон скана. Каждая различная строка — sysDescr или продукт с версией
+    из баннера сервиса ("OpenSSH 8.2") — сопоставляется с базой один раз, результат делят все
+    хосты, где она встретилась: на парке одинаковых устройств стоимость зависит от числа
+    различных прошивок, а не хостов.
+    """
+
+    def __init__(self, matcher=None):
+        self.matcher = matcher or MATCHER
+        self._results = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def _get(self, key, compute):
+        with self._lock:
+            found = self._results.get(key)
+            if found is not None:
+                self.hits += 1
+                return found
+        found = compute()  # вне блокировки: одинаковую строку могут посчитать дважды — не страшно
+        with self._lock:
+            return self._results.setdefault(key, found)
+
+    def match_device(self, sysdescr, port_fingerprints=None):
+        """Как match_device(), но через кэш прогона."""
+        found = []
+        if sysdescr:
+            found += self._get(("sysdescr", sysdescr), lambda: self.matcher.match(sysdescr))
+        for product, version in identified_products(None, port_fingerprints):
+            found += self._get(("product", product, version), lambda: self.matcher.match(None, {0: {
+                "product": product, "version": version}}))
+        out, seen = [], set()
+        for e in found:
+            if e.get("cve") not in seen:
+                seen.add(e.get("cve"))
+                out.append(dict(e))
+        return out
+
+    def stats(self):
+        """{"distinct": различных строк сопоставлено, "reused": сколько раз взят готовый результат}."""
+        return {"distinct": len(self._results), "reused": self.hits}
+
+def match_sysdescr(sysdescr):
+    return MATCHER.match(sysdescr)
+
+def match_device(sysdescr, port_fingerprints=None):
+    """CVE устройства по sysDescr и версиям сервисов из fingerprint'а портов."""
+    return MATCHER.match(sysdescr, port_fingerprints)
+
+def match_many(sysdescrs):
+    return MATCHER.match_many(sysdescrs)
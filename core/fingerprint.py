@@ -0,0 +1,281 @@
+# core/fingerprint.py — второй этап скана: сервисы и версии на уже найденных открытых TCP-портах
+#
+# Connect-скан (portscanner.scan_host) ничего не отправляет и не ждёт баннеров.
+# Здесь по каждому открытому порту делается одна-две протокольные пробы, а ответ
+# сопоставляется с сигнатурами из data/service_signatures.json.
+import asyncio
+import contextlib
+import json
+import os
+import re
+
+SIG_FILE = os.path.join("data", "service_signatures.json")
+
+FP_TIMEOUT = 2.0        # сек на одну пробу (connect + чтение)
+FP_GREETING_WAIT = 1.0  # сколько ждать приветствия на неизвестном порту, прежде чем пробовать HTTP
+FP_CONCURRENCY = 32     # одновременных проб на хост
+FP_READ_BYTES = 4096
+BANNER_MAX_LEN = 1024
+
+# Сервер сам присылает приветствие — достаточно прочитать
+GREETING_PORTS = {21: "ftp", 22: "ssh", 23: "telnet", 25: "smtp", 110: "pop3", 143: "imap", 587: "smtp", 3306: "mysql"}
+
+# Веб-интерфейсы: сразу шлём HTTP-запрос
+HTTP_PORTS = {80, 81, 591, 5000, 5001, 7547, 8000, 8008, 8080, 8081, 8088, 8888, 9000}
+
+# Порты, где ожидается TLS: открытым текстом их не трогаем, сертификат смотрит модуль tls
+TLS_PORTS = {443: "https", 465: "smtps", 636: "ldaps", 853: "domain-s", 990: "ftps", 993: "imaps", 995: "pop3s",
+             4443: "https", 8443: "https"}
+
+_HTTP_PROBE = "GET / HTTP/1.0\r\nHost: {host}\r\nUser-Agent: eltex-audit\r\nConnection: close\r\n\r\n"
+
+# Telnet: IAC-последовательности согласования опций
+_IAC, _DONT, _DO, _WONT, _WILL, _SB, _SE = 255, 254, 253, 252, 251, 250, 240
+
+_TITLE_RE = re.compile(r"<title[^>]*>([^<]{0,200})</title>", re.I)
+
+
+def load_signatures():
+    if not os.path.exists(SIG_FILE):
+        return []
+    with open(SIG_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compile_signatures(sigs):
+    """
+    Индекс сигнатур: {service: [(token, regex, sig), ...]}, "*" — для любого сервиса.
+    token — литерал в нижнем регистре: регулярку пробуем, только если он есть в баннере.
+    """
+    index = {}
+    for sig in sigs:
+        try:
+            rx = re.compile(sig["pattern"], re.I)
+        except (KeyError, re.error):
+            continue
+        token = (sig.get("token") or "").lower()
+        index.setdefault(sig.get("service", "*"), []).append((token, rx, sig))
+    return index
+
+
+SIGNATURES = compile_signatures(load_signatures())
+
+
+def _group(m, ref):
+    """Поле сигнатуры: номер группы регулярки или готовое значение."""
+    if isinstance(ref, int) and not isinstance(ref, bool):
+        try:
+            return (m.group(ref) or "").strip() or None
+        except IndexError:
+            return None
+    return ref
+
+
+def match_banner(banner, service=None, index=None):
+    """
+    Сопоставляет баннер с сигнатурами: сначала сигнатуры устройств ("*"), затем сервиса.
+    Возвращает {"product", "version", "model", "firmware"} (только найденные поля) или None.
+    """
+    if not banner:
+        return None
+    index = SIGNATURES if index is None else index
+    low = banner.lower()
+    result = {}
+    for key in ("*", service):
+        for token, rx, sig in index.get(key, []) if key else []:
+            if token and token not in low:
+                continue
+            m = rx.search(banner)
+            if not m:
+                continue
+            for field in ("product", "version", "model"):
+                if field in sig and not result.get(field):
+                    value = _group(m, sig[field])
+                    if value:
+                        result[field] = value
+            if sig.get("firmware") and result.get("version"):
+                result["firmware"] = True
+            if key != "*":
+                break  # для сервиса хватает первой (самой специфичной) сигнатуры
+    return result or None
+
+
+def _strip_telnet(data):
+    """Убирает из потока telnet IAC-последовательности."""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        b = data[i]
+        if b != _IAC:
+            out.append(b)
+            i += 1
+            continue
+        cmd = data[i + 1] if i + 1 < len(data) else None
+        if cmd in (_DO, _DONT, _WILL, _WONT):
+            i += 3
+        elif cmd == _SB:
+            end = data.find(bytes([_IAC, _SE]), i)
+            i = len(data) if end < 0 else end + 2
+        else:
+            i += 2
+    return bytes(out)
+
+
+def _telnet_refusals(data):
+    """На каждое DO/WILL сервера отвечаем WONT/DONT, чтобы он перешёл к приглашению."""
+    out = bytearray()
+    for i in range(len(data) - 2):
+        if data[i] == _IAC and data[i + 1] in (_DO, _WILL):
+            out += bytes([_IAC, _WONT if data[i + 1] == _DO else _DONT, data[i + 2]])
+    return bytes(out)
+
+
+async def _exchange(ip, port, payload, timeout, budget=None, governor=None):
+    """
+    Одна TCP-сессия: connect, (опционально) отправка payload, чтение до FP_READ_BYTES
+    или до истечения timeout. Возвращает полученные байты (b"" — сервис промолчал).
+    """
+    if governor is not None:
+        await governor.acquire_async(ip)
+    if budget is not None:
+        await budget.acquire_async()
+    writer = None
+    data = b""
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        if payload:
+            writer.write(payload)
+            await writer.drain()
+        negotiated = 0
+        while len(data) < FP_READ_BYTES:
+            left = deadline - loop.time()
+            if left <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.read(FP_READ_BYTES - len(data)), left)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            data += chunk
+            # telnet: пока сервер только согласовывает опции — отказываемся и читаем дальше
+            if chunk[:1] == bytes([_IAC]) and negotiated < 3:
+                negotiated += 1
+                writer.write(_telnet_refusals(chunk))
+                await writer.drain()
+                continue
+            if not payload and _strip_telnet(data).strip():
+                break  # приветствие получено — больше не ждём
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+        if budget is not None:
+            budget.release()
+    return data
+
+
+def _classify(port, data):
+    """Определяет сервис по первым байтам ответа (с поправкой на порт)."""
+    if data[:4] == b"SSH-":
+        return "ssh"
+    if data[:5] == b"HTTP/":
+        return "http"
+    if data[:1] in (b"\x15", b"\x16") and data[1:2] == b"\x03":
+        return "tls"  # TLS alert/handshake в ответ на открытый текст
+    if data[:1] == bytes([_IAC]):
+        return "telnet"
+    if data[:3] == b"220":
+        return "smtp" if b"SMTP" in data[:200].upper() or GREETING_PORTS.get(port) == "smtp" else "ftp"
+    if data[:3] == b"+OK":
+        return "pop3"
+    if data[:4] == b"* OK":
+        return "imap"
+    if len(data) > 5 and data[4] == 0x0A and port == 3306:
+        return "mysql"
+    return GREETING_PORTS.get(port) or ("http" if port in HTTP_PORTS else "unknown")
+
+
+def _banner_text(service, data):
+    """Текст баннера для отчёта: у HTTP — заголовки и <title>, у telnet — без IAC."""
+    if service == "telnet":
+        data = _strip_telnet(data)
+    text = data.decode(errors="ignore")
+    if service == "http":
+        head, _, body = text.partition("\r\n\r\n")
+        m = _TITLE_RE.search(body)
+        text = head + (f"\r\n<title>{m.group(1).strip()}</title>" if m else "")
+    return text[:BANNER_MAX_LEN]
+
+
+async def async_fingerprint_port(ip, port, timeout=FP_TIMEOUT, budget=None, governor=None):
+    """
+    Определяет сервис на открытом TCP-порту. Возвращает
+      {"banner", "service", ["tls"], ["product"], ["version"], ["model"], ["firmware"]}
+    """
+    if port in TLS_PORTS:
+        return {"banner": "", "service": TLS_PORTS[port], "tls": True}
+
+    http_probe = _HTTP_PROBE.format(host=ip).encode()
+    if port in HTTP_PORTS:
+        data = await _exchange(ip, port, http_probe, timeout, budget, governor)
+    else:
+        wait = timeout if port in GREETING_PORTS else min(timeout, FP_GREETING_WAIT)
+        data = await _exchange(ip, port, None, wait, budget, governor)
+        if not data and port not in GREETING_PORTS:
+            # молчит — возможно, веб-интерфейс на нестандартном порту
+            data = await _exchange(ip, port, http_probe, timeout, budget, governor)
+
+    service = _classify(port, data)
+    fp = {"banner": _banner_text(service, data), "service": service}
+    if service == "tls" or (service == "http" and b"HTTPS port" in data):
+        fp["tls"] = True
+    match = match_banner(fp["banner"], service)
+    if match:
+        fp.update(match)
+    return fp
+
+
+async def async_fingerprint_host(ip, ports, timeout=FP_TIMEOUT, concurrency=FP_CONCURRENCY, budget=None,
+                                 governor=None):
+    """Проверяет список открытых портов хоста. Возвращает {port: fingerprint}."""
+    ports = list(ports)
+    result = {}
+    it = iter(ports)
+
+    async def worker():
+        for p in it:
+            result[p] = await async_fingerprint_port(ip, p, timeout=timeout, budget=budget, governor=governor)
+
+    await asyncio.gather(*(worker() for _ in range(min(len(ports), max(1, concurrency)))))
+    return result
+
+
+def fingerprint_host(ip, ports, timeout=FP_TIMEOUT, concurrency=FP_CONCURRENCY, budget=None, governor=None):
+    """Синхронная обёртка над async_fingerprint_host."""
+    if not ports:
+        return {}
+    return asyncio.run(async_fingerprint_host(
+        ip, ports, timeout=timeout, concurrency=concurrency, budget=budget, governor=governor,
+    ))
+
+
+def device_identity(port_fingerprints, snmp_sysdescr=None):
+    """
+    Модель и версия прошивки устройства по результатам fingerprint'а и sysDescr.
+    В fw_version идут только версии сигнатур с "firmware": true (не версия OpenSSH и т.п.).
+    Возвращает (model, fw_version); неизвестное — None.
+    """
+    matches = [fp for fp in (port_fingerprints or {}).values() if fp]
+    if snmp_sysdescr:
+        m = match_banner(snmp_sysdescr, "snmp")
+        if m:
+            matches.insert(0, m)  # sysDescr — самый надёжный источник
+    model = next((m["model"] for m in matches if m.get("model")), None)
+    fw_version = next((m["version"] for m in matches if m.get("firmware") and m.get("version")), None)
+    return model, fw_version
@@ -1,5 +1,16 @@
 import json, os, re
 MAP_FILE = os.path.join("data", "mitre_mappings.json")
+RULES_FILE = os.path.join("data", "mitre_rules.json")
+
+# Правила — декларативные условия из RULES_FILE: {"имя": условие}. Условие — объект с одним ключом:
+#   {"tcp": [23, 2323]}                        открыт любой из TCP-портов
+#   {"udp": {"ports": [123], "service": "ntp", "info": "monlist"}}
+#                                              UDP-порт open, сервис (и флаг в разборе пробы) совпали
+#   {"banner": "eltex|firmware"}               регулярка (без учёта регистра) по баннеру любого TCP-порта
+#   {"open_ports": {"min": 21}}                число открытых TCP-портов в пределах min/max
+#   {"snmp": "sysdescr" | "community"}         есть sysDescr / ответ на стандартную community
+#   {"cve": {"severity": ["HIGH"]}}            есть CVE (с указанной важностью; {} — любая)
+#   {"all": [...]}, {"any": [...]}, {"not": {...}}
 
 def load_mappings():
     if not os.path.exists(MAP_FILE):
@@ -7,41 +18,195 @@ def load_mappings():
     with open(MAP_FILE, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def load_rules():
+    if not os.path.exists(RULES_FILE):
+        return {}
+    with open(RULES_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _atom(kind, arg):
+    """Нормализованный атом условия (хешируемый — одинаковые атомы разных правил считаются один раз)."""
+    if kind == "tcp":
+        return "tcp", tuple(sorted(int(p) for p in arg))
+    if kind == "udp":
+        return "udp", tuple(sorted(int(p) for p in arg.get("ports", []))), arg.get("service"), arg.get("info")
+    if kind == "banner":
+        re.compile(arg)
+        return "banner", arg
+    if kind == "open_ports":
+        return "open_ports", arg.get("min"), arg.get("max")
+    if kind == "snmp":
+        if arg not in ("sysdescr", "community"):
+            raise ValueError(f"snmp: {arg}")
+        return "snmp", arg
+    if kind == "cve":
+        return "cve", tuple(sorted(s.upper() for s in arg.get("severity") or []))
+    raise ValueError(f"неизвестное условие: {kind}")
+
+def _compile(cond, atoms):
+    """Условие → дерево ("atom", i) / ("all"|"any", [...]) / ("not", x); atoms — общий список атомов плана."""
+    if not isinstance(cond, dict) or len(cond) != 1:
+        raise ValueError(f"условие должно быть объектом с одним ключом: {cond}")
+    (kind, arg), = cond.items()
+    if kind in ("all", "any"):
+        return kind, [_compile(c, atoms) for c in arg]
+    if kind == "not":
+        return "not", _compile(arg, atoms)
+    atom = _atom(kind, arg)
+    if atom not in atoms:
+        atoms.append(atom)
+    return "atom", atoms.index(atom)
+
+class RulePlan:
+    """
+    План проверок, скомпилированный один раз из правил и маппингов MITRE.
+
+    evaluate(records) проверяет пачку хостов (например, весь скан) по столбцам: каждый атом
+    условий — одно множество хостов (битовая маска по номерам записей), атомы считаются один
+    раз на пачку, регулярка баннера — один раз на различный баннер, а правила — логикой
+    над масками. undefined — правила, на которые ссылаются маппинги, но которых нет
+    в RULES_FILE; errors — правила с ошибкой в описании.
+    """
+
+    def __init__(self, mappings, rules):
+        self.mappings = mappings
+        self.atoms = []
+        self.rules = {}
+        self.errors = {}
+        for name, cond in rules.items():
+            try:
+                self.rules[name] = _compile(cond, self.atoms)
+            except (ValueError, TypeError, AttributeError, re.error) as e:
+                self.errors[name] = str(e)
+        self.regexes = {a[1]: re.compile(a[1], re.I) for a in self.atoms if a[0] == "banner"}
+        referenced = []
+        for m in mappings:
+            for rule in m.get("detection_rules", []):
+                if rule not in referenced:
+                    referenced.append(rule)
+        self.undefined = [r for r in referenced if r not in self.rules and r not in self.errors]
+        # в порядке маппингов: (техника, имя техники, правило) — только определённые правила
+        self.checks = [(m.get("id"), m.get("name"), rule)
+                       for m in mappings for rule in m.get("detection_rules", []) if rule in self.rules]
+
+    def _columns(self, records):
+        """Маска хостов по каждому атому."""
+        cols = [[] for _ in self.atoms]
+        matched = {}  # (регулярка, баннер) -> bool
+        for i, rec in enumerate(records):
+            tcp = {int(p): v or {} for p, v in (rec.get("ports") or {}).items()}
+            udp = {int(p): v or {} for p, v in (rec.get("udp_ports") or {}).items()}
+            cves = rec.get("cve_matches") or []
+            for a, atom in enumerate(self.atoms):
+                kind = atom[0]
+                if kind == "tcp":
+                    hit = any(p in tcp for p in atom[1])
+                elif kind == "udp":
+                    hit = False
+                    for p in atom[1]:
+                        v = udp.get(p)
+                        if (v and v.get("state") == "open" and (atom[2] is None or v.get("service") == atom[2])
+                                and (atom[3] is None or (v.get("info") or {}).get(atom[3]))):
+                            hit = True
+                            break
+                elif kind == "banner":
+                    hit = False
+                    for v in tcp.values():
+                        b = v.get("banner") or ""
+                        key = (atom[1], b)
+                        if key not in matched:
+                            matched[key] = bool(b) and self.regexes[atom[1]].search(b) is not None
+                        if matched[key]:
+                            hit = True
+                            break
+                elif kind == "open_ports":
+                    n = len(tcp)
+                    hit = (atom[1] is None or n >= atom[1]) and (atom[2] is None or n <= atom[2])
+                elif kind == "snmp":
+                    hit = bool(rec.get("snmp") if atom[1] == "sysdescr" else rec.get("snmp_community"))
+                else:  # cve
+                    hit = any(not atom[1] or (c.get("severity") or "").upper() in atom[1] for c in cves)
+                if hit:
+                    cols[a].append(i)
+        return [_mask(c) for c in cols]
+
+    def _eval(self, node, cols, full):
+        op, arg = node
+        if op == "atom":
+            return cols[arg]
+        if op == "not":
+            return full ^ self._eval(arg, cols, full)
+        out = full if op == "all" else 0
+        for n in arg:
+            out = out & self._eval(n, cols, full) if op == "all" else out | self._eval(n, cols, full)
+        return out
+
+    def evaluate(self, records):
+        """Находки по каждой записи: [[{"technique_id", "technique_name", "rule", "confidence"}, ...], ...]."""
+        records = list(records)
+        out = [[] for _ in records]
+        if not records or not self.checks:
+            return out
+        cols = self._columns(records)
+        full = (1 << len(records)) - 1
+        masks = {}
+        for tid, tname, rule in self.checks:
+            if rule not in masks:
+                masks[rule] = self._eval(self.rules[rule], cols, full)
+            for i in _members(masks[rule]):
+                out[i].append({"technique_id": tid, "technique_name": tname, "rule": rule, "confidence": "medium"})
+        return out
+
+def _mask(indexes):
+    if not indexes:
+        return 0
+    bits = bytearray(indexes[-1] // 8 + 1)
+    for i in indexes:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+def _members(mask):
+    i = 0
+    for byte in mask.to_bytes((mask.bit_length() + 7) // 8, "little"):
+        if byte:
+            for j in range(8):
+                if byte >> j & 1:
+                    yield i + j
+        i += 8
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _stamps():
+    return _file_stamp(MAP_FILE), _file_stamp(RULES_FILE)
+
 MAPPINGS = load_mappings()
+PLAN = RulePlan(MAPPINGS, load_rules())
+_stamp = _stamps()
 
-def _rule_ssh_open(rec): return 22 in rec.get("ports", {})
-def _rule_http_open(rec): return 80 in rec.get("ports", {}) or 443 in rec.get("ports", {})
-def _rule_snmp_sysdescr(rec): return bool(rec.get("snmp"))
-def _rule_telnet_open(rec): return 23 in rec.get("ports", {})
-def _rule_http_fw(rec):
-    for v in rec.get("ports", {}).values():
-        b = v.get("banner", "")
-        if re.search(r"eltex|firmware|version", b, re.I):
-            return True
-    return False
-def _rule_known_cve(rec): return bool(rec.get("cve_matches"))
-
-RULES = {
-    "snmp_sysdescr": _rule_snmp_sysdescr,
-    "telnet_open": _rule_telnet_open,
-    "http_fw": _rule_http_fw,
-    "known_cve": _rule_known_cve,
-    "ssh_open": _rule_ssh_open,
-    "http_open": _rule_http_open
-}
+def maybe_reload():
+    """Перечитывает маппинги и правила, если изменились их mtime/размер. Возвращает версию правил."""
+    global MAPPINGS, PLAN, _stamp
+    stamp = _stamps()
+    if stamp != _stamp:
+        MAPPINGS = load_mappings()
+        PLAN = RulePlan(MAPPINGS, load_rules())
+        _stamp = stamp
+    return stamp
 
+def rule_problems():
+    """{"undefined": [правила без описания], "errors": {правило: ошибка}} — для лога перед сканом."""
+    maybe_reload()
+    return {"undefined": list(PLAN.undefined), "errors": dict(PLAN.errors)}
 
-def run_mitre_checks(record):
-    findings = []
-    for m in MAPPINGS:
-        for rule in m.get("detection_rules", []):
-            fn = RULES.get(rule)
-            if fn and fn(record):
-                findings.append({
-                    "technique_id": m.get("id"),
-                    "technique_name": m.get("name"),
-                    "rule": rule,
-                    "confidence": "medium"
-                })
-    return findings
+def run_mitre_checks_batch(records):
+    """Проверка пачки записей хостов (весь скан) за один проход плана."""
+    maybe_reload()
+    return PLAN.evaluate(records)
 
+def run_mitre_checks(record):
+    return run_mitre_checks_batch([record])[0]
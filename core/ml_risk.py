@@ -5,7 +5,7 @@ def heuristic_score(features: dict) -> int:
     Простая эвристическая модель оценки риска.
     features:
       open_ports_count  — количество открытых портов
-      snmp_public       — открыт SNMP с public
+      snmp_public       — SNMP отвечает на стандартную community (public, private, ...)
       telnet_open       — открыт Telnet
       has_cve_high      — есть высокие CVE
       default_creds     — используются дефолтные учётные данные
@@ -1,58 +1,715 @@
 # core/portscanner.py — портсканер с поддержкой TCP (quick/special/full) и базового UDP-сканирования
+import asyncio
+import contextlib
+import errno
+import ipaddress
+import itertools
+import select
 import socket
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import struct
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
-# Предустановленные "специальные" TCP-порты
-SPECIAL_PORTS = [21, 22, 23, 25, 80, 110, 143, 443, 993, 995, 3306, 3389, 8080, 8443]
-
-# Набор интересных UDP-портов, которые сканируем по умолчанию
-UDP_SPECIAL_PORTS = [53, 67, 69, 123, 161, 500, 1900, 1194]
+from core import snmp_pdu
 
+PORT_MIN = 1
+PORT_MAX = 65535
 
 
-def parse_ports_from_string(s):
+class PortSet:
     """
-    Парсит строку вида "22,80,1000-1010" → список уникальных портов (ints).
-    Возвращает пустой список при ошибке/пустой строке.
+    Компактное множество портов: отсортированный список непересекающихся диапазонов
+    [(start, end), ...] (end включительно). "1-65535" — один кортеж, а не 65535 int'ов.
+
+    Объединение/пересечение/разность — слиянием диапазонов за O(диапазонов),
+    проверка "p in ports" — бинарным поиском. Итерация — по возрастанию, len() — число портов.
+    Объекты неизменяемы, их можно безопасно делить между потоками и хостами.
     """
-    if not s:
-        return []
-    out = set()
-    parts = s.split(",")
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-        if "-" in part:
-            try:
-                start, end = part.split("-", 1)
-                start = int(start.strip())
-                end = int(end.strip())
-                if end < start:
-                    start, end = end, start
-                for p in range(start, end + 1):
-                    if 1 <= p <= 65535:
-                        out.add(p)
-            except ValueError:
-                continue
+
+    __slots__ = ("_starts", "_ends", "_len")
+
+    def __init__(self, ports=()):
+        if isinstance(ports, PortSet):
+            ranges = ports.ranges()
         else:
+            ranges = ((p, p) for p in ports)
+        self._set_ranges(ranges)
+
+    def _set_ranges(self, ranges):
+        starts, ends = [], []
+        for start, end in sorted((int(a), int(b)) for a, b in ranges):
+            start, end = max(start, PORT_MIN), min(end, PORT_MAX)
+            if start > end:
+                continue
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._starts = starts
+        self._ends = ends
+        self._len = sum(e - s + 1 for s, e in zip(starts, ends))
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Множество из диапазонов [(start, end), ...]; пересекающиеся и смежные сливаются."""
+        obj = cls.__new__(cls)
+        obj._set_ranges(ranges)
+        return obj
+
+    @classmethod
+    def full(cls):
+        return cls.from_ranges([(PORT_MIN, PORT_MAX)])
+
+    @classmethod
+    def parse(cls, s):
+        """
+        Строка вида "22,80,1000-1010" → PortSet. Некорректные элементы пропускаются,
+        порты вне 1..65535 отбрасываются.
+        """
+        ranges = []
+        for part in (s or "").split(","):
+            part = part.strip()
+            if not part:
+                continue
             try:
-                p = int(part)
-                if 1 <= p <= 65535:
-                    out.add(p)
+                if "-" in part:
+                    start, end = part.split("-", 1)
+                    start, end = int(start.strip()), int(end.strip())
+                    if end < start:
+                        start, end = end, start
+                else:
+                    start = end = int(part)
             except ValueError:
                 continue
-    return sorted(out)
+            ranges.append((start, end))
+        return cls.from_ranges(ranges)
+
+    def ranges(self):
+        return list(zip(self._starts, self._ends))
+
+    def to_spec(self):
+        """Обратное к parse: "22,80,1000-1010"."""
+        return ",".join(str(s) if s == e else f"{s}-{e}" for s, e in zip(self._starts, self._ends))
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        for s, e in zip(self._starts, self._ends):
+            yield from range(s, e + 1)
+
+    def __contains__(self, port):
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            return False
+        i = bisect_right(self._starts, port) - 1
+        return i >= 0 and port <= self._ends[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, PortSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    def __hash__(self):
+        return hash((tuple(self._starts), tuple(self._ends)))
+
+    def __repr__(self):
+        return f"PortSet({self.to_spec()!r})"
+
+    @staticmethod
+    def _coerce(other):
+        return other if isinstance(other, PortSet) else PortSet(other)
+
+    def union(self, other):
+        return PortSet.from_ranges(self.ranges() + self._coerce(other).ranges())
+
+    def intersection(self, other):
+        a, b = self.ranges(), self._coerce(other).ranges()
+        out = []
+        i = j = 0
+        while i < len(a) and j < len(b):
+            start, end = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+            if start <= end:
+                out.append((start, end))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return PortSet.from_ranges(out)
+
+    def difference(self, other):
+        b = self._coerce(other).ranges()
+        out = []
+        j = 0
+        for start, end in self.ranges():
+            while j < len(b) and b[j][1] < start:
+                j += 1
+            k = j
+            while k < len(b) and b[k][0] <= end:
+                if b[k][0] > start:
+                    out.append((start, b[k][0] - 1))
+                start = max(start, b[k][1] + 1)
+                k += 1
+            if start <= end:
+                out.append((start, end))
+        return PortSet.from_ranges(out)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+class PortOrder:
+    """
+    Порты множества ports в порядке убывания вероятности: сначала те из preferred,
+    что входят в ports, затем остальные по возрастанию. Список на все порты не строится —
+    full-скан в таком порядке занимает в памяти только голову preferred.
+    """
+
+    __slots__ = ("ports", "head")
+
+    def __init__(self, ports, preferred=()):
+        self.ports = ports if isinstance(ports, PortSet) else PortSet(ports)
+        self.head = [p for p in dict.fromkeys(preferred) if p in self.ports]
+
+    def __len__(self):
+        return len(self.ports)
+
+    def __bool__(self):
+        return bool(self.ports)
+
+    def __iter__(self):
+        yield from self.head
+        yield from self.ports - PortSet(self.head)
+
+    def __contains__(self, port):
+        return port in self.ports
+
+    def to_spec(self):
+        return self.ports.to_spec()
+
+
+# Предустановленные "специальные" TCP-порты
+SPECIAL_PORTS = PortSet([21, 22, 23, 25, 80, 110, 143, 443, 993, 995, 3306, 3389, 8080, 8443])
+
+# Набор интересных UDP-портов, которые сканируем по умолчанию
+UDP_SPECIAL_PORTS = PortSet([53, 67, 69, 123, 161, 500, 1900, 1194])
+
+# Встроенный порядок TCP-портов по убыванию частоты (по мотивам статистики nmap-services
+# с поднятыми портами управления сетевым оборудованием). Для режима top:N его дополняет
+# статистика наших собственных сканов из БД (см. python_scanner.history_port_order).
+TOP_TCP_PORTS = [
+    80, 23, 443, 22, 21, 8080, 161, 25, 3389, 110, 445, 139, 143, 53, 135, 3306, 8443, 1723, 111, 995,
+    993, 5900, 8291, 830, 2222, 7547, 8000, 8888, 8081, 587, 199, 1720, 465, 548, 113, 81, 6001, 10000,
+    514, 5060, 179, 1025, 1026, 2000, 8008, 32768, 554, 26, 1433, 49152, 2001, 515, 49154, 1027, 5666,
+    646, 5000, 5631, 631, 49153, 2049, 88, 79, 5800, 106, 2121, 1110, 49155, 6000, 513, 990, 5357,
+    427, 49156, 543, 544, 5101, 144, 7, 389, 8728, 8729, 4786, 9100, 5001, 8088, 9000, 3000, 5432,
+    1521, 6379, 27017, 11211, 1883, 8883, 502, 102, 20000, 47808, 1900, 4443, 853, 636, 2323, 37777,
+    49157, 5009, 873, 1028, 1029, 1755, 2717, 3128, 3986, 4899, 5051, 5190, 6646, 7070, 8009, 9999,
+]
+
+# Режим top:N — N самых частых портов (см. top_ports)
+TOP_MODE_PREFIX = "top:"
+
+# Движки TCP-сканирования: пул потоков (исторический) и неблокирующие сокеты + asyncio
+ENGINES = ("threads", "asyncio")
+
+# Сколько connect'ов держим "в полёте" одновременно в asyncio-движке
+ASYNC_CONCURRENCY = 2000
+
+# Запас дескрипторов под файлы/БД/прочие сокеты процесса
+FD_RESERVE = 64
+
+# Порты для быстрой проверки "живости" хоста: любой SYN-ACK или RST означает, что хост жив
+DISCOVERY_PORTS = [22, 23, 80, 443, 8080]
+
+
+class SocketBudget:
+    """
+    Общий на весь прогон лимит одновременно открытых сокетов/проб (TCP, UDP, SNMP, TLS).
+
+    Работает и из потоков, и из корутин: при параллельном скане нескольких хостов у каждого
+    может быть свой поток и свой event loop, поэтому в основе — threading.BoundedSemaphore.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self._sem = threading.BoundedSemaphore(self.limit)
+
+    def acquire(self):
+        self._sem.acquire()
+
+    def release(self):
+        self._sem.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def acquire_async(self):
+        # не блокируем event loop: опрашиваем семафор с нарастающей паузой
+        delay = 0.001
+        while not self._sem.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+
+# Ограничение темпа проб (в пробах/пакетах в секунду). Слишком быстрый скан перегружает
+# control plane небольших коммутаторов и conntrack межсетевых экранов по пути: пакеты молча
+# теряются, и открытые порты уходят в "filtered". None — без ограничения.
+RATE_GLOBAL = 5000
+RATE_SUBNET = 1500
+RATE_HOST = 300
+RATE_SUBNET_PREFIX = 24
+RATE_BURST = 0.1      # допустимый всплеск — столько секунд трафика на полной скорости
+
+
+class _Gcra:
+    """Одно "ведро" в форме GCRA: tat — теоретическое время прихода следующей пробы."""
+
+    __slots__ = ("interval", "tau", "tat")
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.tau = self.interval * max(0.0, rate * burst - 1)
+        self.tat = 0.0
+
+
+class RateGovernor:
+    """
+    Общий на прогон ограничитель темпа проб (token bucket): лимиты на весь прогон,
+    на подсеть (/subnet_prefix) и на хост. Проба (TCP connect, UDP-пакет, SNMP- или TLS-запрос)
+    стоит по токену в каждом из трёх вёдер и уходит, когда токен есть во всех.
+
+    Потокобезопасен; acquire() ждёт в потоке, acquire_async() — в event loop,
+    try_acquire() не ждёт вовсе (для циклов, которым есть чем заняться в паузе).
+    """
+
+    def __init__(self, global_rate=RATE_GLOBAL, subnet_rate=RATE_SUBNET, host_rate=RATE_HOST,
+                 subnet_prefix=RATE_SUBNET_PREFIX, burst=RATE_BURST):
+        self.global_rate = global_rate or None
+        self.subnet_rate = subnet_rate or None
+        self.host_rate = host_rate or None
+        self.subnet_prefix = subnet_prefix
+        self.burst = burst
+        self._global = _Gcra(global_rate, burst) if self.global_rate else None
+        self._subnets = {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def limits(self):
+        return {
+            "global": self.global_rate,
+            "subnet": self.subnet_rate,
+            "host": self.host_rate,
+            "subnet_prefix": self.subnet_prefix,
+        }
+
+    def _subnet_key(self, ip):
+        try:
+            return int(ipaddress.IPv4Address(ip)) >> (32 - self.subnet_prefix)
+        except ValueError:
+            return ip
+
+    def _bucket(self, table, key, rate, now):
+        b = table.get(key)
+        if b is None:
+            if len(table) >= 4096:
+                # простаивающие вёдра ничем не отличаются от новых — выбрасываем
+                for k in [k for k, v in table.items() if v.tat <= now]:
+                    del table[k]
+            b = table[key] = _Gcra(rate, self.burst)
+        return b
+
+    def _reserve(self, ip, commit):
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            if self._global:
+                buckets.append(self._global)
+            if self.subnet_rate:
+                buckets.append(self._bucket(self._subnets, self._subnet_key(ip), self.subnet_rate, now))
+            if self.host_rate:
+                buckets.append(self._bucket(self._hosts, ip, self.host_rate, now))
+            at = max([now] + [b.tat - b.tau for b in buckets])
+            if at > now and not commit:
+                return at - now
+            for b in buckets:
+                b.tat = max(b.tat, at) + b.interval
+            return at - now
+
+    def try_acquire(self, ip):
+        """Забирает токен, если он есть сейчас (→ 0.0); иначе — сколько секунд ждать (токен не занят)."""
+        return self._reserve(ip, commit=False)
+
+    def acquire(self, ip):
+        delay = self._reserve(ip, commit=True)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, ip):
+        delay = self._reserve(ip, commit=True)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _pace(governor, ip):
+    if governor is not None:
+        governor.acquire(ip)
+
+
+# Адаптивные таймауты connect'а по мотивам TCP RTO (RFC 6298): SRTT/RTTVAR по первым ответам хоста
+RTT_INITIAL_TIMEOUT = 1.0   # пока ответов нет
+RTT_MIN_TIMEOUT = 0.05      # нижняя граница: даже в LAN не опускаемся ниже 50 мс
+RTT_MAX_TIMEOUT = 3.0       # верхняя граница для медленных WAN-линков
+RTT_GRANULARITY = 0.01
+
+# UDP-скан с одного сокета: ICMP-ошибки читаем из очереди ошибок сокета (Linux, IP_RECVERR)
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)
+SO_EE_ORIGIN_ICMP = 2
+ICMP_DEST_UNREACH = 3
+ICMP_PORT_UNREACH = 3
+UDP_RATE = 1000      # UDP-пакетов в секунду на хост
+UDP_RETRIES = 1      # повторные отправки на порты без ответа (ICMP у хостов часто ограничен по частоте)
+UDP_SEND_RETRIES = 3 # повторов sendto одного пакета при ошибке, после — порт "filtered" с ошибкой
+
+# ---------- Протокольные UDP-пробы ----------
+# Большинство UDP-сервисов молча игнорирует b"\x00", поэтому на известные порты шлём настоящие
+# запросы протокола и сразу разбираем ответ: один обмен даёт точное "open" и сведения о сервисе.
+
+_DNS_QID = 0x4541
+# стандартный рекурсивный запрос (RD=1): ". IN NS"
+_DNS_ROOT_NS_QUERY = struct.pack(">HHHHHH", _DNS_QID, 0x0100, 1, 0, 0, 0) + b"\x00" + struct.pack(">HH", 2, 1)
+
+# NTP: обычный клиентский запрос (mode 3) и приватный monlist (mode 7, REQ_MON_GETLIST_1)
+_NTP_CLIENT = b"\x1b" + b"\x00" * 47
+_NTP_MONLIST = b"\x17\x00\x03\x2a" + b"\x00" * 4
+
+_SSDP_MSEARCH = (
+    b"M-SEARCH * HTTP/1.1\r\n"
+    b"HOST: 239.255.255.250:1900\r\n"
+    b'MAN: "ssdp:discover"\r\n'
+    b"MX: 1\r\n"
+    b"ST: ssdp:all\r\n\r\n"
+)
+
+# IKEv1 Main Mode: одно SA-предложение 3DES/SHA1/PSK/MODP-1024, как у ike-scan
+_IKE_COOKIE = b"ELTXAUDT"
+_IKE_TRANSFORM = struct.pack(">BBHBBH", 0, 0, 32, 1, 1, 0) + b"".join(
+    struct.pack(">HH", 0x8000 | attr, value)
+    for attr, value in ((1, 5), (2, 2), (3, 1), (4, 2), (11, 1), (12, 28800))
+)
+_IKE_PROPOSAL = struct.pack(">BBHBBBB", 0, 0, 8 + len(_IKE_TRANSFORM), 1, 1, 0, 1) + _IKE_TRANSFORM
+_IKE_SA = struct.pack(">BBHII", 0, 0, 12 + len(_IKE_PROPOSAL), 1, 1) + _IKE_PROPOSAL
+_IKE_MAIN_MODE = (
+    _IKE_COOKIE + b"\x00" * 8 + struct.pack(">BBBBII", 1, 0x10, 2, 0, 0, 28 + len(_IKE_SA)) + _IKE_SA
+)
+
+# OpenVPN без tls-auth: P_CONTROL_HARD_RESET_CLIENT_V2 (opcode 7, key_id 0), пустой ACK, packet-id 0
+_OPENVPN_RESET = b"\x38" + b"ELTXAUDT" + b"\x00" + b"\x00\x00\x00\x00"
+
+# TFTP RRQ на заведомо несуществующий файл: живой сервер ответит ERROR (или DATA)
+_TFTP_RRQ = b"\x00\x01" + b"eltex-audit-probe\x00octet\x00"
+
+
+def _parse_dns(data):
+    if len(data) < 12:
+        return None
+    qid, flags, _, ancount, _, _ = struct.unpack_from(">HHHHHH", data)
+    if qid != _DNS_QID or not flags & 0x8000:
+        return None
+    ra = bool(flags & 0x0080)
+    rcode = flags & 0x000F
+    return {
+        "recursion_available": ra,
+        "rcode": rcode,
+        "answers": ancount,
+        "open_resolver": ra and rcode == 0 and ancount > 0,
+    }
+
+
+def _parse_ntp(data):
+    """
+    Ответ NTP: mode 4 — версия и stratum, mode 7 — ответ на monlist (_NTP_MONLIST).
+    monlist засчитывается, только если это ответ (бит R) на наш запрос (implementation
+    и request code совпадают), без ошибки и хотя бы с одной записью: ошибка "нет данных"
+    от настроенного ntpd и эхо нашего же пакета усилителем не являются.
+
+    >>> _parse_ntp(bytes.fromhex("970003 2a 0006 0048") + bytes(72 * 6))
+    {'monlist': True}
+    >>> _parse_ntp(bytes.fromhex("970003 2a 4000 0000"))  # INFO_ERR_NODATA, 0 записей
+    >>> _parse_ntp(_NTP_MONLIST)  # эхо запроса
+    """
+    if not data:
+        return None
+    mode = data[0] & 0x07
+    if mode == 4 and len(data) >= 48:
+        return {"version": (data[0] >> 3) & 0x07, "stratum": data[1]}
+    if mode == 7 and len(data) >= 8:
+        err_items = struct.unpack_from(">H", data, 4)[0]
+        if (data[0] & 0x80 and data[2:4] == _NTP_MONLIST[2:4]
+                and err_items >> 12 == 0 and err_items & 0x0FFF):
+            # список последних клиентов сервера — классический NTP-усилитель
+            return {"monlist": True}
+    return None
+
+
+def _parse_snmp(data):
+    try:
+        msg = snmp_pdu.decode_message(data)
+    except snmp_pdu.SnmpDecodeError:
+        return None
+    info = {"community": msg["community"], "error_status": msg["error_status"]}
+    for oid, value in msg["varbinds"]:
+        if oid == snmp_pdu.OID_SYSDESCR and isinstance(value, bytes):
+            info["banner"] = value.decode(errors="ignore")
+    return info
+
+
+def _parse_ssdp(data):
+    text = data.decode(errors="ignore")
+    if not text.startswith("HTTP/"):
+        return None
+    headers = {}
+    for line in text.split("\r\n")[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    return {
+        "banner": headers.get("server", ""),
+        "location": headers.get("location"),
+        "st": headers.get("st"),
+    }
+
+
+def _parse_ike(data):
+    if len(data) < 28 or data[:8] != _IKE_COOKIE:
+        return None
+    next_payload, version, exchange = data[16], data[17], data[18]
+    return {"ike_version": version >> 4, "exchange": exchange, "notify": next_payload == 11}
+
+
+def _parse_openvpn(data):
+    if not data or data[0] >> 3 != 8:  # P_CONTROL_HARD_RESET_SERVER_V2
+        return None
+    return {"hard_reset_server": True}
+
+
+def _parse_tftp(data):
+    if len(data) < 4 or data[:2] not in (b"\x00\x03", b"\x00\x05"):
+        return None
+    return {"opcode": data[1]}
+
+
+# порт → {"service", "payloads": [...], "parse": fn(data) → dict | None}
+UDP_PROBES = {
+    53: {"service": "dns", "payloads": [_DNS_ROOT_NS_QUERY], "parse": _parse_dns},
+    69: {"service": "tftp", "payloads": [_TFTP_RRQ], "parse": _parse_tftp},
+    123: {"service": "ntp", "payloads": [_NTP_CLIENT, _NTP_MONLIST], "parse": _parse_ntp},
+    161: {
+        "service": "snmp",
+        "payloads": [snmp_pdu.encode_get("public", [snmp_pdu.OID_SYSDESCR])],
+        "parse": _parse_snmp,
+    },
+    500: {"service": "ike", "payloads": [_IKE_MAIN_MODE], "parse": _parse_ike},
+    1194: {"service": "openvpn", "payloads": [_OPENVPN_RESET], "parse": _parse_openvpn},
+    1900: {"service": "ssdp", "payloads": [_SSDP_MSEARCH], "parse": _parse_ssdp},
+}
+
+UDP_DEFAULT_PAYLOAD = b"\x00"
+
+
+def udp_payloads(port):
+    """Пакеты, которые отправляем на UDP-порт (протокольные или пустая "проба")."""
+    probe = UDP_PROBES.get(port)
+    return probe["payloads"] if probe else [UDP_DEFAULT_PAYLOAD]
+
+
+def udp_port_result(port, data, prev=None):
+    """
+    Превращает ответ с UDP-порта в запись результата:
+      {"state": "open", "banner": "...", ["service": "...", "info": {...}]}
+    Для портов из UDP_PROBES ответ разбирается парсером протокола; prev — уже
+    полученная запись того же порта (несколько проб на порт → сведения сливаются).
+    """
+    res = prev if prev and prev.get("state") == "open" else {"state": "open", "banner": ""}
+    probe = UDP_PROBES.get(port)
+    info = probe["parse"](data) if probe else None
+    if info is None:
+        if not res["banner"] and data:
+            res["banner"] = data.decode(errors="ignore")
+        return res
+    info = dict(info)
+    banner = info.pop("banner", "")
+    if banner:
+        res["banner"] = banner
+    res["service"] = probe["service"]
+    res.setdefault("info", {}).update(info)
+    return res
+
+
+# Сколько проб подряд может уйти в таймаут без единого ответа хоста, прежде чем считаем его
+# молча зафильтрованным и прекращаем скан (0 — не прерывать)
+MAX_SILENT_PROBES = 200
+
+
+class RttEstimator:
+    """
+    Оценка RTT одного хоста и статистика его ответов.
+
+    Отсчёты RTT дают и SYN-ACK (порт открыт), и RST (ECONNREFUSED — порт закрыт):
+    и то и другое — ответ самого хоста. Таймаут connect'а = SRTT + max(G, 4*RTTVAR)
+    в пределах [min_timeout, max_timeout]; до первого ответа — initial.
+    Если max_silent проб подряд ушли в таймаут, а ответов не было вовсе, выставляется aborted.
+    """
+
+    def __init__(self, initial=RTT_INITIAL_TIMEOUT, min_timeout=RTT_MIN_TIMEOUT,
+                 max_timeout=RTT_MAX_TIMEOUT, max_silent=MAX_SILENT_PROBES):
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_silent = max_silent
+        self.srtt = None
+        self.rttvar = None
+        self.open = 0
+        self.closed = 0
+        self.filtered = 0
+        self.silent_streak = 0
+        self.aborted = False
+        self._lock = threading.Lock()
+
+    @property
+    def replies(self):
+        return self.open + self.closed
+
+    def timeout(self):
+        if self.srtt is None:
+            return self.initial
+        rto = self.srtt + max(RTT_GRANULARITY, 4 * self.rttvar)
+        return min(self.max_timeout, max(self.min_timeout, rto))
+
+    def record(self, state, rtt=None):
+        """Учитывает результат пробы: state — "open" | "closed" | "filtered"."""
+        with self._lock:
+            if state == "filtered":
+                self.filtered += 1
+                self.silent_streak += 1
+                if self.max_silent and not self.replies and self.silent_streak >= self.max_silent:
+                    self.aborted = True
+                return
+            if state == "open":
+                self.open += 1
+            else:
+                self.closed += 1
+            self.silent_streak = 0
+            if rtt is None:
+                return
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def stats(self):
+        return {
+            "closed_ports_count": self.closed,
+            "filtered_ports_count": self.filtered,
+            "aborted": self.aborted,
+            "srtt_ms": round(self.srtt * 1000, 2) if self.srtt is not None else None,
+        }
+
+
+def _slot(budget):
+    """Контекст "занять слот бюджета" для синхронного кода; без бюджета — пустой контекст."""
+    return budget if budget is not None else contextlib.nullcontext()
+
+
+def parse_ports_from_string(s):
+    """
+    Парсит строку вида "22,80,1000-1010" → PortSet (итерируется по возрастанию).
+    Возвращает пустой PortSet при ошибке/пустой строке.
+    """
+    return PortSet.parse(s)
+
+
+def parse_top_mode(mode):
+    """ "top:100" → 100; для остальных режимов (и некорректного N) — None."""
+    if not isinstance(mode, str) or not mode.startswith(TOP_MODE_PREFIX):
+        return None
+    try:
+        n = int(mode[len(TOP_MODE_PREFIX):])
+    except ValueError:
+        return None
+    return n if 1 <= n <= PORT_MAX else None
+
 
+def is_valid_mode(mode):
+    return mode in ("quick", "special", "full") or parse_top_mode(mode) is not None
 
-def tcp_scan_port(ip, port, timeout=1.0):
+
+def top_ports(n, preferred=()):
+    """
+    N самых вероятных TCP-портов в порядке убывания вероятности (PortOrder):
+    сначала preferred (статистика сканов), затем TOP_TCP_PORTS, затем остальные по возрастанию.
+    """
+    head = [p for p in dict.fromkeys(list(preferred) + TOP_TCP_PORTS) if PORT_MIN <= p <= PORT_MAX][:n]
+    ports = PortSet(head)
+    if len(ports) < n:
+        ports |= PortSet(itertools.islice(PortSet.full() - ports, n - len(ports)))
+    return PortOrder(ports, head)
+
+
+def tcp_scan_port(ip, port, timeout=1.0, budget=None, governor=None):
     """Проверка одного TCP-порта. Возвращает dict с состоянием или None, если порт закрыт/недоступен."""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    state, banner, _ = tcp_probe(ip, port, timeout=timeout, read_timeout=timeout, budget=budget, governor=governor)
+    if state != "open":
+        return None
+    return {"state": "open", "banner": banner}
+
+
+def tcp_probe(ip, port, timeout=1.0, read_timeout=None, budget=None, governor=None):
+    """
+    TCP-проба с классификацией ответа. Возвращает (state, banner, rtt):
+      state — "open" (SYN-ACK), "closed" (RST / ECONNREFUSED) или "filtered" (таймаут, ICMP unreachable);
+      rtt   — время до SYN-ACK/RST в секундах, None если хост не ответил.
+    timeout — на connect; read_timeout — на чтение баннера. Без read_timeout проба "чистая":
+    только connect, без отправки данных (баннеры собирает отдельный этап — core/fingerprint.py).
+    governor — RateGovernor: темп ограничивается до занятия слота бюджета, чтобы не держать сокет в ожидании.
+    """
+    _pace(governor, ip)
+    with _slot(budget):
+        return _tcp_probe(ip, port, timeout, read_timeout)
+
+
+def _tcp_probe(ip, port, timeout, read_timeout):
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return "filtered", "", None
     sock.settimeout(timeout)
     try:
+        t0 = time.perf_counter()
         res = sock.connect_ex((ip, port))
+        rtt = time.perf_counter() - t0
+        if res == errno.ECONNREFUSED:
+            return "closed", "", rtt
         if res != 0:
-            return None  # порт не открыт
+            return "filtered", "", None  # таймаут или ICMP unreachable от маршрутизатора
+        if read_timeout is None:
+            return "open", "", rtt
+        sock.settimeout(read_timeout)
         banner = ""
         try:
             # пробуем отправить пустую "пробу", чтобы некоторые сервисы выдали баннер/ошибку
@@ -65,9 +722,9 @@ def tcp_scan_port(ip, port, timeout=1.0):
                 banner = data.decode(errors="ignore")
         except Exception:
             pass
-        return {"state": "open", "banner": banner}
+        return "open", banner, rtt
     except Exception:
-        return None
+        return "filtered", "", None
     finally:
         try:
             sock.close()
@@ -75,7 +732,7 @@ def tcp_scan_port(ip, port, timeout=1.0):
             pass
 
 
-def udp_scan_port(ip, port, timeout=1.0):
+def udp_scan_port(ip, port, timeout=1.0, budget=None, governor=None):
     """
     Простейшая проверка UDP-порта.
     Возвращает:
@@ -83,20 +740,28 @@ def udp_scan_port(ip, port, timeout=1.0):
       {"state": "open|filtered", "banner": ""} — если не получили ответа (UDP сложно различить)
     или None при явной ошибке.
     """
+    _pace(governor, ip)
+    with _slot(budget):
+        return _udp_scan_port(ip, port, timeout)
+
+
+def _udp_scan_port(ip, port, timeout):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.settimeout(timeout)
     try:
-        # Отправляем пустой пакет; для ряда сервисов (SNMP, DNS, NTP) можно в будущем делать осмысленный payload
-        sock.sendto(b"\x00", (ip, port))
+        # Для известных сервисов (DNS, NTP, SNMP, ...) — протокольные пробы из UDP_PROBES
+        for payload in udp_payloads(port):
+            sock.sendto(payload, (ip, port))
+        res = None
         try:
-            data, _ = sock.recvfrom(1024)
-            banner = ""
-            if data:
-                banner = data.decode(errors="ignore")
-            return {"state": "open", "banner": banner}
+            while True:
+                data, _ = sock.recvfrom(65535)
+                res = udp_port_result(port, data, res)
+                sock.settimeout(0.05)  # первый ответ есть — добираем ответы на остальные пробы
         except socket.timeout:
-            # Не получили ответа — порт может быть открыт или фильтроваться
-            return {"state": "open|filtered", "banner": ""}
+            pass
+        # Не получили ответа — порт может быть открыт или фильтроваться
+        return res or {"state": "open|filtered", "banner": ""}
     except Exception:
         return None
     finally:
@@ -106,34 +771,501 @@ def udp_scan_port(ip, port, timeout=1.0):
             pass
 
 
-def scan_host(ip, ports, threads=100, timeout=1.0):
+def _fd_limited(concurrency):
+    """
+    Ограничивает число одновременно открытых сокетов мягким лимитом дескрипторов (RLIMIT_NOFILE),
+    иначе при тысячах connect'ов socket() начнёт падать с EMFILE и порты ошибочно уйдут в "закрытые".
+    """
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return max(1, concurrency)
+    if soft == resource.RLIM_INFINITY:
+        return max(1, concurrency)
+    return max(1, min(concurrency, soft - FD_RESERVE))
+
+
+async def async_tcp_scan_port(ip, port, timeout=1.0, budget=None, governor=None):
+    """
+    Асинхронный аналог tcp_scan_port на неблокирующем сокете.
+    Возвращает dict с состоянием или None, если порт закрыт/недоступен.
+    """
+    state, banner, _ = await async_tcp_probe(ip, port, timeout=timeout, read_timeout=timeout, budget=budget,
+                                             governor=governor)
+    if state != "open":
+        return None
+    return {"state": "open", "banner": banner}
+
+
+async def async_tcp_probe(ip, port, timeout=1.0, read_timeout=None, budget=None, governor=None):
+    """Асинхронный аналог tcp_probe: возвращает (state, banner, rtt)."""
+    if governor is not None:
+        await governor.acquire_async(ip)
+    if budget is None:
+        return await _async_tcp_probe(ip, port, timeout, read_timeout)
+    await budget.acquire_async()
+    try:
+        return await _async_tcp_probe(ip, port, timeout, read_timeout)
+    finally:
+        budget.release()
+
+
+async def _async_tcp_probe(ip, port, timeout, read_timeout):
+    loop = asyncio.get_running_loop()
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return "filtered", "", None
+    sock.setblocking(False)
+    try:
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        except ConnectionRefusedError:
+            return "closed", "", time.perf_counter() - t0
+        except (asyncio.TimeoutError, OSError):
+            return "filtered", "", None
+        rtt = time.perf_counter() - t0
+        if read_timeout is None:
+            return "open", "", rtt
+        banner = ""
+        try:
+            # та же "проба", что и в потоковом движке
+            await asyncio.wait_for(loop.sock_sendall(sock, b"\r\n\r\n"), read_timeout)
+        except Exception:
+            pass
+        try:
+            data = await asyncio.wait_for(loop.sock_recv(sock, 1024), read_timeout)
+            if data:
+                banner = data.decode(errors="ignore")
+        except Exception:
+            pass
+        return "open", banner, rtt
+    finally:
+        try:
+            sock.close()
+        except Exception:
+            pass
+
+
+class PortCursor:
+    """
+    Позиция скана хоста для checkpoint'ов: сколько портов от начала порядка обхода
+    проверено без пропусков. Пробы завершаются не по порядку, поэтому номера завершённых
+    впереди курсора держатся в множестве (не больше числа проб в полёте).
+    on_advance(value) вызывается при каждом продвижении курсора.
+    """
+
+    def __init__(self, start=0, on_advance=None):
+        self.value = start
+        self.on_advance = on_advance
+        self._done = set()
+        self._lock = threading.Lock()
+
+    def done(self, index):
+        with self._lock:
+            self._done.add(index)
+            start = self.value
+            while self.value in self._done:
+                self._done.remove(self.value)
+                self.value += 1
+            advanced = self.value != start
+            value = self.value
+        if advanced and self.on_advance:
+            self.on_advance(value)
+
+
+def _resume_iter(ports, start):
+    """(номер, порт) в порядке обхода ports, начиная с позиции start."""
+    return enumerate(itertools.islice(iter(ports), start, None), start)
+
+
+async def async_scan_host(ip, ports, concurrency=ASYNC_CONCURRENCY, timeout=1.0, budget=None, should_stop=None,
+                          rtt=None, on_open=None, governor=None, start=0, on_cursor=None):
+    """
+    TCP-сканирование хоста в одном event loop.
+    Держит до `concurrency` connect'ов в полёте: фиксированный пул корутин-воркеров
+    разбирает общий итератор портов, поэтому задачи не создаются на все 65535 портов сразу.
+    budget — общий SocketBudget прогона; should_stop() → True прерывает скан.
+    rtt — RttEstimator хоста: задаёт таймауты connect'а и прерывает скан молчащего хоста.
+    on_open(port, info) вызывается сразу по нахождении открытого порта.
+    governor — общий RateGovernor прогона.
+    start/on_cursor — продолжение с позиции start порядка обхода и уведомления о позиции (PortCursor).
+    Возвращает словарь: {port: {"state": "...", "banner": "..."}, ...}
+    """
+    found = {}
+    if not isinstance(ports, (PortSet, PortOrder, list, tuple)):
+        ports = list(ports)
+    if len(ports) <= start:
+        return found
+    it = _resume_iter(ports, start)
+    cursor = PortCursor(start, on_cursor)
+
+    async def worker():
+        # в одном потоке event loop'а next() по общему итератору безопасен
+        for i, p in it:
+            if (should_stop and should_stop()) or (rtt and rtt.aborted):
+                return
+            connect_timeout = rtt.timeout() if rtt else timeout
+            state, banner, sample = await async_tcp_probe(
+                ip, p, timeout=connect_timeout, budget=budget, governor=governor,
+            )
+            if rtt:
+                rtt.record(state, sample)
+            if state == "open":
+                found[p] = {"state": "open", "banner": banner}
+                if on_open:
+                    on_open(p, found[p])
+            cursor.done(i)
+
+    n = min(len(ports) - start, _fd_limited(concurrency))
+    await asyncio.gather(*(worker() for _ in range(n)))
+    return found
+
+
+async def async_tcp_ping(ip, ports=None, timeout=1.0, governor=None):
+    """
+    Проверка "живости" хоста TCP-пробами на несколько портов одновременно.
+    Хост считается живым, если хоть один порт ответил SYN-ACK (connect прошёл)
+    или RST (ECONNREFUSED). Таймауты и ICMP host/net unreachable — "мёртв".
+    """
+    loop = asyncio.get_running_loop()
+    ports = ports or DISCOVERY_PORTS
+
+    async def probe(port):
+        sock = None
+        try:
+            if governor is not None:
+                await governor.acquire_async(ip)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+            return True
+        except ConnectionRefusedError:
+            return True
+        except (asyncio.TimeoutError, OSError):
+            return False
+        finally:
+            if sock is not None:
+                sock.close()
+
+    tasks = [asyncio.ensure_future(probe(p)) for p in ports]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            if await fut:
+                return True
+        return False
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+class _SnmpPingProtocol(asyncio.DatagramProtocol):
+    """Собирает адреса, ответившие с 161/udp чем-то похожим на SNMP."""
+
+    def __init__(self):
+        self.replied = set()
+
+    def datagram_received(self, data, addr):
+        if addr[1] != 161:
+            return
+        try:
+            snmp_pdu.decode_message(data)
+        except snmp_pdu.SnmpDecodeError:
+            return
+        self.replied.add(addr[0])
+
+    def error_received(self, exc):
+        pass
+
+
+async def async_snmp_ping(ips, community="public", timeout=1.0, governor=None):
+    """
+    Рассылает SNMP GET sysDescr.0 на все адреса с одного UDP-сокета и ждёт ответы `timeout` секунд.
+    community — строка или список community (на каждый адрес уходит по запросу на каждую).
+    Возвращает множество ответивших IP.
+    """
+    ips = list(ips)
+    if not ips:
+        return set()
+    communities = [community] if isinstance(community, str) else list(community)
+    loop = asyncio.get_running_loop()
+    transport, proto = await loop.create_datagram_endpoint(_SnmpPingProtocol, family=socket.AF_INET)
+    try:
+        pkts = [snmp_pdu.encode_get(c, [snmp_pdu.OID_SYSDESCR]) for c in communities]
+        sent = 0
+        for ip in ips:
+            for pkt in pkts:
+                if governor is not None:
+                    await governor.acquire_async(ip)
+                transport.sendto(pkt, (ip, 161))
+                sent += 1
+                if sent % 256 == 0:
+                    await asyncio.sleep(0)  # даём циклу вычитать ответы и сбросить буфер отправки
+        await asyncio.sleep(timeout)
+        return proto.replied & set(ips)
+    finally:
+        transport.close()
+
+
+async def async_discover_hosts(ips, ports=None, timeout=1.0, concurrency=ASYNC_CONCURRENCY,
+                               snmp=False, community="public", host_ports=None, governor=None):
+    """
+    Быстрый проход по списку адресов: какие хосты вообще живы.
+    Сначала TCP-пробы (ports, по умолчанию DISCOVERY_PORTS), затем — для не ответивших
+    по TCP и только если snmp=True — SNMP GET с одного UDP-сокета.
+    host_ports — {ip: порты}: дополнительные пробы для отдельных хостов
+    (например, порты, открытые у них в прошлый раз).
+    Возвращает множество живых IP.
+    """
+    ips = list(ips)
+    ports = PortSet(ports or DISCOVERY_PORTS)
+    host_ports = host_ports or {}
+    alive = set()
+    if not ips:
+        return alive
+    it = iter(ips)
+
+    async def worker():
+        for ip in it:
+            extra = host_ports.get(ip)
+            if await async_tcp_ping(ip, ports | extra if extra else ports, timeout=timeout, governor=governor):
+                alive.add(ip)
+
+    # на каждый хост одновременно уходит до width сокетов
+    width = len(ports) + max((len(v) for v in host_ports.values()), default=0)
+    n = min(len(ips), max(1, _fd_limited(concurrency) // width))
+    await asyncio.gather(*(worker() for _ in range(n)))
+
+    if snmp:
+        rest = [ip for ip in ips if ip not in alive]
+        alive |= await async_snmp_ping(rest, community=community, timeout=timeout, governor=governor)
+    return alive
+
+
+def discover_hosts(ips, ports=None, timeout=1.0, concurrency=ASYNC_CONCURRENCY, snmp=False, community="public",
+                   host_ports=None, governor=None):
+    """Синхронная обёртка над async_discover_hosts. Возвращает множество живых IP."""
+    return asyncio.run(async_discover_hosts(
+        ips, ports=ports, timeout=timeout, concurrency=concurrency, snmp=snmp, community=community,
+        host_ports=host_ports, governor=governor,
+    ))
+
+
+def scan_host(ip, ports, threads=100, timeout=1.0, engine="threads", budget=None, should_stop=None, rtt=None,
+              on_open=None, governor=None, start=0, on_cursor=None):
     """
     Параллельное TCP-сканирование хоста по списку портов.
+    Это "чистый" connect-скан: данные не отправляются, баннер у открытых портов пустой —
+    сервисы и версии определяет отдельный этап (core/fingerprint.py) только по открытым портам.
+    engine:
+      - "threads" → пул потоков, один блокирующий сокет на поток (threads — размер пула)
+      - "asyncio" → неблокирующие сокеты в одном event loop (threads — число connect'ов в полёте)
+    budget — общий SocketBudget прогона (ограничение сокетов поверх threads);
+    should_stop() → True: оставшиеся порты не проверяются.
+    rtt — RttEstimator хоста (адаптивные таймауты, статистика closed/filtered, ранний выход).
+    Порты проверяются в порядке итерации ports (см. PortOrder/top_ports), а on_open(port, info)
+    вызывается по мере нахождения открытых портов — не дожидаясь конца скана.
+    governor — общий RateGovernor прогона (темп connect'ов).
+    start — продолжить с этой позиции порядка обхода ports (возобновление прерванного скана);
+    on_cursor(n) — сколько портов от начала порядка обхода проверено подряд (см. PortCursor).
     Возвращает словарь: {port: {"state": "...", "banner": "..."}, ...}
     """
+    if engine == "asyncio":
+        return asyncio.run(async_scan_host(
+            ip, ports, concurrency=threads, timeout=timeout, budget=budget, should_stop=should_stop, rtt=rtt,
+            on_open=on_open, governor=governor, start=start, on_cursor=on_cursor,
+        ))
+
     found = {}
+    if len(ports) <= start:
+        return found
+    cursor = PortCursor(start, on_cursor)
 
-    def worker(p):
-        return p, tcp_scan_port(ip, p, timeout=timeout)
+    def worker(i, p):
+        if (should_stop and should_stop()) or (rtt and rtt.aborted):
+            return i, p, None, False
+        connect_timeout = rtt.timeout() if rtt else timeout
+        state, banner, sample = tcp_probe(ip, p, timeout=connect_timeout, budget=budget, governor=governor)
+        if rtt:
+            rtt.record(state, sample)
+        return i, p, ({"state": "open", "banner": banner} if state == "open" else None), True
 
-    with ThreadPoolExecutor(max_workers=max(1, min(len(ports), threads))) as ex:
-        futures = [ex.submit(worker, p) for p in ports]
-        for fut in as_completed(futures):
-            p, res = fut.result()
-            if res:
-                found[p] = res
+    workers = max(1, min(len(ports) - start, threads))
+    it = _resume_iter(ports, start)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        # задачи подаём окном, а не на все порты сразу: на full-скане это 65535 Future'ов
+        pending = {ex.submit(worker, i, p) for i, p in itertools.islice(it, workers * 4)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, p, res, probed = fut.result()
+                if res:
+                    found[p] = res
+                    if on_open:
+                        on_open(p, res)
+                if probed:
+                    cursor.done(i)
+            pending |= {ex.submit(worker, i, p) for i, p in itertools.islice(it, len(done))}
     return found
 
 
-def scan_udp_host(ip, ports, threads=50, timeout=1.0):
+def udp_errqueue_supported():
+    """Можно ли получать ICMP-ошибки UDP через IP_RECVERR (по сути — это Linux)."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def _udp_drain(sock, ip, states):
+    """
+    Вычитывает всё, что накопилось на сокете:
+      - очередь ошибок: ICMP port unreachable → "closed", прочие unreachable → "filtered";
+        адрес в msg_name — исходный адрес назначения, т.е. (ip, порт), на который слали;
+      - обычные датаграммы от ip → "open" с баннером.
+    """
+    while True:
+        try:
+            _, ancdata, _, addr = sock.recvmsg(512, 512, MSG_ERRQUEUE)
+        except (BlockingIOError, InterruptedError):
+            break
+        except OSError:
+            break
+        if not addr or addr[0] != ip:
+            continue
+        for level, ctype, cdata in ancdata:
+            if level != socket.SOL_IP or ctype != IP_RECVERR or len(cdata) < 8:
+                continue
+            # struct sock_extended_err: u32 ee_errno, u8 ee_origin, u8 ee_type, u8 ee_code, ...
+            _, origin, icmp_type, icmp_code = struct.unpack_from("=IBBB", cdata)
+            if origin != SO_EE_ORIGIN_ICMP or icmp_type != ICMP_DEST_UNREACH:
+                continue
+            port = addr[1]
+            if states.get(port, {}).get("state") == "open":
+                continue
+            state = "closed" if icmp_code == ICMP_PORT_UNREACH else "filtered"
+            states[port] = {"state": state, "banner": ""}
+
+    # ограничиваем число итераций: каждая ошибка на сокете один раз всплывает и в recvfrom
+    for _ in range(4096):
+        try:
+            data, addr = sock.recvfrom(65535)
+        except (BlockingIOError, InterruptedError):
+            break
+        except OSError:
+            continue  # отложенная ошибка (ECONNREFUSED и т.п.) — уже учтена через очередь ошибок
+        if addr[0] == ip:
+            states[addr[1]] = udp_port_result(addr[1], data, states.get(addr[1]))
+
+
+def udp_sweep(ip, ports, timeout=1.0, rate=UDP_RATE, retries=UDP_RETRIES, budget=None, should_stop=None,
+              governor=None):
+    """
+    UDP-скан хоста с одного неблокирующего сокета (Linux).
+
+    На каждый порт уходят пакеты udp_payloads(port) (протокольные пробы для UDP_PROBES),
+    с ограничением rate пакетов/с; между отправками вычитываются ответы
+    и ICMP-ошибки (IP_RECVERR). После последней отправки ждём ещё timeout секунд.
+    Порты без какого-либо ответа отправляются повторно до retries раз.
+    governor — общий RateGovernor прогона, поверх собственного rate хоста.
+
+    Состояния: "open" (пришёл ответ), "closed" (ICMP port unreachable),
+    "filtered" (другой ICMP unreachable), "open|filtered" (тишина).
+    Возвращает словарь {port: {"state": "...", "banner": "..."}} без закрытых портов.
+    """
+    ports = ports if isinstance(ports, PortSet) else PortSet(ports)
+    states = {}
+    with _slot(budget), socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+        sock.setblocking(False)
+        poller = select.poll()
+        poller.register(sock, select.POLLIN | select.POLLERR)
+        rate = max(1, rate)
+
+        def wait_and_drain(seconds):
+            if poller.poll(max(0, int(seconds * 1000))):
+                _udp_drain(sock, ip, states)
+
+        pending = ports
+        for _ in range(max(0, retries) + 1):
+            start = time.monotonic()
+            # пакеты генерируются по ходу отправки, список на все порты не строится
+            packets = ((p, payload) for p in pending for payload in udp_payloads(p))
+            current = next(packets, None)
+            sent = 0
+            failures = 0  # подряд неудачных sendto текущего пакета
+            while current is not None:
+                if should_stop and should_stop():
+                    break
+                # сколько пакетов разрешено отправить к текущему моменту
+                allowed = int((time.monotonic() - start) * rate) + 1
+                while current is not None and sent < allowed:
+                    if governor is not None and governor.try_acquire(ip) > 0:
+                        break  # общий лимит исчерпан — пока вычитываем ответы
+                    port, payload = current
+                    try:
+                        sock.sendto(payload, (ip, port))
+                    except (BlockingIOError, InterruptedError):
+                        break  # буфер отправки полон — подождём
+                    except OSError as e:
+                        if e.errno == errno.ENOBUFS:
+                            break
+                        # в sendto может "всплыть" отложенная ICMP-ошибка прошлого пакета — тогда повтор
+                        # уйдёт; постоянная ошибка (ENETUNREACH, EHOSTUNREACH, EACCES, ...) повторяться
+                        # будет вечно — после UDP_SEND_RETRIES порт помечается и пропускается
+                        failures += 1
+                        if failures <= UDP_SEND_RETRIES:
+                            continue
+                        states.setdefault(port, {"state": "filtered", "banner": "", "error": e.strerror or str(e)})
+                        failures = 0
+                        current = next(packets, None)
+                        continue
+                    sent += 1
+                    failures = 0
+                    current = next(packets, None)
+                _udp_drain(sock, ip, states)
+                wait_and_drain(min(0.05, 1.0 / rate))
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                wait_and_drain(deadline - time.monotonic())
+            pending = pending - PortSet(states)
+            if not pending or (should_stop and should_stop()):
+                break
+
+    found = {}
+    for p in ports:
+        res = states.get(p, {"state": "open|filtered", "banner": ""})
+        if res["state"] != "closed":
+            found[p] = res
+    return found
+
+
+def scan_udp_host(ip, ports, threads=50, timeout=1.0, budget=None, should_stop=None,
+                  engine="auto", rate=UDP_RATE, retries=UDP_RETRIES, governor=None):
     """
     Параллельное UDP-сканирование хоста по списку портов.
+    engine:
+      - "auto"   → udp_sweep с одного сокета, если ОС умеет IP_RECVERR, иначе "threads"
+      - "socket" → udp_sweep (закрытые порты отсекаются по ICMP port unreachable)
+      - "threads"→ по сокету и потоку на порт, без ответа — "open|filtered"
     Возвращает словарь: {port: {"state": "...", "banner": "..."}, ...}
     """
+    if engine == "auto":
+        engine = "socket" if udp_errqueue_supported() else "threads"
+    if engine == "socket":
+        return udp_sweep(ip, ports, timeout=timeout, rate=rate, retries=retries,
+                         budget=budget, should_stop=should_stop, governor=governor)
+
     found = {}
 
     def worker(p):
-        return p, udp_scan_port(ip, p, timeout=timeout)
+        if should_stop and should_stop():
+            return p, None
+        return p, udp_scan_port(ip, p, timeout=timeout, budget=budget, governor=governor)
 
     with ThreadPoolExecutor(max_workers=max(1, min(len(ports), threads))) as ex:
         futures = [ex.submit(worker, p) for p in ports]
@@ -144,16 +1276,20 @@ def scan_udp_host(ip, ports, threads=50, timeout=1.0):
     return found
 
 
-def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100):
+def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100, engine="threads", concurrency=None,
+            budget=None, should_stop=None, adaptive=True, max_silent=MAX_SILENT_PROBES,
+            port_order=None, on_open=None, governor=None, custom_udp_ports=None, tcp_start=0, on_cursor=None):
     """
     Высокоуровневый вызов:
       TCP:
         - quick   → порты только из custom_ports
         - special → SPECIAL_PORTS
-        - full    → 1..65535
+        - top:N   → N самых вероятных портов (top_ports)
+        - full    → 1..65535, самые вероятные — первыми
       UDP:
-        - quick   → порты только из custom_ports
+        - quick   → порты только из custom_udp_ports (по умолчанию UDP не сканируется)
         - special → UDP_SPECIAL_PORTS
+        - top:N   → не сканируется
         - full    → 1..65535
 
     Возвращает словарь:
@@ -166,21 +1302,52 @@ def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100):
         "udp_special_ports": {...},  # UDP-избранные
         "scanned_ports_count": N,
         "udp_scanned_ports_count": M,
+        "scanned_ports": "1-1024",   # что сканировали (PortSet.to_spec())
+        "udp_scanned_ports": "",
       }
+
+    engine: "threads" (по умолчанию) или "asyncio".
+    concurrency: число connect'ов в полёте для asyncio-движка (по умолчанию ASYNC_CONCURRENCY).
+    budget: общий SocketBudget, если параллельно сканируется несколько хостов.
+    should_stop: callable → True, чтобы прервать скан (например, по /api/stop).
+    adaptive: таймауты connect'а по RTT хоста (RttEstimator) вместо фиксированных;
+      timeout режима тогда — только начальное значение.
+    max_silent: после стольких таймаутов подряд без единого ответа хост считается
+      молча зафильтрованным, TCP-скан прекращается, UDP не сканируется (0 — не прерывать).
+
+    port_order: порты по убыванию частоты из истории сканов — для top:N и full.
+    on_open(port, info): вызывается по мере нахождения открытых TCP-портов.
+    governor: общий RateGovernor прогона — темп TCP connect'ов и UDP-проб.
+    tcp_start/on_cursor: возобновление TCP-скана с позиции порядка обхода и её уведомления (см. scan_host).
+
+    В ответ дополнительно попадает "tcp_stats": {closed_ports_count, filtered_ports_count, aborted, srtt_ms}.
     """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown scan engine: {engine}")
+    top_n = parse_top_mode(mode)
+
     # ---------- TCP-часть (как раньше) ----------
     if mode == "full":
-        tcp_ports = list(range(1, 65536))
+        tcp_ports = PortOrder(PortSet.full(), list(port_order or []) + TOP_TCP_PORTS)
         timeout = max(timeout, 0.2)
-        threads = min(threads, 300)
+        if engine == "threads":
+            threads = min(threads, 300)
+
+    elif top_n:
+        tcp_ports = top_ports(top_n, port_order or [])
+        timeout = max(timeout, 0.2 if top_n > 1000 else 0.6)
+        if engine == "threads":
+            threads = min(threads, 300)
 
     elif mode == "special":
-        tcp_ports = SPECIAL_PORTS[:]
+        tcp_ports = SPECIAL_PORTS
         timeout = max(timeout, 0.6)
 
     else:  # quick
         if isinstance(custom_ports, str):
             tcp_ports = parse_ports_from_string(custom_ports)
+        elif isinstance(custom_ports, (PortSet, PortOrder)):
+            tcp_ports = custom_ports
         elif isinstance(custom_ports, (list, tuple)):
             tmp = []
             for p in custom_ports:
@@ -188,12 +1355,14 @@ def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100):
                     tmp.append(int(p))
                 except Exception:
                     continue
-            tcp_ports = tmp
+            tcp_ports = PortSet(tmp)
         else:
-            tcp_ports = []
+            tcp_ports = PortSet()
         timeout = max(timeout, 0.6)
 
-    tcp_ports = sorted({p for p in tcp_ports if 1 <= int(p) <= 65535})
+    rtt = None
+    if adaptive:
+        rtt = RttEstimator(initial=max(timeout, RTT_INITIAL_TIMEOUT), max_silent=max_silent)
 
     if not tcp_ports:
         # если ни одного TCP порта не задано — считаем хост "непросканированным"
@@ -202,7 +1371,13 @@ def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100):
         alive = False
         scanned_tcp_count = 0
     else:
-        found_tcp = scan_host(ip, tcp_ports, threads=threads, timeout=timeout)
+        if engine == "asyncio":
+            threads = concurrency or ASYNC_CONCURRENCY
+        found_tcp = scan_host(
+            ip, tcp_ports, threads=threads, timeout=timeout, engine=engine,
+            budget=budget, should_stop=should_stop, rtt=rtt, on_open=on_open, governor=governor,
+            start=tcp_start, on_cursor=on_cursor,
+        )
         special_found_tcp = {p: found_tcp[p] for p in found_tcp if p in SPECIAL_PORTS}
         alive = bool(found_tcp)
         scanned_tcp_count = len(tcp_ports)
@@ -210,23 +1385,29 @@ def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100):
         # ---------- UDP-часть ----------
     if mode == "full":
         # full-режим: UDP тоже полноскан — ОСТОРОЖНО, это очень шумно и долго
-        udp_ports = list(range(1, 65536))
+        udp_ports = PortSet.full()
 
     elif mode == "special":
         # special: только заранее отобранные интересные UDP-порты
-        udp_ports = UDP_SPECIAL_PORTS[:]
+        udp_ports = UDP_SPECIAL_PORTS
 
-    else:  # quick
-        # quick: по умолчанию вообще НЕ сканируем UDP,
-        # чтобы не засорять отчёты. При желании можно будет
-        # ввести отдельный параметр custom_udp_ports.
-        udp_ports = []
+    elif mode == "quick" and custom_udp_ports:
+        udp_ports = parse_ports_from_string(custom_udp_ports) if isinstance(custom_udp_ports, str) \
+            else PortSet(custom_udp_ports)
 
+    else:  # quick, top:N
+        # quick: по умолчанию вообще НЕ сканируем UDP,
+        # чтобы не засорять отчёты (порты можно явно задать в custom_udp_ports).
+        udp_ports = PortSet()
 
-    udp_ports = sorted({p for p in udp_ports if 1 <= int(p) <= 65535})
+    if rtt and rtt.aborted:
+        udp_ports = PortSet()  # хост молча всё режет — UDP дал бы только open|filtered на каждый порт
 
     if udp_ports:
-        found_udp = scan_udp_host(ip, udp_ports, threads=min(len(udp_ports), 50), timeout=1.0)
+        found_udp = scan_udp_host(
+            ip, udp_ports, threads=min(len(udp_ports), 50), timeout=1.0,
+            budget=budget, should_stop=should_stop, governor=governor,
+        )
         special_found_udp = {p: found_udp[p] for p in found_udp if p in UDP_SPECIAL_PORTS}
         scanned_udp_count = len(udp_ports)
     else:
@@ -243,4 +1424,7 @@ def scan_ip(ip, mode="quick", custom_ports=None, timeout=1.0, threads=100):
         "udp_special_ports": special_found_udp,
         "scanned_ports_count": scanned_tcp_count,
         "udp_scanned_ports_count": scanned_udp_count,
+        "scanned_ports": tcp_ports.to_spec(),
+        "udp_scanned_ports": udp_ports.to_spec(),
+        "tcp_stats": rtt.stats() if rtt else None,
     }
\ No newline at end of file
@@ -1,10 +1,18 @@
 import os
+import re
 import json
 import time
-
-from core.portscanner import scan_host, scan_ip
-from core.snmp_client import get_sysdescr
-from core import tls_checker, cve_matcher, mitre_checks, ml_risk
+import itertools
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from core.portscanner import (
+    scan_host, scan_ip, discover_hosts, parse_ports_from_string, parse_top_mode, DISCOVERY_PORTS, SocketBudget,
+    PortSet, PortOrder, RateGovernor, PORT_MAX, SPECIAL_PORTS, UDP_SPECIAL_PORTS, is_valid_mode,
+)
+from core import snmp_client
+from core import tls_checker, cve_matcher, mitre_checks, ml_risk, fingerprint
 from system import db
 
 DEFAULT_PORTS = [22, 23, 80, 443, 161]
@@ -13,10 +21,163 @@ DEFAULT_PORTS = [22, 23, 80, 443, 161]
 ALIVE_FROM_UDP = False        # учитывать UDP только если state == "open" (не open|filtered). По умолчанию — НЕ учитывать.
 HIDE_UDP_WHEN_DEAD = True     # скрывать UDP-результаты для alive == False (чтобы не засорять отчёт)
 
+# Обнаружение живых хостов перед сканом портов
+DISCOVERY_TIMEOUT = 1.0          # сек на TCP/SNMP-пробу
+DISCOVERY_EXTRA_PORTS_MAX = 16   # порты quick-режима (и известные открытые порты хоста) добавляем к пробам, если их немного
+DEAD_BACKOFF_MAX_SKIP = 24       # хост, мёртвый N плановых прогонов подряд, пропускаем 2^(N-1)-1 прогонов, но не больше
+DISCOVERY_CHUNK = 4096           # адресов за один проход обнаружения (цель не разворачивается в память целиком)
+
+# Инкрементальный режим "incremental[:N]" (для плановых прогонов): каждый прогон перепроверяет
+# известные открытые TCP/UDP-порты и проходит очередной 1/N-срез портов — полное покрытие за N прогонов:
+# TCP — все 65535 портов, UDP — набор UDP_SPECIAL_PORTS (протокольные пробы; остальной UDP без
+# ответа даёт лишь open|filtered)
+INCREMENTAL_MODE = "incremental"
+RESCAN_CYCLES = 24
+
+# Параллельный скан нескольких хостов
+HOST_WORKERS = 8                 # сколько хостов сканируем одновременно
+SOCKET_BUDGET = 1024             # общий лимит сокетов/проб "в полёте" на весь прогон
+SNMP_PREFETCH = 256              # на сколько хостов вперёд scan_many заранее отправляет SNMP-запросы
+INVENTORY_FLUSH_CELLS = 5000     # ячеек SNMP-таблиц на одну транзакцию записи в БД
+REEVAL_CHUNK = 500               # устройств на одну пачку повторного анализа (чтение, MITRE, запись)
+
+# Задачи с контрольными точками (ScanJob)
+CHECKPOINT_INTERVAL = 10.0       # сек между сохранениями прогресса задачи в БД
+
+# Кэш анализа устройств (CVE, MITRE, риск, проблемы) по их отпечатку
+ANALYSIS_CACHE_SIZE = 4096       # отпечатков в LRU
+
+# Заголовки HTTP, которые меняются от запроса к запросу, — в отпечаток не входят
+_VOLATILE_HEADER_RE = re.compile(r"^(?:date|expires|last-modified|etag|set-cookie|age|x-request-id)\s*:.*$\n?", re.I | re.M)
+
 
-def build_issues_and_advice(ip, open_ports, snmp_info, cves, risk):
+class ScanJob:
     """
-    На основе признаков формирует:
+    Задача сканирования с контрольными точками в SQLite (scan_jobs / scan_job_hosts).
+
+    По каждому хосту хранится либо готовый результат (status "done"), либо прогресс
+    недоделанного скана (status "partial", или "failed", если скан хоста упал с ошибкой):
+    позиция курсора портов (portscanner.PortCursor) и уже найденные открытые порты. Прогресс сбрасывается в БД не чаще CHECKPOINT_INTERVAL,
+    готовые хосты — сразу. Прерванная задача загружается через ScanJob.load и продолжается:
+    готовые хосты пропускаются, недоделанные сканируются с сохранённой позиции.
+    """
+
+    def __init__(self, job_id, target, params, hosts=None):
+        self.id = job_id
+        self.target = target
+        self.params = params
+        self._hosts = hosts or {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_at = time.monotonic()
+
+    @classmethod
+    def create(cls, target, params):
+        return cls(db.create_scan_job(target, params), target, params)
+
+    @classmethod
+    def load(cls, job_id):
+        job = db.get_scan_job(job_id)
+        if not job:
+            return None
+        hosts = {}
+        for ip, (status, cursor, ports, result) in db.get_job_hosts(job_id).items():
+            hosts[ip] = {
+                "status": status,
+                "cursor": cursor or 0,
+                "ports": {int(p): info for p, info in json.loads(ports or "{}").items()},
+                "result": json.loads(result) if result else None,
+            }
+        return cls(job["id"], job["target"], job["params"], hosts)
+
+    def _host(self, ip):
+        return self._hosts.setdefault(ip, {"status": "partial", "cursor": 0, "ports": {}, "result": None})
+
+    def is_done(self, ip):
+        h = self._hosts.get(ip)
+        return bool(h and h["status"] == "done")
+
+    def resume_point(self, ip):
+        """{"cursor", "ports"} для недоделанного хоста или None."""
+        with self._lock:
+            h = self._hosts.get(ip)
+            if not h or h["status"] == "done" or not (h["cursor"] or h["ports"]):
+                return None
+            return {"cursor": h["cursor"], "ports": dict(h["ports"])}
+
+    def record_open(self, ip, port, info):
+        with self._lock:
+            self._host(ip)["ports"][port] = dict(info)
+            self._dirty.add(ip)
+        self.maybe_save()
+
+    def record_cursor(self, ip, cursor):
+        with self._lock:
+            self._host(ip)["cursor"] = cursor
+            self._dirty.add(ip)
+        self.maybe_save()
+
+    def host_done(self, ip, result):
+        with self._lock:
+            h = self._host(ip)
+            h.update(status="done", result=result, ports={})
+            self._dirty.add(ip)
+        self.save()
+
+    def host_failed(self, ip):
+        """Скан хоста упал: хост остаётся недоделанным (прогресс сохраняется), продолжение его повторит."""
+        with self._lock:
+            self._host(ip)["status"] = "failed"
+            self._dirty.add(ip)
+        self.save()
+
+    def done_hosts(self):
+        with self._lock:
+            return [ip for ip, h in self._hosts.items() if h["status"] == "done"]
+
+    def failed_hosts(self):
+        with self._lock:
+            return [ip for ip, h in self._hosts.items() if h["status"] == "failed"]
+
+    def results(self):
+        """Результаты готовых хостов (включая прошлые запуски задачи) в порядке завершения."""
+        with self._lock:
+            return [h["result"] for h in self._hosts.values() if h["status"] == "done" and h["result"]]
+
+    def maybe_save(self):
+        if time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        # пишет один поток; остальные не ждут — их изменения уйдут следующим сохранением
+        if not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                rows = []
+                for ip in self._dirty:
+                    h = self._hosts[ip]
+                    rows.append((
+                        ip, h["status"], h["cursor"],
+                        json.dumps({str(p): v for p, v in h["ports"].items()}, ensure_ascii=False),
+                        json.dumps(h["result"], ensure_ascii=False) if h["result"] is not None else None,
+                    ))
+                self._dirty.clear()
+                self._saved_at = time.monotonic()
+            if rows:
+                db.save_job_hosts(self.id, rows)
+        finally:
+            self._save_lock.release()
+
+    def set_status(self, status, report=None):
+        self.save()
+        db.update_scan_job(self.id, status, report)
+
+
+def build_issues_and_advice(ip, open_ports, snmp_info, cves, risk, snmp_community=None):
+    """
+    На основе признаков формирует (snmp_community — стандартная community, на которую ответило устройство):
     - список конкретных "issues" с рекомендациями;
     - человекочитаемый текст совета.
     """
@@ -32,13 +193,14 @@ def build_issues_and_advice(ip, open_ports, snmp_info, cves, risk):
             "recommendation": "Отключить Telnet и использовать SSH (22/tcp). Если отключить нельзя — ограничить доступ ACL и/или через VPN."
         })
 
-    # 2. SNMP с public
-    if snmp_info and "public" in str(snmp_info).lower():
+    # 2. SNMP со стандартной community (public, private, ... из defaults.json)
+    if snmp_community:
         issues.append({
             "id": "SNMP_PUBLIC",
-            "title": "SNMP community 'public'",
+            "title": f"SNMP community '{snmp_community}'",
             "severity": "HIGH",
-            "description": "Обнаружен SNMP с community строкой 'public'. Это дефолтное значение, его легко подобрать.",
+            "description": f"Устройство отвечает на SNMP с community '{snmp_community}'. "
+                           f"Это дефолтное значение, его легко подобрать.",
             "recommendation": "Сменить community на уникальное, ограничить доступ к SNMP по IP или вообще отключить SNMP, если не используется."
         })
 
@@ -74,7 +236,11 @@ def build_issues_and_advice(ip, open_ports, snmp_info, cves, risk):
             "recommendation": "Отключить неиспользуемые сервисы, фильтровать трафик на границе (межсетевые экраны, ACL)."
         })
 
-    # Текстовый вывод по общему риску
+    return issues, advice_for(ip, risk)
+
+
+def advice_for(ip, risk):
+    """Текстовый вывод по общему риску."""
     if risk >= 80:
         advice_text = (
             f"Общая оценка риска для {ip}: {risk}/100 (КРИТИЧЕСКИЙ уровень). "
@@ -93,128 +259,580 @@ def build_issues_and_advice(ip, open_ports, snmp_info, cves, risk):
             f"Тем не менее стоит убедиться, что управленческие интерфейсы доступны только из админской сети, "
             f"а прошивка обновлена."
         )
+    return advice_text
+
+
+class AnalysisCache:
+    """
+    LRU-кэш анализа устройства: ключ — нормализованный отпечаток (host_fingerprint), значение —
+    CVE, находки MITRE, риск и проблемы. Сотни устройств одной модели с той же прошивкой и набором
+    портов анализируются один раз. Кэш сбрасывается целиком, когда меняется база CVE
+    (файл или импорт NVD) или правила MITRE. Зависящий от IP текст совета в кэш не входит.
+    """
+
+    def __init__(self, size=ANALYSIS_CACHE_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = self.misses = 0
+
+    def _check_version(self):
+        version = (cve_matcher.MATCHER.stamp(), mitre_checks.maybe_reload())
+        if version != self._version:
+            with self._lock:
+                self._items.clear()
+                self._version = version
+
+    def get(self, key):
+        self._check_version()
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+ANALYSIS_CACHE = AnalysisCache()
+
+
+def host_fingerprint(open_ports, udp_ports, snmp_system, modules):
+    """
+    Нормализованный отпечаток устройства — всё, от чего зависит анализ: модули, TCP-порты с сервисом,
+    продуктом, версией и баннером (без меняющихся заголовков HTTP), открытые UDP-сервисы,
+    sysDescr и community. IP в отпечаток не входит.
+    """
+    tcp = tuple(sorted(
+        (p, v.get("service"), v.get("product"), v.get("version"), _VOLATILE_HEADER_RE.sub("", v.get("banner") or ""))
+        for p, v in open_ports.items()
+    ))
+    udp = tuple(sorted(
+        (p, v.get("state"), v.get("service"), json.dumps(v.get("info"), sort_keys=True, default=str))
+        for p, v in udp_ports.items() if (v or {}).get("state") == "open"
+    ))
+    snmp = (snmp_system.get("sysdescr"), snmp_system.get("community")) if snmp_system else None
+    return tuple(sorted(m for m in modules if m in ("cve", "mitre"))), tcp, udp, snmp
+
+
+def analyze_host(ip, open_ports, udp_ports, snmp_system, modules, cve_cache=None, cache=None):
+    """
+    CVE, находки MITRE, риск и проблемы устройства: {"cves", "mitre", "risk", "issues"}.
+    cache — AnalysisCache (по умолчанию — общий ANALYSIS_CACHE): одинаковые отпечатки считаются
+    один раз; каждый вызов получает свою копию результата.
+    """
+    cache = ANALYSIS_CACHE if cache is None else cache
+    key = host_fingerprint(open_ports, udp_ports, snmp_system, modules)
+    found = cache.get(key)
+    if found is not None:
+        return _analysis_copy(found)
+
+    snmp_info = (snmp_system or {}).get("sysdescr")
+    cves = []
+    if "cve" in modules:
+        if cve_cache is not None:
+            cves = cve_cache.match_device(snmp_info, open_ports)
+        else:
+            cves = cve_matcher.match_device(snmp_info, open_ports)
+
+    mitre_findings = []
+    if "mitre" in modules:
+        # правила MITRE смотрят только на отпечаток — ip в записи для совместимости
+        mitre_findings = mitre_checks.run_mitre_checks({
+            "ip": ip,
+            "ports": open_ports,
+            "udp_ports": udp_ports,
+            "snmp": snmp_info,
+            "snmp_community": (snmp_system or {}).get("community"),
+            "cve_matches": cves,
+        })
+
+    # UDP учитываем только если реально был ответ
+    udp_open_count = sum(1 for v in udp_ports.values() if (v or {}).get("state") == "open")
+    risk = ml_risk.heuristic_score({
+        "open_ports_count": len(open_ports) + udp_open_count,          # НЕ раздуваем за счёт open|filtered
+        "snmp_public": bool(snmp_system),  # ответ пришёл только на стандартную community
+        "telnet_open": 23 in open_ports,                               # UDP:23 не имеет смысла
+        "has_cve_high": any((c.get("severity", "").upper() == "HIGH") for c in cves),
+        "default_creds": False,
+    })
+    issues, _ = build_issues_and_advice(ip, open_ports, snmp_info, cves, risk,
+                                        snmp_community=(snmp_system or {}).get("community"))
+    found = {"cves": cves, "mitre": mitre_findings, "risk": risk, "issues": issues}
+    cache.put(key, found)
+    return _analysis_copy(found)
+
+
+def _analysis_copy(found):
+    # записи CVE/MITRE/проблем — плоские словари: копии верхнего уровня хватает
+    return {
+        "cves": [dict(c) for c in found["cves"]],
+        "mitre": [dict(f) for f in found["mitre"]],
+        "risk": found["risk"],
+        "issues": [dict(i) for i in found["issues"]],
+    }
+
+
+def rate_governor(limits=None):
+    """
+    RateGovernor прогона из настроек запроса: {"global", "subnet", "host", "subnet_prefix"}.
+    Не заданные ключи — значения по умолчанию (portscanner.RATE_*), 0/None — без ограничения.
+    Бросает ValueError при некорректных значениях.
+    """
+    limits = dict(limits or {})
+    unknown = set(limits) - {"global", "subnet", "host", "subnet_prefix"}
+    if unknown:
+        raise ValueError(f"unknown rate limits: {', '.join(sorted(unknown))}")
+    kwargs = {}
+    for key, arg in (("global", "global_rate"), ("subnet", "subnet_rate"), ("host", "host_rate")):
+        if key in limits:
+            value = limits[key]
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                raise ValueError(f"bad rate limit {key}: {value!r}")
+            kwargs[arg] = value
+    if "subnet_prefix" in limits:
+        prefix = limits["subnet_prefix"]
+        if isinstance(prefix, bool) or not isinstance(prefix, int) or not 0 <= prefix <= 32:
+            raise ValueError(f"bad subnet_prefix: {prefix!r}")
+        kwargs["subnet_prefix"] = prefix
+    return RateGovernor(**kwargs)
+
+
+def parse_incremental_mode(mode):
+    """ "incremental" → RESCAN_CYCLES, "incremental:N" → N; для остальных режимов — None."""
+    if mode == INCREMENTAL_MODE:
+        return RESCAN_CYCLES
+    if not isinstance(mode, str) or not mode.startswith(INCREMENTAL_MODE + ":"):
+        return None
+    try:
+        n = int(mode[len(INCREMENTAL_MODE) + 1:])
+    except ValueError:
+        return None
+    return n if 1 <= n <= PORT_MAX else None
+
+
+def is_valid_scan_mode(mode):
+    return is_valid_mode(mode) or parse_incremental_mode(mode) is not None
+
+
+def rescan_slice(cycle, cycles):
+    """Срез номер cycle (по модулю cycles) пространства портов: сплошной диапазон ~65535/cycles портов."""
+    size = -(-PORT_MAX // cycles)
+    start = (cycle % cycles) * size + 1
+    return PortSet.from_ranges([(start, min(PORT_MAX, start + size - 1))])
+
+
+def rescan_udp_slice(cycle, cycles, ports=UDP_SPECIAL_PORTS):
+    """Срез номер cycle (по модулю cycles) UDP-портов ports: каждый порт попадает ровно в один из cycles срезов."""
+    return PortSet(p for i, p in enumerate(ports) if i % cycles == cycle % cycles)
+
+
+def incremental_plan(job_key, cycles=RESCAN_CYCLES, cycle=None):
+    """
+    План очередного инкрементального прогона задачи job_key (номер цикла хранится в БД):
+      {"cycle", "cycles", "slice": PortSet, "udp_slice": PortSet, "tcp": {ip: PortSet}, "udp": {ip: PortSet}}
+    slice / udp_slice — очередной срез TCP-портов / UDP_SPECIAL_PORTS (rescan_slice, rescan_udp_slice);
+    tcp/udp — порты, открытые у устройств сейчас (по port_state).
+    cycle — повторить уже начатый цикл (возобновление задачи), счётчик в БД не сдвигается.
+    """
+    if cycle is None:
+        cycle = db.next_rescan_cycle(job_key)
+    cycle %= cycles
+    return {
+        "cycle": cycle,
+        "cycles": cycles,
+        "slice": rescan_slice(cycle, cycles),
+        "udp_slice": rescan_udp_slice(cycle, cycles),
+        "tcp": known_open_ports("tcp"),
+        "udp": known_open_ports("udp"),
+    }
 
-    return issues, advice_text
+
+def track_port_changes(dev_id, proto, scanned, found):
+    """
+    Сравнивает результат скана с port_state устройства и обновляет его.
+    scanned — PortSet просканированных портов, found — {port: info} из скана.
+    Порт считается закрывшимся, только если был открыт и входил в scanned; UDP "open|filtered"
+    (нет ответа) — не изменение. Возвращает список изменений:
+      [{"proto", "port", "change": "opened" | "closed" | "service", "service", ["old"]}, ...]
+    """
+    prev = db.get_port_states(dev_id, proto)
+    prev_open = PortSet(p for p, (state, _) in prev.items() if state == "open")
+    now_open = PortSet(p for p, v in found.items() if (v or {}).get("state") == "open")
+    unknown = PortSet(p for p, v in found.items() if (v or {}).get("state") != "open")
+
+    changes, rows = [], []
+    for p in now_open:
+        service = found[p].get("service")
+        if service == "unknown":
+            service = None  # fingerprint не опознал — не повод считать, что сервис сменился
+        old_state, old_service = prev.get(p, (None, None))
+        if old_state != "open":
+            changes.append({"proto": proto, "port": p, "change": "opened", "service": service})
+        elif service and old_service and service != old_service:
+            changes.append({"proto": proto, "port": p, "change": "service", "service": service, "old": old_service})
+        rows.append((p, "open", service))
+    for p in (prev_open & scanned) - now_open - unknown:
+        changes.append({"proto": proto, "port": p, "change": "closed", "service": prev[p][1]})
+        rows.append((p, "closed", None))
+
+    if rows:
+        db.upsert_port_states(dev_id, proto, rows)
+    return changes
+
+
+def describe_change(change):
+    """Текст изменения для лога/уведомлений."""
+    where = f"{change['port']}/{change['proto']}"
+    service = f" ({change['service']})" if change.get("service") else ""
+    if change["change"] == "opened":
+        return f"открыт новый порт {where}{service}"
+    if change["change"] == "closed":
+        return f"порт {where}{service} закрылся"
+    return f"на {where} сменился сервис: {change.get('old')} → {change.get('service')}"
+
+
+def history_port_order(service="tcp"):
+    """Порты, открытые у наших устройств, по убыванию частоты — порядок для top:N и full."""
+    return [port for port, _ in db.get_port_frequency(service)]
+
+
+def known_open_ports(service="tcp"):
+    """Открытые порты каждого устройства по последнему скану в БД: {ip: PortSet}."""
+    return {ip: PortSet.from_ranges(r) for ip, r in db.get_open_port_ranges(service).items()}
+
+
+def discover_live_hosts(ips, modules=None, mode="quick", custom_ports=None, use_backoff=False, governor=None):
+    """
+    Проход обнаружения перед дорогим сканом: оставляет только живые хосты.
+
+    В quick-режиме к DISCOVERY_PORTS добавляются пользовательские порты (если их не больше
+    DISCOVERY_EXTRA_PORTS_MAX), чтобы не потерять хост, у которого открыт только нужный порт.
+    По той же причине хосты из БД дополнительно пробуются на портах, открытых у них в прошлый раз.
+    При use_backoff=True (плановые прогоны) пропускаются хосты, которые подряд не отвечали,
+    и обновляется статистика живости в БД; ручной прогон её не читает и не меняет.
+    governor — RateGovernor прогона (темп проб обнаружения).
+
+    ips может быть ленивым (targets.TargetSet и т.п.): адреса обрабатываются порциями
+    по DISCOVERY_CHUNK, в памяти остаются только живые.
+
+    Возвращает (live_ips, summary), где live_ips сохраняет исходный порядок, а summary:
+      {"total", "alive", "skipped_dead", "skipped_backoff"}
+    """
+    modules = modules or []
+
+    ports = PortSet(DISCOVERY_PORTS)
+    if mode == "quick" and custom_ports:
+        extra = parse_ports_from_string(custom_ports) if isinstance(custom_ports, str) else PortSet(custom_ports)
+        if len(extra) <= DISCOVERY_EXTRA_PORTS_MAX:
+            ports |= extra
+
+    known = known_open_ports("tcp")
+    backoff = db.get_backoff_hosts() if use_backoff else {}
+    live = []
+    summary = {"total": 0, "alive": 0, "skipped_dead": 0, "skipped_backoff": 0}
+
+    it = iter(ips)
+    while True:
+        chunk = list(itertools.islice(it, DISCOVERY_CHUNK))
+        if not chunk:
+            break
+        host_ports = {}
+        for ip in chunk:
+            extra = known.get(ip, PortSet()) - ports
+            if extra:
+                host_ports[ip] = PortSet(itertools.islice(extra, DISCOVERY_EXTRA_PORTS_MAX))
+
+        to_probe = [ip for ip in chunk if ip not in backoff]
+        skipped_backoff = [ip for ip in chunk if ip in backoff]
+
+        alive = discover_hosts(to_probe, ports=ports, timeout=DISCOVERY_TIMEOUT, snmp="snmp" in modules,
+                               community=snmp_client.SNMP_COMMUNITIES, host_ports=host_ports, governor=governor)
+        chunk_live = [ip for ip in to_probe if ip in alive]
+        dead = [ip for ip in to_probe if ip not in alive]
+
+        if use_backoff:  # счётчики неответов ведут только плановые прогоны; ручной скан их не сдвигает
+            db.update_host_liveness(chunk_live, dead, skipped_backoff, max_skip=DEAD_BACKOFF_MAX_SKIP)
+        live += chunk_live
+        summary["total"] += len(chunk)
+        summary["skipped_dead"] += len(dead)
+        summary["skipped_backoff"] += len(skipped_backoff)
+
+    summary["alive"] = len(live)
+    return live, summary
+
+
+def snmp_request(ip, governor=None, budget=None):
+    """
+    Асинхронный SNMP-запрос к хосту через общий SnmpPoller: concurrent.futures.Future
+    с результатом SnmpPoller.identify (группа system + подошедшая community) или None.
+    budget — SocketBudget прогона: каждый запрос (по одному на community) занимает в нём слот.
+    """
+    return snmp_client.get_poller().submit_identify(ip, governor=governor, budget=budget)
+
+
+def sweep_snmp(ips, modules=None, governor=None, timeout=snmp_client.SNMP_TIMEOUT, retries=1):
+    """
+    SNMP-обнаружение диапазона без скана портов (snmp_client.snmp_sweep): один UDP-сокет,
+    темп — governor. По sysDescr определяются модель/прошивка, а с модулем "cve" — и CVE.
+    Возвращает {ip: {"sysdescr", "model", "fw_version", "cves"}}.
+    """
+    modules = modules or []
+    found = snmp_client.snmp_sweep(ips, timeout=timeout, retries=retries, governor=governor or rate_governor())
+    cves = cve_matcher.match_many(found.values()) if "cve" in modules else [[] for _ in found]
+    out = {}
+    for (ip, sysdescr), matches in zip(found.items(), cves):
+        model, fw_version = fingerprint.device_identity({}, sysdescr)
+        out[ip] = {"sysdescr": sysdescr, "model": model, "fw_version": fw_version, "cves": matches}
+    return out
 
 
-def scan_device(ip, mode="quick", modules=None, custom_ports=None):
+def collect_snmp_inventory(ips, walks=None, governor=None):
+    """
+    SNMP-инвентаризация: интерфейсы (ifTable/ifXTable), ENTITY-MIB и ARP (snmp_client.INVENTORY_WALKS)
+    с устройств, у которых известна рабочая community (snmp_access — заполняет scan_device).
+
+    Все обходы идут через общий SnmpPoller (GETBULK, конвейер на много устройств сразу),
+    ячейки пишутся в БД по мере прихода ответов — транзакциями до INVENTORY_FLUSH_CELLS
+    ячеек, так что в памяти таблицы целиком не копятся. Строки, которых нет в новом
+    полном обходе таблицы, удаляются. Возвращает {ip: {таблица: True | False}} — обход
+    таблицы завершён целиком или нет.
+    """
+    walks = walks or snmp_client.INVENTORY_WALKS
+    access = db.get_snmp_access(ips)
+    started = int(time.time())
+    jobs = [
+        ((ip, table, n), ip, columns, community)
+        for ip, (_, community) in access.items()
+        for n, (table, columns) in enumerate(walks)
+    ]
+    status = {}
+    buf = []
+    for (ip, table, _), kind, payload in snmp_client.get_poller().walk_many(jobs, governor=governor):
+        if kind == "cells":
+            buf += [(table, access[ip][0], column, row_index, value) for column, row_index, value in payload]
+            if len(buf) >= INVENTORY_FLUSH_CELLS:
+                db.save_snmp_cells(buf, int(time.time()))
+                buf = []
+            continue
+        tables = status.setdefault(ip, {})
+        tables[table] = tables.get(table, True) and payload
+    if buf:
+        db.save_snmp_cells(buf, int(time.time()))
+
+    for ip, tables in status.items():
+        for table, ok in tables.items():
+            if ok:
+                db.prune_snmp_table(table, access[ip][0], started)
+    return status
+
+
+def reevaluate_devices(modules=("cve", "mitre"), chunk=REEVAL_CHUNK, should_stop=None, on_progress=None):
+    """
+    Повторный анализ уже просканированных устройств без единого пакета в сеть: записи хостов
+    восстанавливаются из БД (db.get_device_records — последние открытые порты, баннеры, sysDescr)
+    пачками по chunk, заново проходят CVE (MatchCache на весь прогон) и MITRE (весь chunk —
+    одним проходом плана правил), а vulnerabilities/mitre_findings обновляются (db.save_reevaluation).
+    Нужно после обновления базы CVE или правил MITRE.
+    on_progress(stats) — после каждой пачки; should_stop() → True прерывает после текущей пачки.
+    Возвращает {"devices", "cves", "findings", "stopped"}.
+    """
+    modules = list(modules or [])
+    cve_cache = cve_matcher.MatchCache() if "cve" in modules else None
+    stats = {"devices": 0, "cves": 0, "findings": 0, "stopped": False}
+    after = 0
+    while True:
+        if should_stop and should_stop():
+            stats["stopped"] = True
+            break
+        devices = db.get_device_records(after, chunk)
+        if not devices:
+            break
+        after = devices[-1]["device_id"]
+        cves = [None] * len(devices)
+        if cve_cache is not None:
+            cves = [cve_cache.match_device((d["snmp_system"] or {}).get("sysdescr"), d["ports"]) for d in devices]
+        findings = [None] * len(devices)
+        if "mitre" in modules:
+            findings = mitre_checks.run_mitre_checks_batch({
+                "ip": d["ip"],
+                "ports": d["ports"],
+                "udp_ports": d["udp_ports"],
+                "snmp": (d["snmp_system"] or {}).get("sysdescr"),
+                "snmp_community": (d["snmp_system"] or {}).get("community"),
+                "cve_matches": c or [],
+            } for d, c in zip(devices, cves))
+        db.save_reevaluation([(d["device_id"], c, f) for d, c, f in zip(devices, cves, findings)])
+        stats["devices"] += len(devices)
+        stats["cves"] += sum(len(c) for c in cves if c)
+        stats["findings"] += sum(len(f) for f in findings if f)
+        if on_progress:
+            on_progress(dict(stats))
+    return stats
+
+
+def scan_device(ip, mode="quick", modules=None, custom_ports=None, engine="threads",
+                per_host=None, budget=None, should_stop=None, port_order=None, on_open=None, governor=None,
+                plan=None, on_change=None, resume=None, on_cursor=None, snmp=None, cve_cache=None):
     """
     Сканирует ОДИН IP.
 
-    mode: "quick" | "special" | "full"
+    mode: "quick" | "special" | "top:N" | "full" | "incremental[:N]"
     custom_ports: строка или список для режима quick, например "22,80,1000-1010"
-    modules: list[str] из: "snmp", "cve", "mitre", "tls"
+    modules: list[str] из: "snmp", "cve", "mitre", "tls" (результат "tls" — {port: сертификат})
+    engine: движок TCP-скана — "threads" | "asyncio" (см. portscanner.scan_host)
+    per_host: лимит одновременных проб на этот хост (по умолчанию — дефолты scan_ip)
+    budget: общий SocketBudget прогона — под него же идут SNMP- и TLS-запросы
+    should_stop: callable → True, чтобы прервать скан портов
+    port_order: частотный порядок портов для top:N/full (по умолчанию — history_port_order())
+    on_open(port, info): вызывается по мере нахождения открытых TCP-портов
+    governor: RateGovernor прогона — темп TCP/UDP-проб, fingerprint'а, SNMP- и TLS-запросов
+    plan: план инкрементального прогона (incremental_plan) — общий для всех хостов прогона
+    on_change(change): вызывается на каждое изменение состояния портов относительно прошлых сканов
+    resume: {"cursor", "ports"} из ScanJob — продолжить прерванный TCP-скан с позиции cursor
+      (порядок обхода портов должен совпадать: тот же mode/custom_ports/port_order/plan)
+    on_cursor(n): позиция TCP-скана для checkpoint'ов (см. portscanner.PortCursor)
+    snmp: уже отправленный snmp_request(ip) (scan_many шлёт их заранее); иначе запрос уходит здесь
+    cve_cache: cve_matcher.MatchCache прогона — одинаковые sysDescr/версии сервисов сопоставляются один раз
     """
     modules = modules or []
 
+    # SNMP-запрос уходит сразу и идёт параллельно со сканом портов
+    if "snmp" in modules and snmp is None:
+        snmp = snmp_request(ip, governor, budget)
+
     # 1) Скан портов (TCP + UDP) — UDP в quick мы гасим, чтобы не спамил
-    scan_result = scan_ip(ip, mode=mode, custom_ports=custom_ports)
-    if mode == "quick":
+    scan_mode = mode
+    custom_udp_ports = None
+    cycles = parse_incremental_mode(mode)
+    if cycles:
+        # известные открытые порты — первыми, затем очередной срез пространства портов
+        plan = plan or incremental_plan(ip, cycles)
+        known = plan["tcp"].get(ip, PortSet())
+        custom_ports = PortOrder(plan["slice"] | known, list(known))
+        custom_udp_ports = (plan["udp_slice"] | plan["udp"].get(ip, PortSet())) or None
+        scan_mode = "quick"
+    if port_order is None and (mode == "full" or parse_top_mode(mode)):
+        port_order = history_port_order()
+    scan_kwargs = {"engine": engine, "budget": budget, "should_stop": should_stop,
+                   "port_order": port_order, "on_open": on_open, "governor": governor,
+                   "custom_udp_ports": custom_udp_ports, "on_cursor": on_cursor,
+                   "tcp_start": resume["cursor"] if resume else 0}
+    if per_host:
+        scan_kwargs.update(threads=per_host, concurrency=per_host)
+    scan_result = scan_ip(ip, mode=scan_mode, custom_ports=custom_ports, **scan_kwargs)
+    if scan_mode == "quick" and not custom_udp_ports:
         scan_result["udp_ports"] = {}
         scan_result["udp_special_ports"] = {}
         scan_result["udp_scanned_ports_count"] = 0
 
+    if resume:
+        # открытые порты, найденные до прерывания (до позиции cursor)
+        for p, info in resume["ports"].items():
+            scan_result["ports"].setdefault(p, info)
+            if p in SPECIAL_PORTS:
+                scan_result["special_ports"].setdefault(p, scan_result["ports"][p])
+        scan_result["alive"] = scan_result["alive"] or bool(resume["ports"])
+
     open_ports         = scan_result.get("ports", {})               # TCP
     special_ports      = scan_result.get("special_ports", {})
     udp_ports          = scan_result.get("udp_ports", {})           # UDP
     udp_special_ports  = scan_result.get("udp_special_ports", {})
     scanned_tcp_count  = scan_result.get("scanned_ports_count", 0)
     scanned_udp_count  = scan_result.get("udp_scanned_ports_count", 0)
+    tcp_stats          = scan_result.get("tcp_stats")
 
-    # 2) Работа с БД
-    dev_id = db.upsert_device(ip)
-    now = int(time.time())
+    # 2) Второй этап: сервисы и версии только на открытых TCP-портах (баннеры, product/version)
+    if open_ports:
+        fingerprints = fingerprint.fingerprint_host(ip, list(open_ports), budget=budget, governor=governor)
+        for p, fp in fingerprints.items():
+            open_ports[p].update(fp)
 
-    # 3) SNMP (через UDP/161; если выключен/фильтруется — вернёт None)
-    snmp_info = None
+    # 3) SNMP (через UDP/161; если выключен/фильтруется — вернёт None): группа system
+    #    и community, на которую ответило устройство
+    snmp_system = None
     if "snmp" in modules:
         try:
-            snmp_info = get_sysdescr(ip)
+            snmp_system = snmp.result()
         except Exception:
-            snmp_info = None
-
-    # 4) CVE по sysDescr
-    cves = []
-    if "cve" in modules and snmp_info:
-        cves = cve_matcher.match_sysdescr(snmp_info)
-        for c in cves:
-            db.insert_vuln(
-                dev_id,
-                c.get("cve"),
-                c.get("desc", ""),
-                c.get("severity", "MEDIUM"),
-            )
-
-    # 5) MITRE
-    mitre_findings = []
-    if "mitre" in modules:
-        record = {
-            "ip": ip,
-            "ports": open_ports,
-            "udp_ports": udp_ports,
-            "snmp": snmp_info,
-            "cve_matches": cves,
-        }
-        mitre_findings = mitre_checks.run_mitre_checks(record)
-        for f in mitre_findings:
-            db.insert_mitre(
-                dev_id,
-                f["technique_id"],
-                f["technique_name"],
-                f.get("rule", ""),
-                f.get("confidence", ""),
-                f,
-            )
-
-    # 6) TLS-сертификат на 443/tcp
-    tls_info = None
-    if "tls" in modules and 443 in open_ports:
-        tls_info = tls_checker.get_cert_info(ip, 443)
-
-    # 7) Сохраняем TCP-сканы в БД
-    for p, info in open_ports.items():
-        db.insert_scan(
-            dev_id,
-            now,
-            p,
-            "tcp",
-            info.get("state"),
-            banner=info.get("banner"),
-            snmp_sysdescr=(snmp_info if p == 161 else None),  # фактически TCP/161 не встретится, но оставим совместимость
-            raw_json=json.dumps(info, ensure_ascii=False),
-        )
+            snmp_system = None
+    snmp_info = (snmp_system or {}).get("sysdescr")
+
+    # 4) Работа с БД: модель и прошивка — из сигнатур баннеров и sysDescr, имя — из sysName
+    model, fw_version = fingerprint.device_identity(open_ports, snmp_info)
+    dev_id = db.upsert_device(ip, hostname=(snmp_system or {}).get("sysname"), model=model, fw_version=fw_version)
+    if snmp_system:
+        db.upsert_snmp_access(dev_id, snmp_system)
+    now = int(time.time())
 
-    # 8) Сохраняем UDP-сканы в БД
-    for p, info in udp_ports.items():
-        db.insert_scan(
+    # 5-6) CVE по sysDescr и версиям сервисов на портах, MITRE, риск и проблемы — по отпечатку
+    #      устройства: одинаковые устройства анализируются один раз (ANALYSIS_CACHE)
+    analysis = analyze_host(ip, open_ports, udp_ports, snmp_system, modules, cve_cache=cve_cache)
+    cves, mitre_findings, risk, issues = analysis["cves"], analysis["mitre"], analysis["risk"], analysis["issues"]
+    if cves:
+        db.insert_vulns(dev_id, cves)
+    for f in mitre_findings:
+        db.insert_mitre(
             dev_id,
-            now,
-            p,
-            "udp",
-            info.get("state"),
-            banner=info.get("banner"),
-            snmp_sysdescr=None,
-            raw_json=json.dumps(info, ensure_ascii=False),
+            f["technique_id"],
+            f["technique_name"],
+            f.get("rule", ""),
+            f.get("confidence", ""),
+            f,
         )
 
-    # 9) Оценка риска (UDP учитываем только если реально был ответ)
-    udp_open_count = sum(1 for v in udp_ports.values() if (v or {}).get("state") == "open")
-    features = {
-        "open_ports_count": len(open_ports) + udp_open_count,          # НЕ раздуваем за счёт open|filtered
-        "snmp_public": bool(snmp_info and "public" in str(snmp_info).lower()),
-        "telnet_open": 23 in open_ports,                               # UDP:23 не имеет смысла
-        "has_cve_high": any((c.get("severity", "").upper() == "HIGH") for c in cves),
-        "default_creds": False,
-    }
-    risk = ml_risk.heuristic_score(features)
+    # 7) TLS-сертификаты на всех открытых портах, где ожидается или обнаружен TLS (fingerprint):
+    #    рукопожатия идут одновременно, под общий budget/governor прогона
+    tls_info = None
+    if "tls" in modules:
+        tls_ports = [p for p, v in open_ports.items() if p in fingerprint.TLS_PORTS or (v or {}).get("tls")]
+        tls_info = tls_checker.inspect_host(ip, sorted(tls_ports), budget=budget, governor=governor)
+
+    # 8-9) Сохраняем TCP- и UDP-сканы в БД одной пачкой
+    rows = [
+        (dev_id, now, p, "tcp", info.get("state"), info.get("banner"),
+         snmp_info if p == 161 else None,  # фактически TCP/161 не встретится, но оставим совместимость
+         json.dumps(info, ensure_ascii=False))
+        for p, info in open_ports.items()
+    ]
+    rows += [
+        (dev_id, now, p, "udp", info.get("state"), info.get("banner"), None, json.dumps(info, ensure_ascii=False))
+        for p, info in udp_ports.items()
+    ]
+    if rows:
+        db.insert_scans(rows)
+
+    # 9a) Изменения состояния портов относительно прошлых сканов. Прерванный скан
+    #     (стоп, молчащий хост) не сравниваем — непроверенные порты выглядели бы закрытыми.
+    changes = []
+    if not (tcp_stats or {}).get("aborted") and not (should_stop and should_stop()):
+        baseline = db.has_port_baseline(dev_id)
+        changes = track_port_changes(dev_id, "tcp", PortSet.parse(scan_result.get("scanned_ports")), open_ports)
+        changes += track_port_changes(dev_id, "udp", PortSet.parse(scan_result.get("udp_scanned_ports")), udp_ports)
+        if not baseline:
+            changes = []  # первый полный скан устройства — это базовая линия, а не изменения
+            db.set_port_baseline(dev_id)
+        for c in changes:
+            db.insert_history(dev_id, "port_change", c)
+            if on_change:
+                on_change(c)
+
+    # 10-11) Риск (посчитан в analyze_host) и совет
     db.insert_metric(dev_id, "risk", risk)
+    advice_text = advice_for(ip, risk)
 
-    # 10) Проблемы и рекомендации
-    issues, advice_text = build_issues_and_advice(ip, open_ports, snmp_info, cves, risk)
-
-    # 11) Корректная "живость" хоста
+    # 12) Корректная "живость" хоста
     alive_tcp      = bool(open_ports)
-    alive_snmp     = bool(snmp_info)
+    alive_snmp     = bool(snmp_system)
     alive_udp_open = any(((v or {}).get("state") == "open") for v in udp_ports.values())
     alive_flag     = alive_tcp or alive_snmp or (ALIVE_FROM_UDP and alive_udp_open)
 
@@ -232,31 +850,140 @@ def scan_device(ip, mode="quick", modules=None, custom_ports=None):
         "udp_ports": udp_ports,
         "udp_special_ports": udp_special_ports,
         "snmp": snmp_info if "snmp" in modules else None,
+        "snmp_system": snmp_system if "snmp" in modules else None,
         "cves": cves if "cve" in modules else [],
         "mitre": mitre_findings if "mitre" in modules else [],
         "tls": tls_info if "tls" in modules else None,
+        "model": model,
+        "fw_version": fw_version,
         "risk": risk,
         "issues": issues,
         "advice": advice_text,
         "scanned_ports_count": scanned_tcp_count,
         "udp_scanned_ports_count": scanned_udp_count,
+        "tcp_stats": tcp_stats,
+        "changes": changes,
         "scan_mode": mode,
     }
 
 
 
-def scan_network(ips, mode="quick", modules=None, custom_ports=None):
+def scan_many(ips, mode="quick", modules=None, custom_ports=None, engine="threads",
+              host_workers=HOST_WORKERS, socket_budget=SOCKET_BUDGET, per_host=None,
+              should_stop=None, on_start=None, on_open=None, governor=None, plan=None, on_change=None,
+              port_order=None, job=None, cve_cache=None):
+    """
+    Параллельный скан нескольких хостов (генератор).
+
+    Одновременно сканируется не больше host_workers хостов; все их TCP/UDP-пробы, SNMP и TLS
+    делят один SocketBudget(socket_budget), а per_host ограничивает пробы на один хост.
+    Адреса берутся из ips лениво, по мере освобождения воркеров; SNMP-запросы (модуль "snmp")
+    уходят на SNMP_PREFETCH хостов вперёд, так что молчащие хосты стоят один таймаут на всю пачку.
+
+    Выдаёт (ip, result) в порядке завершения. on_start(ip) вызывается перед стартом хоста;
+    should_stop() → True: новые хосты не запускаются, а начатые прерывают скан портов.
+    on_open(ip, port, info) вызывается из потоков воркеров по мере нахождения открытых TCP-портов.
+    governor — общий RateGovernor (по умолчанию — с лимитами portscanner.RATE_*).
+    plan — план инкрементального режима (incremental_plan); on_change(ip, change) — изменения портов.
+    port_order — частотный порядок портов для top:N/full (по умолчанию — из истории сканов).
+    job — ScanJob: готовые в нём хосты пропускаются, недоделанные продолжаются с checkpoint'а,
+      прогресс и результаты сохраняются в задачу. Хост, скан которого прервал should_stop,
+      остаётся недоделанным.
+    cve_cache — cve_matcher.MatchCache на весь прогон (по умолчанию — свой на этот вызов):
+      одинаковые sysDescr и версии сервисов разных хостов сопоставляются с базой CVE один раз.
+    """
+    modules = modules or []
+    budget = SocketBudget(socket_budget)
+    if cve_cache is None and "cve" in modules:
+        cve_cache = cve_matcher.MatchCache()
+    governor = governor or rate_governor()
+    it = iter(ips) if job is None else (ip for ip in ips if not job.is_done(ip))
+    ahead = deque()  # (ip, snmp_request) — хосты, которым SNMP-запрос уже отправлен
+    # частотный порядок портов считаем один раз на прогон, а не на каждый хост
+    if port_order is None and (mode == "full" or parse_top_mode(mode)):
+        port_order = history_port_order()
+    if plan is None and parse_incremental_mode(mode):
+        plan = incremental_plan("scan_many", parse_incremental_mode(mode))
+
+    def next_host():
+        if "snmp" not in modules:
+            return next(it, None), None
+        while len(ahead) < SNMP_PREFETCH:
+            ip = next(it, None)
+            if ip is None:
+                break
+            ahead.append((ip, snmp_request(ip, governor, budget)))
+        return ahead.popleft() if ahead else (None, None)
+
+    def task(ip, snmp):
+        t0 = time.perf_counter()
+
+        def opened(port, info):
+            if job:
+                job.record_open(ip, port, info)
+            if on_open:
+                on_open(ip, port, info)
+
+        res = scan_device(
+            ip, mode=mode, modules=modules, custom_ports=custom_ports, engine=engine,
+            per_host=per_host, budget=budget, should_stop=should_stop, port_order=port_order, governor=governor,
+            on_open=opened if (job or on_open) else None,
+            plan=plan, on_change=(lambda change: on_change(ip, change)) if on_change else None,
+            resume=job.resume_point(ip) if job else None,
+            on_cursor=(lambda n: job.record_cursor(ip, n)) if job else None,
+            snmp=snmp, cve_cache=cve_cache,
+        )
+        res["timings"] = {"duration_ms": int((time.perf_counter() - t0) * 1000)}
+        return res
+
+    with ThreadPoolExecutor(max_workers=max(1, host_workers)) as ex:
+        pending = {}
+
+        def submit_next():
+            if should_stop and should_stop():
+                return False
+            ip, snmp = next_host()
+            if ip is None:
+                return False
+            if on_start:
+                on_start(ip)
+            pending[ex.submit(task, ip, snmp)] = ip
+            return True
+
+        while len(pending) < max(1, host_workers) and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                ip = pending.pop(fut)
+                failed = False
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    res = {"ip": ip, "error": str(e)}
+                    failed = True
+                if job and failed:
+                    job.host_failed(ip)
+                elif job and not (should_stop and should_stop()):
+                    job.host_done(ip, res)
+                yield ip, res
+                submit_next()
+
+
+def scan_network(ips, mode="quick", modules=None, custom_ports=None, engine="threads",
+                 host_workers=HOST_WORKERS, socket_budget=SOCKET_BUDGET, rate_limits=None):
     """
     Сканирует список IP, сохраняет JSON-отчёт и возвращает список результатов.
+    rate_limits — лимиты темпа проб (см. rate_governor).
     """
     modules = modules or []
-    results = []
-    for ip in ips:
-        try:
-            res = scan_device(ip, mode=mode, modules=modules, custom_ports=custom_ports)
-        except Exception as e:
-            res = {"ip": ip, "error": str(e)}
-        results.append(res)
+    results = [
+        res for _, res in scan_many(
+            ips, mode=mode, modules=modules, custom_ports=custom_ports, engine=engine,
+            host_workers=host_workers, socket_budget=socket_budget, governor=rate_governor(rate_limits),
+        )
+    ]
 
     out_dir = os.path.join("data", "reports")
     os.makedirs(out_dir, exist_ok=True)
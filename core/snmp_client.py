@@ -1,63 +1,548 @@
+# core/snmp_client.py — SNMP-запросы к устройствам через один долгоживущий event loop
+#
+# Раньше get_sysdescr на каждый IP поднимал свой event loop и puresnmp-клиент, а timeout/retries
+# игнорировались. Теперь все запросы идут через SnmpPoller: один фоновый поток с event loop,
+# один UDP-сокет на семейство адресов, сопоставление ответов по request-id (snmp_pdu),
+# настоящие таймауты и повторы. SNMP по подсети стоит примерно один таймаут, а не таймаут
+# на каждый молчащий хост.
 import asyncio
+import concurrent.futures
+import hashlib
+import ipaddress
+import itertools
+import json
 import logging
+import os
+import queue
+import random
+import socket
+import threading
 
-from puresnmp import Client, V2C, PyWrapper
+from core import snmp_pdu
 
 logger = logging.getLogger(__name__)
 
+SNMP_PORT = 161
+SNMP_TIMEOUT = 2.0       # сек на одну попытку
+SNMP_RETRIES = 1         # повторов после первой попытки
+SNMP_CONCURRENCY = 512   # запросов "в полёте" на весь poller
+SNMP_MAX_REPETITIONS = 25  # строк таблицы на один GETBULK
+SNMP_WALKS = 64          # обходов таблиц одновременно (walk_many)
 
-async def _async_get_sysdescr(ip: str, community: str = "public") -> str | None:
+# request-id из [SWEEP_RID_MIN, 0x7FFFFFFF] всегда кодируется 4 байтами: заранее собранный
+# пакет sweep'а остаётся тем же, меняются только эти 4 байта
+SWEEP_RID_MIN = 0x00800000
+
+DEFAULTS_FILE = os.path.join("system", "defaults.json")
+
+# Группа system (RFC 1213): всё нужное для опознания устройства — одним GET
+SYSTEM_OIDS = {
+    "sysdescr": snmp_pdu.OID_SYSDESCR,
+    "sysobjectid": snmp_pdu.OID_SYSOBJECTID,
+    "uptime": snmp_pdu.OID_SYSUPTIME,
+    "sysname": snmp_pdu.OID_SYSNAME,
+    "location": snmp_pdu.OID_SYSLOCATION,
+}
+
+
+def load_communities(path=DEFAULTS_FILE):
+    """Стандартные community из defaults.json ("snmp_communities"); по умолчанию — ["public"]."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            communities = json.load(f).get("snmp_communities") or []
+    except (OSError, ValueError, AttributeError):
+        communities = []
+    return [c for c in communities if isinstance(c, str) and c] or ["public"]
+
+
+SNMP_COMMUNITIES = load_communities()
+
+# Таблицы инвентаризации: (таблица БД, {колонка: OID колонки SNMP-таблицы}).
+# Колонки одной записи обходятся вместе — один GETBULK приносит целые строки.
+INVENTORY_WALKS = [
+    ("snmp_interfaces", {                     # IF-MIB ifTable
+        "descr": "1.3.6.1.2.1.2.2.1.2",
+        "type": "1.3.6.1.2.1.2.2.1.3",
+        "mtu": "1.3.6.1.2.1.2.2.1.4",
+        "speed": "1.3.6.1.2.1.2.2.1.5",
+        "mac": "1.3.6.1.2.1.2.2.1.6",
+        "admin_status": "1.3.6.1.2.1.2.2.1.7",
+        "oper_status": "1.3.6.1.2.1.2.2.1.8",
+    }),
+    ("snmp_interfaces", {                     # IF-MIB ifXTable
+        "name": "1.3.6.1.2.1.31.1.1.1.1",
+        "high_speed": "1.3.6.1.2.1.31.1.1.1.15",
+        "alias": "1.3.6.1.2.1.31.1.1.1.18",
+    }),
+    ("snmp_entities", {                       # ENTITY-MIB entPhysicalTable
+        "descr": "1.3.6.1.2.1.47.1.1.1.1.2",
+        "class": "1.3.6.1.2.1.47.1.1.1.1.5",
+        "name": "1.3.6.1.2.1.47.1.1.1.1.7",
+        "hw_rev": "1.3.6.1.2.1.47.1.1.1.1.8",
+        "fw_rev": "1.3.6.1.2.1.47.1.1.1.1.9",
+        "sw_rev": "1.3.6.1.2.1.47.1.1.1.1.10",
+        "serial": "1.3.6.1.2.1.47.1.1.1.1.11",
+        "mfg_name": "1.3.6.1.2.1.47.1.1.1.1.12",
+        "model_name": "1.3.6.1.2.1.47.1.1.1.1.13",
+    }),
+    ("snmp_arp", {                            # IP-MIB ipNetToMediaTable
+        "if_index": "1.3.6.1.2.1.4.22.1.1",
+        "mac": "1.3.6.1.2.1.4.22.1.2",
+        "ip": "1.3.6.1.2.1.4.22.1.3",
+        "type": "1.3.6.1.2.1.4.22.1.4",
+    }),
+]
+
+
+class SnmpWalkError(Exception):
+    """Обход таблицы не завершён: агент перестал отвечать или вернул ошибку."""
+
+
+class _PollerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, pending):
+        self.pending = pending
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = snmp_pdu.decode_message(data)
+        except snmp_pdu.SnmpDecodeError:
+            return
+        entry = self.pending.get(msg["request_id"])
+        if entry is None:
+            return
+        ip, fut = entry
+        if addr[0] == ip and not fut.done():
+            fut.set_result(msg)
+
+    def error_received(self, exc):
+        # ICMP port unreachable и т.п.: ждём таймаута запроса, а не роняем сокет
+        logger.debug(f"SNMP socket error: {exc}")
+
+
+def _text(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="ignore").strip("\x00").strip() or None
+    return value
+
+
+def _system_info(values, community):
+    """{oid: value} → {"community", "sysdescr", "sysobjectid", "uptime", "sysname", "location"}."""
+    info = {"community": community}
+    for field, oid in SYSTEM_OIDS.items():
+        info[field] = _text(values.get(oid))
+    return info
+
+
+def _cell(column, value):
+    """Значение ячейки для БД: MAC — "aa:bb:..", прочие OCTET STRING — текст."""
+    if isinstance(value, (bytes, bytearray)):
+        if column == "mac":
+            return ":".join(f"{b:02x}" for b in value) or None
+        return _text(value)
+    return value
+
+
+def _oid_key(oid):
+    return tuple(int(x) for x in oid.split("."))
+
+
+def _varbinds(msg):
+    """{oid: value} из ответа; noSuchObject/noSuchInstance/endOfMibView отбрасываются."""
+    if msg["error_status"]:
+        return {}
+    return {oid: v for oid, v in msg["varbinds"] if not (isinstance(v, str) and v in snmp_pdu.EXCEPTIONS.values())}
+
+
+class SnmpPoller:
     """
-    Внутренняя async-функция для получения sysDescr через puresnmp.
+    Пул SNMP GET-запросов поверх одного event loop в фоновом потоке.
 
-    Использует SNMPv2c (V2C) и OID 1.3.6.1.2.1.1.1.0 (sysDescr.0).
+    request() — корутина для самого loop'а; submit()/get()/poll() — для обычных потоков.
+    Одновременно в полёте не больше concurrency запросов; governor (RateGovernor) задаёт темп.
     """
-    try:
-        # Создаём клиента и оборачиваем его в PyWrapper, чтобы на выходе были
-        # нормальные питоновские типы, а не SNMP-специфичные объекты.
-        client = PyWrapper(Client(ip, V2C(community)))
 
-        # Пример из официальной документации puresnmp:
-        # output = await client.get("1.3.6.1.2.1.1.1.0")
-        # 
-        value = await client.get("1.3.6.1.2.1.1.1.0")
+    def __init__(self, concurrency=SNMP_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._sem = None
+        self._transports = {}
+        self._pending = {}
+        self._ids = itertools.count(random.randrange(1, 1 << 30))
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            threading.Thread(target=run, name="snmp-poller", daemon=True).start()
+            started.wait()
+            self._sem = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+            return loop
+
+    def _next_id(self):
+        # request-id — 32-битный INTEGER со знаком
+        return next(self._ids) % 0x7FFFFFFF or 1
+
+    async def _transport(self, ip):
+        family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+        transport = self._transports.get(family)
+        if transport is None or transport.is_closing():
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(lambda: _PollerProtocol(self._pending), family=family)
+            self._transports[family] = transport
+        return transport
+
+    async def request(self, ip, oids, community="public", timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES,
+                      governor=None, version=snmp_pdu.SNMP_V2C, port=SNMP_PORT, budget=None):
+        """
+        Один GET (с повторами): {oid: value} или None, если ответа нет.
+        Выполняется в loop'е poller'а. budget — SocketBudget прогона: запрос занимает в нём слот.
+        """
+        msg = await self._exchange(
+            ip, lambda rid: snmp_pdu.encode_get(community, oids, request_id=rid, version=version),
+            timeout=timeout, retries=retries, governor=governor, port=port, budget=budget,
+        )
+        return _varbinds(msg) if msg is not None else None
 
-        # На многих устройствах это байты → декодируем аккуратно
-        if isinstance(value, (bytes, bytearray)):
+    async def _exchange(self, ip, build, timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES, governor=None, port=SNMP_PORT,
+                        budget=None):
+        """
+        Запрос build(request_id) → разобранный ответ (snmp_pdu.decode_message) или None.
+        budget — SocketBudget прогона: слот занят на всё время обмена, включая повторы.
+        """
+        async with self._sem:
+            if budget is not None:
+                await budget.acquire_async()
             try:
-                return value.decode("utf-8", errors="ignore")
-            except Exception:
-                return str(value)
+                loop = asyncio.get_running_loop()
+                transport = await self._transport(ip)
+                for _ in range(max(0, retries) + 1):
+                    rid = self._next_id()
+                    fut = loop.create_future()
+                    self._pending[rid] = (ip, fut)
+                    try:
+                        if governor is not None:
+                            await governor.acquire_async(ip)
+                        transport.sendto(build(rid), (ip, port))
+                        return await asyncio.wait_for(fut, timeout)
+                    except asyncio.TimeoutError:
+                        continue
+                    finally:
+                        self._pending.pop(rid, None)
+                return None
+            finally:
+                if budget is not None:
+                    budget.release()
+
+    async def walk(self, ip, columns, community="public", max_repetitions=SNMP_MAX_REPETITIONS, **kwargs):
+        """
+        Обход SNMP-таблицы GETBULK'ами (асинхронный генератор).
+
+        columns — {имя: OID колонки}; все ещё не законченные колонки идут в одном запросе,
+        так что ответ приносит до max_repetitions целых строк. Выдаёт пачки ячеек
+        [(имя, индекс строки, значение), ...] — по одной на ответ, ничего не копя в памяти.
+        На tooBig размер пачки уменьшается вдвое. SnmpWalkError — агент замолчал или ответил ошибкой.
+        """
+        cursors = dict(columns)   # имя → последний полученный OID колонки
+        reps = max(1, max_repetitions)
+        while cursors:
+            names = list(cursors)
+            oids = [cursors[n] for n in names]
+            msg = await self._exchange(
+                ip, lambda rid: snmp_pdu.encode_getbulk(community, oids, request_id=rid, max_repetitions=reps),
+                **kwargs,
+            )
+            if msg is None:
+                raise SnmpWalkError(f"{ip}: no response")
+            if msg["error_status"] == snmp_pdu.ERR_TOO_BIG and reps > 1:
+                reps = max(1, reps // 2)
+                continue
+            if msg["error_status"]:
+                raise SnmpWalkError(f"{ip}: error-status {msg['error_status']}")
+
+            cells = []
+            finished = set()
+            for i, (oid, value) in enumerate(msg["varbinds"]):
+                name = names[i % len(names)]
+                if name in finished:
+                    continue
+                root = columns[name]
+                if (not oid.startswith(root + ".") or value == "endOfMibView"
+                        or _oid_key(oid) <= _oid_key(cursors[name])):
+                    finished.add(name)  # колонка кончилась (или агент пошёл по кругу)
+                    continue
+                cursors[name] = oid
+                cells.append((name, oid[len(root) + 1:], _cell(name, value)))
+            if not msg["varbinds"]:
+                finished.update(names)
+            for name in finished:
+                cursors.pop(name, None)
+            if cells:
+                yield cells
+
+    def walk_many(self, jobs, parallel=SNMP_WALKS, **kwargs):
+        """
+        Обход многих таблиц на многих устройствах (генератор).
+
+        jobs — [(key, ip, columns, community), ...]; одновременно идут до parallel обходов,
+        запросы разных обходов конвейеризуются в одном loop'е. Выдаёт по мере ответов
+          (key, "cells", [(имя, индекс, значение), ...]) и в конце каждого обхода (key, "end", ok).
+        """
+        loop = self._ensure_loop()
+        out = queue.Queue()
+        it = iter(list(jobs))
+
+        async def worker():
+            for key, ip, columns, community in it:
+                ok = True
+                try:
+                    async for cells in self.walk(ip, columns, community=community, **kwargs):
+                        out.put((key, "cells", cells))
+                except (SnmpWalkError, OSError) as e:
+                    logger.info(f"SNMP walk stopped: {e}")
+                    ok = False
+                out.put((key, "end", ok))
+
+        async def run():
+            try:
+                await asyncio.gather(*(worker() for _ in range(max(1, parallel))))
+            finally:
+                out.put(None)
+
+        fut = asyncio.run_coroutine_threadsafe(run(), loop)
+        try:
+            while True:
+                item = out.get()
+                if item is None:
+                    break
+                yield item
+            fut.result()
+        finally:
+            fut.cancel()
 
-        return str(value)
+    async def identify(self, ip, communities=None, **kwargs):
+        """
+        Группа system (SYSTEM_OIDS) одним GET'ом, все communities — одновременно.
+        Побеждает первая community, на которую устройство ответило (v2c-агент на чужую
+        community молчит), остальные запросы отменяются.
+        Возвращает _system_info(...) с полем "community" или None, если не ответила ни одна.
+        """
+        oids = list(SYSTEM_OIDS.values())
+        tasks = {
+            asyncio.ensure_future(self.request(ip, oids, community=c, **kwargs)): c
+            for c in dict.fromkeys(communities or SNMP_COMMUNITIES)
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    values = task.result()
+                    if values is not None:
+                        return _system_info(values, tasks[task])
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def submit(self, ip, oids, **kwargs):
+        """Запускает request() в loop'е poller'а, возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.request(ip, oids, **kwargs), self._ensure_loop())
+
+    def submit_identify(self, ip, **kwargs):
+        """Запускает identify() в loop'е poller'а, возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.identify(ip, **kwargs), self._ensure_loop())
+
+    def get(self, ip, oids, **kwargs):
+        return self.submit(ip, oids, **kwargs).result()
+
+    def poll(self, ips, oids, **kwargs):
+        """
+        GET на пачку хостов (генератор): все запросы уходят сразу (в пределах concurrency),
+        (ip, {oid: value} | None) выдаются по мере прихода ответов и таймаутов.
+        ips читается лениво — в памяти не больше 2*concurrency незавершённых запросов.
+        """
+        return self._poll(ips, lambda ip: self.submit(ip, oids, **kwargs))
 
-    except Exception as e:
-        logger.warning(f"SNMP (puresnmp) query failed for {ip}: {e}")
+    def poll_identify(self, ips, **kwargs):
+        """Как poll(), но identify(): (ip, system_info | None)."""
+        return self._poll(ips, lambda ip: self.submit_identify(ip, **kwargs))
+
+    def _poll(self, ips, submit):
+        it = iter(ips)
+        pending = {}
+
+        def submit_next():
+            ip = next(it, None)
+            if ip is None:
+                return False
+            pending[submit(ip)] = ip
+            return True
+
+        while len(pending) < 2 * self.concurrency and submit_next():
+            pass
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                ip = pending.pop(fut)
+                try:
+                    res = fut.result()
+                except OSError as e:
+                    logger.warning(f"SNMP query failed for {ip}: {e}")
+                    res = None
+                yield ip, res
+                submit_next()
+
+
+def _sweep_rid(ip, key):
+    """
+    request-id пакета sweep'а для адреса — ключевой хэш адреса. Ответ проверяется пересчётом
+    по адресу отправителя, так что на отправленные запросы не нужно хранить никакого состояния.
+    """
+    h = hashlib.blake2b(ipaddress.ip_address(ip).packed, digest_size=4, key=key).digest()
+    return SWEEP_RID_MIN + int.from_bytes(h, "big") % (0x7FFFFFFF - SWEEP_RID_MIN)
+
+
+def _sweep_template(community):
+    """GET sysDescr.0, разрезанный вокруг 4 байт request-id: (head, tail)."""
+    marker = 0x7E5A5A5A
+    pkt = snmp_pdu.encode_get(community, [snmp_pdu.OID_SYSDESCR], request_id=marker)
+    i = pkt.rfind(marker.to_bytes(4, "big"))  # request-id идёт после community
+    return pkt[:i], pkt[i + 4:]
+
+
+class _SweepProtocol(asyncio.DatagramProtocol):
+    def __init__(self, key, results):
+        self.key = key
+        self.results = results
+
+    def datagram_received(self, data, addr):
+        ip = addr[0]
+        if addr[1] != SNMP_PORT or ip in self.results:
+            return
+        try:
+            msg = snmp_pdu.decode_message(data)
+            if msg["request_id"] != _sweep_rid(ip, self.key):
+                return
+        except (snmp_pdu.SnmpDecodeError, ValueError):
+            return
+        self.results[ip] = decode_sysdescr(_varbinds(msg))
+
+    def error_received(self, exc):
+        pass
+
+
+async def async_snmp_sweep(ips, communities=None, timeout=SNMP_TIMEOUT, retries=0, governor=None):
+    """
+    SNMP-обнаружение по диапазону: заранее собранные GET sysDescr.0 (на каждую community)
+    уходят на все адреса ips с одного UDP-сокета в темпе governor'а, ответы сопоставляются
+    по request-id (_sweep_rid). После отправки ждём timeout; retries — повторные проходы
+    по ещё не ответившим (ips тогда должен итерироваться повторно: список, TargetSet, TargetOrder).
+    Память — O(ответивших), а не O(адресов).
+    Возвращает {ip: sysDescr} (None — ответил, но sysDescr не отдал).
+    """
+    templates = [_sweep_template(c) for c in dict.fromkeys(communities or SNMP_COMMUNITIES)]
+    key = os.urandom(16)
+    results = {}
+    transports = {}
+    loop = asyncio.get_running_loop()
+    try:
+        for _ in range(max(0, retries) + 1):
+            sent = 0
+            for ip in ips:
+                if ip in results:
+                    continue
+                family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+                if family not in transports:
+                    transports[family], _ = await loop.create_datagram_endpoint(
+                        lambda: _SweepProtocol(key, results), family=family)
+                rid = _sweep_rid(ip, key).to_bytes(4, "big")
+                for head, tail in templates:
+                    if governor is not None:
+                        await governor.acquire_async(ip)
+                    transports[family].sendto(head + rid + tail, (ip, SNMP_PORT))
+                    sent += 1
+                    if sent % 256 == 0:
+                        await asyncio.sleep(0)  # даём циклу вычитать ответы и сбросить буфер отправки
+            await asyncio.sleep(timeout)
+    finally:
+        for transport in transports.values():
+            transport.close()
+    return results
+
+
+def snmp_sweep(ips, communities=None, timeout=SNMP_TIMEOUT, retries=0, governor=None):
+    """Синхронная обёртка над async_snmp_sweep: {ip: sysDescr}."""
+    return asyncio.run(async_snmp_sweep(ips, communities=communities, timeout=timeout, retries=retries,
+                                        governor=governor))
+
+
+_POLLER = None
+_POLLER_LOCK = threading.Lock()
+
+
+def get_poller():
+    """Общий SnmpPoller процесса (создаётся при первом обращении)."""
+    global _POLLER
+    with _POLLER_LOCK:
+        if _POLLER is None:
+            _POLLER = SnmpPoller()
+        return _POLLER
+
+
+def decode_sysdescr(values):
+    """sysDescr из {oid: value} в виде строки или None."""
+    value = (values or {}).get(snmp_pdu.OID_SYSDESCR)
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="ignore")
+    return str(value)
+
+
+def get_system_info(ip, communities=None, timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES, governor=None):
+    """
+    sysDescr, sysObjectID, sysUpTime, sysName, sysLocation и подошедшая community
+    (см. SnmpPoller.identify) или None.
+    """
+    try:
+        return get_poller().submit_identify(ip, communities=communities, timeout=timeout, retries=retries,
+                                            governor=governor).result()
+    except OSError as e:
+        logger.warning(f"SNMP query failed for {ip}: {e}")
         return None
 
 
-def get_sysdescr(ip: str, community: str = "public", timeout: int = 2, retries: int = 1) -> str | None:
+def get_sysdescr(ip: str, community: str = "public", timeout: float = SNMP_TIMEOUT,
+                 retries: int = SNMP_RETRIES, governor=None) -> str | None:
     """
     Возвращает SNMP sysDescr (описание устройства) или None.
 
-    Совместимая с прежней версия сигнатура:
       - ip        — IP-адрес устройства
       - community — SNMP community (по умолчанию 'public')
-      - timeout   — сейчас НЕ используется (puresnmp использует свои дефолты)
-      - retries   — сейчас НЕ используется
-
-    Внутри синхронной функции просто запускаем async-функцию через asyncio.
+      - timeout   — сек на одну попытку
+      - retries   — повторов после первой попытки
     """
     try:
-        # Обычный случай: Flask/потоки → event loop ещё не запущен
-        return asyncio.run(_async_get_sysdescr(ip, community))
-    except RuntimeError as e:
-        # На всякий случай fallback, если вдруг вызов идёт из уже работающего event loop
-        logger.debug(f"get_sysdescr: fallback event loop for {ip}: {e}")
-        loop = asyncio.new_event_loop()
-        try:
-            asyncio.set_event_loop(loop)
-            return loop.run_until_complete(_async_get_sysdescr(ip, community))
-        finally:
-            loop.close()
-            asyncio.set_event_loop(None)
+        values = get_poller().get(ip, [snmp_pdu.OID_SYSDESCR], community=community, timeout=timeout,
+                                  retries=retries, governor=governor)
+    except OSError as e:
+        logger.warning(f"SNMP query failed for {ip}: {e}")
+        return None
+    return decode_sysdescr(values)
+
+
+def poll_sysdescr(ips, community="public", timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES, governor=None):
+    """sysDescr для пачки хостов: генератор (ip, sysdescr | None) по мере ответов."""
+    for ip, values in get_poller().poll(ips, [snmp_pdu.OID_SYSDESCR], community=community, timeout=timeout,
+                                        retries=retries, governor=governor):
+        yield ip, decode_sysdescr(values)
@@ -0,0 +1,211 @@
+# core/snmp_pdu.py — минимальный BER-кодек SNMP v1/v2c (без внешних зависимостей)
+#
+# Используется SnmpPoller'ом (core/snmp_client.py) и быстрыми проверками "живости":
+# массовые опросы с одного UDP-сокета без внешних SNMP-библиотек.
+
+SNMP_V1 = 0
+SNMP_V2C = 1
+
+# Типы PDU
+PDU_GET = 0xA0
+PDU_GETNEXT = 0xA1
+PDU_RESPONSE = 0xA2
+PDU_GETBULK = 0xA5
+
+# error-status (RFC 3416)
+ERR_TOO_BIG = 1
+
+# Часто используемые OID'ы
+OID_SYSDESCR = "1.3.6.1.2.1.1.1.0"
+OID_SYSOBJECTID = "1.3.6.1.2.1.1.2.0"
+OID_SYSUPTIME = "1.3.6.1.2.1.1.3.0"
+OID_SYSNAME = "1.3.6.1.2.1.1.5.0"
+OID_SYSLOCATION = "1.3.6.1.2.1.1.6.0"
+
+# Универсальные и прикладные теги ASN.1/SNMP
+_INTEGER = 0x02
+_OCTET_STRING = 0x04
+_NULL = 0x05
+_OID = 0x06
+_SEQUENCE = 0x30
+_IPADDRESS = 0x40
+_COUNTER32 = 0x41
+_GAUGE32 = 0x42
+_TIMETICKS = 0x43
+_OPAQUE = 0x44
+_COUNTER64 = 0x46
+_NO_SUCH_OBJECT = 0x80
+_NO_SUCH_INSTANCE = 0x81
+_END_OF_MIB_VIEW = 0x82
+
+# Значения-исключения SNMPv2 (RFC 3416) возвращаем как строки-маркеры
+EXCEPTIONS = {
+    _NO_SUCH_OBJECT: "noSuchObject",
+    _NO_SUCH_INSTANCE: "noSuchInstance",
+    _END_OF_MIB_VIEW: "endOfMibView",
+}
+
+
+class SnmpDecodeError(ValueError):
+    """Пакет не похож на корректное SNMP-сообщение."""
+
+
+# ---------- кодирование ----------
+
+def _encode_length(n):
+    if n < 0x80:
+        return bytes([n])
+    out = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(out)]) + out
+
+
+def _tlv(tag, payload):
+    return bytes([tag]) + _encode_length(len(payload)) + payload
+
+
+def _encode_int(v, tag=_INTEGER):
+    # минимальное дополнение до двух (BER)
+    length = max(1, (v + (v < 0)).bit_length() // 8 + 1)
+    return _tlv(tag, v.to_bytes(length, "big", signed=True))
+
+
+def _encode_oid(oid):
+    parts = [int(x) for x in oid.strip(".").split(".")]
+    if len(parts) < 2:
+        raise ValueError(f"bad OID: {oid}")
+    out = bytearray([parts[0] * 40 + parts[1]])
+    for p in parts[2:]:
+        chunk = [p & 0x7F]
+        p >>= 7
+        while p:
+            chunk.append(0x80 | (p & 0x7F))
+            p >>= 7
+        out.extend(reversed(chunk))
+    return _tlv(_OID, bytes(out))
+
+
+def _encode_message(community, oids, request_id, version, pdu_type, field1=0, field2=0):
+    if isinstance(community, str):
+        community = community.encode()
+    varbinds = b"".join(_tlv(_SEQUENCE, _encode_oid(o) + _tlv(_NULL, b"")) for o in oids)
+    pdu = _tlv(
+        pdu_type,
+        _encode_int(request_id) + _encode_int(field1) + _encode_int(field2) + _tlv(_SEQUENCE, varbinds),
+    )
+    return _tlv(_SEQUENCE, _encode_int(version) + _tlv(_OCTET_STRING, community) + pdu)
+
+
+def encode_get(community, oids, request_id=1, version=SNMP_V2C, pdu_type=PDU_GET):
+    """
+    Собирает SNMP GET (или GETNEXT) с NULL-значениями для списка OID'ов.
+    """
+    return _encode_message(community, oids, request_id, version, pdu_type)
+
+
+def encode_getbulk(community, oids, request_id=1, non_repeaters=0, max_repetitions=10):
+    """
+    Собирает SNMPv2c GETBULK: первые non_repeaters OID'ов — как GETNEXT, для остальных
+    агент возвращает до max_repetitions следующих значений (в ответе — построчно:
+    [col1, col2, ..., col1, col2, ...]).
+    """
+    return _encode_message(community, oids, request_id, SNMP_V2C, PDU_GETBULK, non_repeaters, max_repetitions)
+
+
+# ---------- декодирование ----------
+
+def _read_tlv(data, pos):
+    """Возвращает (tag, value_start, value_end) для TLV, начинающегося в pos."""
+    if pos + 2 > len(data):
+        raise SnmpDecodeError("truncated TLV")
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        if n == 0 or n > 4 or pos + n > len(data):
+            raise SnmpDecodeError("bad length")
+        length = int.from_bytes(data[pos:pos + n], "big")
+        pos += n
+    end = pos + length
+    if end > len(data):
+        raise SnmpDecodeError("truncated value")
+    return tag, pos, end
+
+
+def _decode_oid(raw):
+    if not raw:
+        return ""
+    first = raw[0]
+    parts = [first // 40, first % 40] if first < 80 else [2, first - 80]
+    v = 0
+    for b in raw[1:]:
+        v = (v << 7) | (b & 0x7F)
+        if not b & 0x80:
+            parts.append(v)
+            v = 0
+    return ".".join(str(p) for p in parts)
+
+
+def _decode_value(tag, raw):
+    if tag == _INTEGER:
+        return int.from_bytes(raw, "big", signed=True)
+    if tag in (_COUNTER32, _GAUGE32, _TIMETICKS, _COUNTER64):
+        return int.from_bytes(raw, "big", signed=False)
+    if tag in (_OCTET_STRING, _OPAQUE):
+        return bytes(raw)
+    if tag == _OID:
+        return _decode_oid(raw)
+    if tag == _IPADDRESS:
+        return ".".join(str(b) for b in raw)
+    if tag == _NULL:
+        return None
+    if tag in EXCEPTIONS:
+        return EXCEPTIONS[tag]
+    return bytes(raw)
+
+
+def decode_message(data):
+    """
+    Разбирает SNMP v1/v2c сообщение:
+      {"version", "community", "pdu_type", "request_id", "error_status", "error_index",
+       "varbinds": [(oid, value), ...]}
+    Бросает SnmpDecodeError, если это не SNMP.
+    """
+    try:
+        tag, pos, end = _read_tlv(data, 0)
+        if tag != _SEQUENCE:
+            raise SnmpDecodeError("not a sequence")
+        tag, s, e = _read_tlv(data, pos)
+        version = _decode_value(tag, data[s:e])
+        tag, s, pos = _read_tlv(data, e)
+        community = bytes(data[s:pos])
+        pdu_type, pos, pdu_end = _read_tlv(data, pos)
+        fields = []
+        for _ in range(3):
+            tag, s, pos = _read_tlv(data, pos)
+            if tag != _INTEGER:
+                raise SnmpDecodeError("bad PDU header")
+            fields.append(int.from_bytes(data[s:pos], "big", signed=True))
+        tag, pos, vb_end = _read_tlv(data, pos)
+        varbinds = []
+        while pos < vb_end:
+            _, s, item_end = _read_tlv(data, pos)
+            tag, os_, oe = _read_tlv(data, s)
+            oid = _decode_oid(data[os_:oe])
+            vtag, vs, ve = _read_tlv(data, oe)
+            varbinds.append((oid, _decode_value(vtag, data[vs:ve])))
+            pos = item_end
+    except (IndexError, ValueError) as e:
+        if isinstance(e, SnmpDecodeError):
+            raise
+        raise SnmpDecodeError(str(e)) from e
+
+    return {
+        "version": version,
+        "community": community.decode(errors="ignore"),
+        "pdu_type": pdu_type,
+        "request_id": fields[0],
+        "error_status": fields[1],
+        "error_index": fields[2],
+        "varbinds": varbinds,
+    }
@@ -0,0 +1,291 @@
+# core/targets.py — цели скана как множество диапазонов адресов
+#
+# Раньше цель разворачивалась в список строк (а для /8 это ~16 млн строк ещё до начала скана).
+# Здесь адреса хранятся целыми числами в виде непересекающихся диапазонов, а обход —
+# ленивый: память O(число диапазонов), а не O(число адресов).
+import ipaddress
+import random
+from bisect import bisect_right
+
+# IPv6-адреса храним со сдвигом, чтобы их числа не пересекались с IPv4
+_V6_BASE = 1 << 32
+
+ORDER_SEQUENTIAL = "sequential"   # по возрастанию адресов
+ORDER_RANDOM = "random"           # псевдослучайная перестановка (без хранения списка)
+ORDER_INTERLEAVED = "interleaved" # соседние адреса из разных /24: нагрузка размазывается по подсетям
+ORDERS = (ORDER_SEQUENTIAL, ORDER_RANDOM, ORDER_INTERLEAVED)
+
+INTERLEAVE_STRIDE = 256           # шаг обхода в режиме interleaved (размер /24)
+
+_M64 = (1 << 64) - 1
+
+
+def _key(addr):
+    addr = ipaddress.ip_address(addr)
+    return int(addr) + (_V6_BASE if addr.version == 6 else 0)
+
+
+def _addr(key):
+    return str(ipaddress.IPv4Address(key) if key < _V6_BASE else ipaddress.IPv6Address(key - _V6_BASE))
+
+
+def _parse_part(part, hosts_only=True):
+    """
+    Один элемент цели → (start, end) или None, если диапазон пуст. Бросает ValueError.
+    hosts_only=False — подсеть целиком, с адресом сети и broadcast (для исключений).
+    """
+    # CIDR-подсеть: как ip_network(...).hosts() — без адреса сети и broadcast
+    if "/" in part:
+        net = ipaddress.ip_network(part, strict=False)
+        start, end = _key(net.network_address), _key(net.broadcast_address)
+        if not hosts_only:
+            return start, end
+        if net.version == 4 and net.prefixlen < 31:
+            start, end = start + 1, end - 1
+        elif net.version == 6 and net.prefixlen < 127:
+            start += 1
+        return (start, end) if start <= end else None
+
+    # Диапазон: 192.168.1.3-192.168.1.10 или 192.168.1.3-10
+    if "-" in part:
+        start_str, end_str = [x.strip() for x in part.split("-", 1)]
+        start_ip = ipaddress.ip_address(start_str)
+        if "." in end_str or ":" in end_str:
+            end_ip = ipaddress.ip_address(end_str)
+            if end_ip.version != start_ip.version:
+                raise ValueError(f"mixed address families: {part}")
+        else:
+            # меняется только последний октет
+            if start_ip.version != 4:
+                raise ValueError(f"bad range: {part}")
+            last = int(end_str)
+            if not 0 <= last <= 255:
+                raise ValueError(f"bad range: {part}")
+            end_ip = ipaddress.IPv4Address((int(start_ip) & ~0xFF) | last)
+        start, end = sorted((_key(start_ip), _key(end_ip)))
+        return start, end
+
+    # Одиночный IP
+    k = _key(part)
+    return k, k
+
+
+def _mix(x):
+    # финализатор splitmix64 — раундовая функция сети Фейстеля
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _M64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _M64
+    return x ^ (x >> 31)
+
+
+def _permutation(n, seed=None):
+    """
+    Псевдослучайная перестановка 0..n-1 без хранения: 4-раундовая сеть Фейстеля — биекция
+    на [0, 4^k) ⊇ [0, n). Cycle walking: шифр применяется к индексу повторно, пока результат
+    не попадёт в [0, n) — снова биекция, уже на [0, n); n > 4^k / 4, так что в среднем
+    меньше 4 применений на индекс.
+    """
+    if n <= 1:
+        yield from range(n)
+        return
+    half = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    rnd = random.Random(seed)
+    keys = [rnd.getrandbits(64) for _ in range(4)]
+    for i in range(n):
+        y = i
+        while True:
+            left, right = y >> half, y & mask
+            for k in keys:
+                left, right = right, left ^ (_mix(right ^ k) & mask)
+            y = (left << half) | right
+            if y < n:
+                break
+        yield y
+
+
+def _interleave(n, stride=INTERLEAVE_STRIDE):
+    """0, stride, 2*stride, ..., 1, 1+stride, ... — каждый индекс ровно один раз."""
+    for offset in range(min(stride, n)):
+        yield from range(offset, n, stride)
+
+
+class TargetSet:
+    """
+    Множество адресов цели: отсортированный список непересекающихся диапазонов
+    [(start, end), ...] целых чисел (end включительно) — по аналогии с portscanner.PortSet.
+
+    Пересекающиеся и смежные диапазоны сливаются, исключения (exclude) вычитаются слиянием
+    за O(диапазонов), len() и "ip in targets" не разворачивают адреса.
+    iter_order() выдаёт адреса строками в нужном порядке (ORDERS) тоже лениво.
+    """
+
+    __slots__ = ("_starts", "_ends", "_offsets", "_len")
+
+    def __init__(self, ranges=()):
+        starts, ends = [], []
+        for start, end in sorted((int(a), int(b)) for a, b in ranges):
+            if start > end:
+                continue
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._starts = starts
+        self._ends = ends
+        # _offsets[i] — сколько адресов в диапазонах до i-го (индекс → адрес бинарным поиском)
+        self._offsets = []
+        total = 0
+        for s, e in zip(starts, ends):
+            self._offsets.append(total)
+            total += e - s + 1
+        self._len = total
+
+    @classmethod
+    def parse(cls, spec, strict=False, hosts_only=True):
+        """
+        Поддерживает:
+        - одиночный IP:      192.168.1.10
+        - список IP:         192.168.1.2,192.168.1.14
+        - диапазон по хостам 192.168.1.3-192.168.1.10 или 192.168.1.3-10
+        - подсети:           192.168.1.0/24
+        Можно комбинировать: 192.168.1.2,192.168.1.3-5,192.168.2.0/30
+        Некорректные элементы пропускаются, а при strict=True — ValueError
+        (для исключений: молча потерянный диапазон означал бы скан того, что трогать нельзя).
+        hosts_only=False — подсети берутся целиком, вместе с адресом сети и broadcast.
+        """
+        ranges = []
+        for part in (spec or "").split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                r = _parse_part(part, hosts_only)
+            except ValueError:
+                if strict:
+                    raise ValueError(f"некорректный адрес/диапазон: {part}")
+                continue
+            if r:
+                ranges.append(r)
+        return cls(ranges)
+
+    @classmethod
+    def from_addresses(cls, ips):
+        """Множество из отдельных адресов (соседние сливаются в диапазоны)."""
+        return cls((k, k) for k in (_key(ip) for ip in ips))
+
+    def ranges(self):
+        return list(zip(self._starts, self._ends))
+
+    def to_spec(self):
+        """Обратное к parse: "192.168.1.1-192.168.1.254,10.0.0.5"."""
+        return ",".join(_addr(s) if s == e else f"{_addr(s)}-{_addr(e)}" for s, e in zip(self._starts, self._ends))
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        for s, e in zip(self._starts, self._ends):
+            for k in range(s, e + 1):
+                yield _addr(k)
+
+    def __contains__(self, ip):
+        try:
+            k = _key(ip)
+        except ValueError:
+            return False
+        i = bisect_right(self._starts, k) - 1
+        return i >= 0 and k <= self._ends[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, TargetSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    def __repr__(self):
+        return f"TargetSet({self.to_spec()!r})"
+
+    def union(self, other):
+        return TargetSet(self.ranges() + other.ranges())
+
+    def difference(self, other):
+        b = other.ranges()
+        out = []
+        j = 0
+        for start, end in self.ranges():
+            while j < len(b) and b[j][1] < start:
+                j += 1
+            k = j
+            while k < len(b) and b[k][0] <= end:
+                if b[k][0] > start:
+                    out.append((start, b[k][0] - 1))
+                start = max(start, b[k][1] + 1)
+                k += 1
+            if start <= end:
+                out.append((start, end))
+        return TargetSet(out)
+
+    __or__ = union
+    __sub__ = difference
+
+    def exclude(self, spec):
+        """
+        Вычитает исключения: TargetSet, строку цели (strict) или набор адресов.
+        Подсеть в исключении — целиком, включая адрес сети и broadcast: исключение
+        не должно пропускать ни одного своего адреса.
+
+        >>> TargetSet.parse("10.0.0.0/8").exclude("10.0.0.0/9")
+        TargetSet('10.128.0.0-10.255.255.254')
+        >>> TargetSet.parse("192.168.1.0/24").exclude("192.168.1.0/25,192.168.1.128/25")
+        TargetSet('')
+        """
+        if isinstance(spec, str):
+            spec = TargetSet.parse(spec, strict=True, hosts_only=False)
+        elif not isinstance(spec, TargetSet):
+            spec = TargetSet.from_addresses(spec)
+        return self.difference(spec)
+
+    def address_at(self, index):
+        """index-й адрес по возрастанию (0 <= index < len)."""
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        i = bisect_right(self._offsets, index) - 1
+        return _addr(self._starts[i] + index - self._offsets[i])
+
+    def iter_order(self, order=ORDER_SEQUENTIAL, seed=None):
+        """
+        Ленивый обход адресов в порядке order (ORDERS). Для random порядок задаётся seed:
+        с тем же seed обход повторяется (нужно для воспроизводимости прогона).
+        """
+        if order == ORDER_SEQUENTIAL:
+            return iter(self)
+        if order == ORDER_RANDOM:
+            indexes = _permutation(self._len, seed)
+        elif order == ORDER_INTERLEAVED:
+            indexes = _interleave(self._len)
+        else:
+            raise ValueError(f"unknown order: {order}")
+        return (self.address_at(i) for i in indexes)
+
+
+class TargetOrder:
+    """
+    Повторно итерируемый обход TargetSet в порядке order (как portscanner.PortOrder для портов):
+    каждый проход — заново и лениво, в том же порядке (для повторных проходов по не ответившим).
+    """
+
+    def __init__(self, targets, order=ORDER_SEQUENTIAL, seed=None):
+        if order not in ORDERS:
+            raise ValueError(f"unknown order: {order}")
+        self.targets = targets
+        self.order = order
+        self.seed = random.getrandbits(32) if seed is None else seed
+
+    def __iter__(self):
+        return self.targets.iter_order(self.order, self.seed)
+
+    def __len__(self):
+        return len(self.targets)
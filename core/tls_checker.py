@@ -1,25 +1,15 @@
-# core/tls_checker.py — более совместимая проверка TLS-сертификата
+# core/tls_checker.py — проверка TLS-сертификатов на открытых портах
+#
+# Одно TLS-рукопожатие на порт: сертификат берётся из него же в DER (getpeercert(binary_form=True))
+# и разбирается через cryptography — второе соединение не нужно. Рукопожатия идут в asyncio
+# одновременно по всем TLS-портам хоста, у каждого — жёсткий дедлайн на connect + handshake.
+import asyncio
+import contextlib
+import hashlib
 import ssl
-import socket
-import tempfile
-import os
 
-
-def _extract_name_from_seq(seq):
-    """
-    subject/issuer из ssl.getpeercert() имеют вид:
-      [
-        (('commonName', 'one.one.one.one'),),
-        (('countryName', 'US'),),
-        ...
-      ]
-    Превратим это в простой dict.
-    """
-    result = {}
-    for rdn in seq or []:
-        for key, value in rdn:
-            result[key] = value
-    return result
+TLS_TIMEOUT = 3.0       # сек на connect + handshake одного порта
+TLS_CONCURRENCY = 16    # одновременных рукопожатий на хост (общий лимит прогона — SocketBudget)
 
 
 def _x509_name_to_dict(x509_name):
@@ -35,74 +25,128 @@ def _x509_name_to_dict(x509_name):
     return result
 
 
-def _decode_cert_pem(pem_str: str):
-    """
-    Разбираем PEM-сертификат через библиотеку cryptography.
-    Это кроссплатформенный способ, не завязанный на приватный ssl._test_decode_cert.
-    """
+def _decode_cert_der(der: bytes):
+    """Разбираем DER-сертификат из рукопожатия через библиотеку cryptography."""
     try:
         from cryptography import x509
-        from cryptography.hazmat.backends import default_backend
     except ImportError as e:
         # Если cryptography не установлена — бросаем понятную ошибку
         raise RuntimeError("cryptography is not installed (pip install cryptography)") from e
 
-    cert = x509.load_pem_x509_certificate(pem_str.encode("ascii"), default_backend())
-
-    subject = _x509_name_to_dict(cert.subject)
-    issuer = _x509_name_to_dict(cert.issuer)
-
-    # Даты делаем в ISO-формате, его удобно парсить/отображать
-    not_before = cert.not_valid_before.isoformat()
-    not_after = cert.not_valid_after.isoformat()
+    cert = x509.load_der_x509_certificate(der)
+    # cryptography >= 42: *_utc; в старых версиях — naive datetime в UTC
+    not_before = getattr(cert, "not_valid_before_utc", None) or cert.not_valid_before
+    not_after = getattr(cert, "not_valid_after_utc", None) or cert.not_valid_after
 
     return {
-        "subject": subject,
-        "issuer": issuer,
-        "notBefore": not_before,
-        "notAfter": not_after,
+        "subject": _x509_name_to_dict(cert.subject),
+        "issuer": _x509_name_to_dict(cert.issuer),
+        # Даты делаем в ISO-формате, его удобно парсить/отображать
+        "notBefore": not_before.isoformat(),
+        "notAfter": not_after.isoformat(),
+        "serial": format(cert.serial_number, "x"),
+        "sha256": hashlib.sha256(der).hexdigest(),
     }
 
 
-def _try_modern_context(ip, port, timeout, hostname):
+def _error(message):
+    return {"error": f"TLS check failed: {message}", "subject": None, "issuer": None,
+            "notBefore": None, "notAfter": None}
+
+
+def _client_context():
     """
-    Первая попытка: нормальный modern TLS-контекст.
-    Может вернуть:
-      - dict с полями subject/issuer/даты
-      - None, если cert пустой
+    Контекст без проверки сертификата и с максимальной совместимостью: на сетевом оборудовании
+    часто старые TLS 1.0 и слабые шифры, а нам нужен сам сертификат, а не защищённый канал.
     """
-    ctx = ssl.create_default_context()
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
     ctx.check_hostname = False
     ctx.verify_mode = ssl.CERT_NONE
+    with contextlib.suppress(ValueError, ssl.SSLError):
+        ctx.minimum_version = ssl.TLSVersion.TLSv1
+    with contextlib.suppress(ssl.SSLError):
+        ctx.set_ciphers("ALL:@SECLEVEL=0")
+    return ctx
+
 
-    with socket.create_connection((ip, port), timeout=timeout) as sock:
-        with ctx.wrap_socket(sock, server_hostname=hostname) as ssock:
-            cert = ssock.getpeercert()
-            # Некоторые сервера при CERT_NONE/без верификации отдают пустой dict
-            if not cert:
-                return None
+_CONTEXT = _client_context()
 
-            # subject/issuer в виде "корявых" структур -> делаем dict
-            subject = _extract_name_from_seq(cert.get("subject"))
-            issuer = _extract_name_from_seq(cert.get("issuer"))
 
-            return {
-                "subject": subject,
-                "issuer": issuer,
-                "notBefore": cert.get("notBefore"),
-                "notAfter": cert.get("notAfter"),
-            }
+async def _handshake(ip, port, hostname):
+    writer = None
+    try:
+        _, writer = await asyncio.open_connection(ip, port, ssl=_CONTEXT, server_hostname=hostname or None)
+        sslobj = writer.get_extra_info("ssl_object")
+        der = sslobj.getpeercert(binary_form=True) if sslobj is not None else None
+        if not der:
+            return _error("server sent no certificate")
+        info = _decode_cert_der(der)
+        info["tls_version"] = sslobj.version()
+        info["cipher"] = (sslobj.cipher() or (None,))[0]
+        return info
+    finally:
+        if writer is not None:
+            writer.close()
+            with contextlib.suppress(Exception):
+                await asyncio.wait_for(writer.wait_closed(), 1.0)
 
 
-def get_cert_info(ip, port=443, timeout=3, hostname=None):
+async def async_get_cert_info(ip, port=443, timeout=TLS_TIMEOUT, hostname=None, budget=None, governor=None):
+    """
+    Сертификат одного порта: {"subject", "issuer", "notBefore", "notAfter", "serial", "sha256",
+    "tls_version", "cipher"} или {"error", "subject": None, ...}. timeout — жёсткий дедлайн
+    на connect + handshake (ожидание budget/governor в него не входит).
+    """
+    if governor is not None:
+        await governor.acquire_async(ip)
+    if budget is not None:
+        await budget.acquire_async()
+    try:
+        return await asyncio.wait_for(_handshake(ip, port, hostname), timeout)
+    except asyncio.TimeoutError:
+        return _error(f"timeout {timeout}s")
+    except Exception as e:
+        return _error(e)
+    finally:
+        if budget is not None:
+            budget.release()
+
+
+async def async_inspect_host(ip, ports, timeout=TLS_TIMEOUT, concurrency=TLS_CONCURRENCY, hostname=None,
+                             budget=None, governor=None):
+    """Сертификаты на всех портах из ports одновременно (не больше concurrency). Возвращает {port: info}."""
+    ports = list(ports)
+    result = {}
+    it = iter(ports)
+
+    async def worker():
+        for p in it:
+            result[p] = await async_get_cert_info(ip, p, timeout=timeout, hostname=hostname,
+                                                  budget=budget, governor=governor)
+
+    await asyncio.gather(*(worker() for _ in range(min(len(ports), max(1, concurrency)))))
+    return {p: result[p] for p in ports}
+
+
+def inspect_host(ip, ports, timeout=TLS_TIMEOUT, concurrency=TLS_CONCURRENCY, hostname=None,
+                 budget=None, governor=None):
+    """Синхронная обёртка над async_inspect_host."""
+    if not ports:
+        return {}
+    return asyncio.run(async_inspect_host(ip, ports, timeout=timeout, concurrency=concurrency, hostname=hostname,
+                                          budget=budget, governor=governor))
+
+
+def get_cert_info(ip, port=443, timeout=TLS_TIMEOUT, hostname=None):
     """
     Возвращает информацию о TLS-сертификате или ошибку:
 
       {
-        "subject": {...} / None,
-        "issuer": {...} / None,
+        "subject": {...},
+        "issuer": {...},
         "notBefore": "...",
         "notAfter":  "...",
+        "serial", "sha256", "tls_version", "cipher"
       }
 
       или
@@ -114,52 +158,5 @@ def get_cert_info(ip, port=443, timeout=3, hostname=None):
         "notBefore": None,
         "notAfter": None
       }
-
-    Логика:
-      1) Пытаемся через обычный TLS-контекст (getpeercert)
-      2) Если cert пустой или ошибка — пытаемся получить PEM через ssl.get_server_certificate
-         и разбираем его вручную через cryptography.
     """
-    host = hostname or ip
-
-    # 1. Пытаемся через обычный TLS-контекст
-    try:
-        info = _try_modern_context(ip, port, timeout, host)
-        if info is not None:
-            return info
-    except Exception:
-        # просто переходим к fallback
-        pass
-
-    # 2. Фоллбэк: ssl.get_server_certificate → PEM → cryptography
-    try:
-        pem = ssl.get_server_certificate((ip, port))
-        if not pem:
-            return {
-                "error": "TLS check failed: empty PEM from server",
-                "subject": None,
-                "issuer": None,
-                "notBefore": None,
-                "notAfter": None,
-            }
-
-        info = _decode_cert_pem(pem)
-        if not info:
-            return {
-                "error": "TLS check failed: cannot decode PEM cert",
-                "subject": None,
-                "issuer": None,
-                "notBefore": None,
-                "notAfter": None,
-            }
-
-        return info
-
-    except Exception as e:
-        return {
-            "error": f"TLS check failed: {e}",
-            "subject": None,
-            "issuer": None,
-            "notBefore": None,
-            "notAfter": None,
-        }
+    return asyncio.run(async_get_cert_info(ip, port, timeout=timeout, hostname=hostname))
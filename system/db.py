@@ -5,6 +5,14 @@ from contextlib import contextmanager
 DB_PATH = os.environ.get("ELTEX_DB", "eltex_audit.db")
 _lock = threading.Lock()
 
+# Таблицы SNMP-инвентаря (ключ строки — (device_id,row_index), row_index — индекс строки SNMP-таблицы)
+# и их колонки: имена колонок подставляются в SQL, поэтому принимаются только отсюда
+SNMP_TABLE_COLUMNS = {
+    "snmp_interfaces": ("descr","type","mtu","speed","mac","admin_status","oper_status","name","high_speed","alias"),
+    "snmp_entities": ("descr","class","name","hw_rev","fw_rev","sw_rev","serial","mfg_name","model_name"),
+    "snmp_arp": ("if_index","mac","ip","type"),
+}
+
 @contextmanager
 def _get_conn():
     with _lock:
@@ -14,6 +22,12 @@ def _get_conn():
         finally:
             conn.close()
 
+def _add_column(cur, table, column, decl):
+    """Добавляет колонку в уже существующую таблицу (база из прошлой версии)."""
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
 def init_db():
     with _get_conn() as conn:
         cur = conn.cursor()
@@ -84,6 +98,128 @@ def init_db():
             details TEXT,
             FOREIGN KEY(device_id) REFERENCES devices(id)
         )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS host_liveness(
+            ip TEXT PRIMARY KEY,
+            dead_streak INTEGER,
+            skip_left INTEGER,
+            last_alive INTEGER,
+            last_checked INTEGER
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS port_state(
+            device_id INTEGER,
+            proto TEXT,
+            port INTEGER,
+            state TEXT,
+            service TEXT,
+            first_seen INTEGER,
+            last_seen INTEGER,
+            changed_at INTEGER,
+            PRIMARY KEY(device_id,proto,port),
+            FOREIGN KEY(device_id) REFERENCES devices(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS snmp_access(
+            device_id INTEGER PRIMARY KEY,
+            community TEXT,
+            sysobjectid TEXT,
+            sysname TEXT,
+            location TEXT,
+            uptime INTEGER,
+            checked_at INTEGER,
+            sysdescr TEXT,
+            FOREIGN KEY(device_id) REFERENCES devices(id)
+        )""")
+        _add_column(cur, "snmp_access", "sysdescr", "TEXT")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS snmp_interfaces(
+            device_id INTEGER,
+            row_index TEXT,
+            descr TEXT, type INTEGER, mtu INTEGER, speed INTEGER, mac TEXT,
+            admin_status INTEGER, oper_status INTEGER, name TEXT, high_speed INTEGER, alias TEXT,
+            updated_at INTEGER,
+            PRIMARY KEY(device_id,row_index),
+            FOREIGN KEY(device_id) REFERENCES devices(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS snmp_entities(
+            device_id INTEGER,
+            row_index TEXT,
+            descr TEXT, class INTEGER, name TEXT, hw_rev TEXT, fw_rev TEXT, sw_rev TEXT,
+            serial TEXT, mfg_name TEXT, model_name TEXT,
+            updated_at INTEGER,
+            PRIMARY KEY(device_id,row_index),
+            FOREIGN KEY(device_id) REFERENCES devices(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS snmp_arp(
+            device_id INTEGER,
+            row_index TEXT,
+            if_index INTEGER, mac TEXT, ip TEXT, type INTEGER,
+            updated_at INTEGER,
+            PRIMARY KEY(device_id,row_index),
+            FOREIGN KEY(device_id) REFERENCES devices(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS port_baseline(
+            device_id INTEGER PRIMARY KEY,
+            created_at INTEGER,
+            FOREIGN KEY(device_id) REFERENCES devices(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS rescan_cycles(
+            job_key TEXT PRIMARY KEY,
+            cycle INTEGER,
+            updated INTEGER
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS scan_jobs(
+            id INTEGER PRIMARY KEY,
+            target TEXT,
+            params TEXT,
+            status TEXT,
+            created_at INTEGER,
+            updated_at INTEGER,
+            report TEXT
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS scan_job_hosts(
+            job_id INTEGER,
+            ip TEXT,
+            status TEXT,
+            cursor INTEGER,
+            ports TEXT,
+            result TEXT,
+            updated_at INTEGER,
+            PRIMARY KEY(job_id,ip),
+            FOREIGN KEY(job_id) REFERENCES scan_jobs(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS nvd_cves(
+            cve TEXT PRIMARY KEY,
+            severity TEXT,
+            description TEXT,
+            last_modified TEXT,
+            imported_at INTEGER
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS nvd_ranges(
+            cve TEXT,
+            vendor TEXT,
+            product TEXT,
+            version TEXT,
+            start_including TEXT,
+            start_excluding TEXT,
+            end_including TEXT,
+            end_excluding TEXT,
+            FOREIGN KEY(cve) REFERENCES nvd_cves(cve)
+        )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_scans_device ON scans(device_id,service,scan_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_vulns_device ON vulnerabilities(device_id,cve)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_mitre_device ON mitre_findings(device_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_nvd_ranges_product ON nvd_ranges(product,vendor)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_nvd_ranges_cve ON nvd_ranges(cve)")
         conn.commit()
 
 def upsert_device(ip, hostname=None, mac=None, model=None, fw_version=None):
@@ -93,7 +229,9 @@ def upsert_device(ip, hostname=None, mac=None, model=None, fw_version=None):
         cur.execute("SELECT id FROM devices WHERE ip=?", (ip,))
         r = cur.fetchone()
         if r:
-            cur.execute("UPDATE devices SET hostname=?,mac=?,model=?,fw_version=?,last_seen=? WHERE id=?",
+            # неизвестные в этом скане поля (None) не затирают найденные ранее
+            cur.execute("""UPDATE devices SET hostname=COALESCE(?,hostname),mac=COALESCE(?,mac),model=COALESCE(?,model),
+                           fw_version=COALESCE(?,fw_version),last_seen=? WHERE id=?""",
                         (hostname,mac,model,fw_version,now,r[0]))
             device_id = r[0]
         else:
@@ -103,6 +241,71 @@ def upsert_device(ip, hostname=None, mac=None, model=None, fw_version=None):
         conn.commit()
         return device_id
 
+def upsert_snmp_access(device_id, info):
+    """Community, на которую ответило устройство, и группа system из SNMP (последний скан)."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO snmp_access(device_id,community,sysobjectid,sysname,location,uptime,checked_at,sysdescr)
+                       VALUES(?,?,?,?,?,?,?,?)
+                       ON CONFLICT(device_id) DO UPDATE SET community=excluded.community,sysobjectid=excluded.sysobjectid,
+                       sysname=excluded.sysname,location=excluded.location,uptime=excluded.uptime,checked_at=excluded.checked_at,
+                       sysdescr=excluded.sysdescr""",
+                    (device_id,info.get("community"),info.get("sysobjectid"),info.get("sysname"),info.get("location"),
+                     info.get("uptime"),int(time.time()),info.get("sysdescr")))
+        conn.commit()
+
+def get_snmp_access(ips):
+    """{ip: (device_id, community)} для устройств, ответивших на SNMP в прошлых сканах."""
+    ips = list(ips)
+    out = {}
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        for i in range(0, len(ips), 500):
+            chunk = ips[i:i+500]
+            cur.execute(f"""SELECT d.ip,d.id,s.community FROM devices d JOIN snmp_access s ON s.device_id=d.id
+                            WHERE d.ip IN ({",".join("?"*len(chunk))})""", chunk)
+            out.update({ip: (dev_id, community) for ip, dev_id, community in cur.fetchall()})
+    return out
+
+def save_snmp_cells(cells, updated_at):
+    """
+    cells: [(table, device_id, column, row_index, value), ...] — ячейки SNMP-таблиц, одной транзакцией.
+    Строки создаются/дополняются по (device_id,row_index): колонки разных обходов (ifTable,
+    ifXTable) сходятся в одну строку.
+    """
+    by_column = {}
+    for table, device_id, column, row_index, value in cells:
+        if column not in SNMP_TABLE_COLUMNS.get(table, ()):
+            raise ValueError(f"unknown column {table}.{column}")
+        by_column.setdefault((table,column), []).append((device_id,row_index,value,updated_at))
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        for (table, column), rows in by_column.items():
+            cur.executemany(f"""INSERT INTO {table}(device_id,row_index,{column},updated_at) VALUES(?,?,?,?)
+                                ON CONFLICT(device_id,row_index) DO UPDATE SET {column}=excluded.{column},
+                                updated_at=excluded.updated_at""", rows)
+        conn.commit()
+
+def prune_snmp_table(table, device_id, before):
+    """Удаляет строки, не обновлённые последним полным обходом (интерфейс/модуль/ARP-запись исчезли)."""
+    if table not in SNMP_TABLE_COLUMNS:
+        raise ValueError(f"unknown table {table}")
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DELETE FROM {table} WHERE device_id=? AND updated_at<?", (device_id,before))
+        conn.commit()
+
+def get_snmp_inventory(ip):
+    """{"interfaces": [...], "entities": [...], "arp": [...]} устройства (строки — словари)."""
+    out = {}
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        for table, columns in SNMP_TABLE_COLUMNS.items():
+            cur.execute(f"""SELECT t.row_index,{",".join("t."+c for c in columns)},t.updated_at FROM {table} t
+                            JOIN devices d ON d.id=t.device_id WHERE d.ip=? ORDER BY t.rowid""", (ip,))
+            out[table[len("snmp_"):]] = [dict(zip(("row_index",)+columns+("updated_at",), r)) for r in cur.fetchall()]
+    return out
+
 def insert_scan(device_id, scan_time, port, service, state, banner=None, snmp_sysdescr=None, raw_json=None):
     with _get_conn() as conn:
         cur = conn.cursor()
@@ -110,6 +313,90 @@ def insert_scan(device_id, scan_time, port, service, state, banner=None, snmp_sy
                     (device_id,scan_time,port,service,state,banner,snmp_sysdescr,raw_json))
         conn.commit()
 
+def insert_scans(rows):
+    """Пачка записей scans одной транзакцией: [(device_id,scan_time,port,service,state,banner,snmp_sysdescr,raw_json), ...]."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO scans(device_id,scan_time,port,service,state,banner,snmp_sysdescr,raw_json) VALUES(?,?,?,?,?,?,?,?)",
+                        rows)
+        conn.commit()
+
+def get_open_port_ranges(service="tcp"):
+    """
+    Открытые сейчас (по port_state) порты каждого устройства, свёрнутые в диапазоны:
+    {ip: [(start, end), ...]}. Диапазоны собираются в SQL (порт минус номер строки
+    постоянен внутри непрерывного отрезка), поэтому порты по одному в Python не поднимаются.
+    """
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            WITH islands AS (SELECT device_id, port, port - ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY port) AS grp
+                             FROM port_state WHERE proto=? AND state='open')
+            SELECT d.ip, MIN(i.port), MAX(i.port) FROM islands i JOIN devices d ON d.id=i.device_id
+            GROUP BY i.device_id, i.grp ORDER BY d.ip, MIN(i.port)
+        """, (service,))
+        out = {}
+        for ip, start, end in cur.fetchall():
+            out.setdefault(ip, []).append((start, end))
+        return out
+
+def has_port_baseline(device_id):
+    """Был ли у устройства хоть один полный (не прерванный) скан, от которого считаются изменения портов."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM port_baseline WHERE device_id=?", (device_id,))
+        return cur.fetchone() is not None
+
+def set_port_baseline(device_id):
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT OR IGNORE INTO port_baseline(device_id,created_at) VALUES(?,?)", (device_id,int(time.time())))
+        conn.commit()
+
+def get_port_states(device_id, proto="tcp"):
+    """Текущее состояние портов устройства, которые когда-либо были открыты: {port: (state, service)}."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT port,state,service FROM port_state WHERE device_id=? AND proto=?", (device_id,proto))
+        return {port: (state, service) for port, state, service in cur.fetchall()}
+
+def upsert_port_states(device_id, proto, rows):
+    """
+    rows: [(port, state, service), ...] — итог скана по портам, состояние которых известно.
+    changed_at меняется только при смене state/service; service=None не затирает известный.
+    """
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO port_state(device_id,proto,port,state,service,first_seen,last_seen,changed_at) VALUES(?,?,?,?,?,?,?,?)
+            ON CONFLICT(device_id,proto,port) DO UPDATE SET
+                changed_at=CASE WHEN state IS NOT excluded.state OR (excluded.service IS NOT NULL AND service IS NOT excluded.service)
+                                THEN excluded.changed_at ELSE changed_at END,
+                state=excluded.state, service=COALESCE(excluded.service,service), last_seen=excluded.last_seen
+        """, [(device_id,proto,port,state,service,now,now,now) for port, state, service in rows])
+        conn.commit()
+
+def next_rescan_cycle(job_key):
+    """Номер очередного цикла инкрементального пересканирования задачи job_key (0, 1, 2, ...)."""
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO rescan_cycles(job_key,cycle,updated) VALUES(?,0,?)
+                       ON CONFLICT(job_key) DO UPDATE SET cycle=cycle+1,updated=excluded.updated""", (job_key,now))
+        cur.execute("SELECT cycle FROM rescan_cycles WHERE job_key=?", (job_key,))
+        conn.commit()
+        return cur.fetchone()[0]
+
+def get_port_frequency(service="tcp", limit=None):
+    """Частота открытых портов по истории сканов: [(port, число устройств), ...] по убыванию."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""SELECT port, COUNT(DISTINCT device_id) AS n FROM scans WHERE service=? AND state='open'
+                       GROUP BY port ORDER BY n DESC, port LIMIT ?""",
+                    (service, -1 if limit is None else int(limit)))
+        return cur.fetchall()
+
 def insert_vuln(device_id, cve, desc, severity="MEDIUM", source="local"):
     now = int(time.time())
     with _get_conn() as conn:
@@ -124,6 +411,148 @@ def insert_vuln(device_id, cve, desc, severity="MEDIUM", source="local"):
                         (device_id,cve,desc,severity,source,now,now))
         conn.commit()
 
+NVD_RANGE_COLUMNS = ("version","start_including","start_excluding","end_including","end_excluding")
+
+def get_nvd_modified(cves):
+    """{cve: last_modified} для уже импортированных CVE из списка."""
+    cves = list(cves)
+    out = {}
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        for i in range(0, len(cves), 500):
+            part = cves[i:i+500]
+            cur.execute(f"SELECT cve,last_modified FROM nvd_cves WHERE cve IN ({','.join('?'*len(part))})", part)
+            out.update(cur.fetchall())
+    return out
+
+def save_nvd_cves(records, removed=(), imported_at=None):
+    """
+    Одна транзакция на пачку импорта: records — [{"cve","severity","description","last_modified",
+    "ranges": [{"vendor","product", NVD_RANGE_COLUMNS...}]}] (заменяют прежние), removed — CVE к удалению.
+    """
+    now = imported_at or int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        gone = [(c,) for c in list(removed) + [r["cve"] for r in records]]
+        cur.executemany("DELETE FROM nvd_ranges WHERE cve=?", gone)
+        cur.executemany("DELETE FROM nvd_cves WHERE cve=?", [(c,) for c in removed])
+        cur.executemany("INSERT OR REPLACE INTO nvd_cves(cve,severity,description,last_modified,imported_at) VALUES(?,?,?,?,?)",
+                        [(r["cve"],r["severity"],r["description"],r["last_modified"],now) for r in records])
+        cur.executemany(f"INSERT INTO nvd_ranges(cve,vendor,product,{','.join(NVD_RANGE_COLUMNS)}) VALUES(?,?,?,?,?,?,?,?)",
+                        [(r["cve"],g["vendor"],g["product"])+tuple(g.get(c) for c in NVD_RANGE_COLUMNS)
+                         for r in records for g in r["ranges"]])
+        conn.commit()
+
+def get_nvd_ranges(name):
+    """
+    Диапазоны версий продукта name ("esr" или "eltex esr" — продукт с вендором через пробел):
+    [(cve, severity, description, vendor, product, version, start_incl, start_excl, end_incl, end_excl)].
+    """
+    vendor, _, product = name.partition(" ")
+    cols = "r.cve,c.severity,c.description,r.vendor,r.product," + ",".join("r."+c for c in NVD_RANGE_COLUMNS)
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""SELECT {cols} FROM nvd_ranges r JOIN nvd_cves c ON c.cve=r.cve WHERE r.product=?
+                        UNION ALL
+                        SELECT {cols} FROM nvd_ranges r JOIN nvd_cves c ON c.cve=r.cve WHERE r.product=? AND r.vendor=?
+                        ORDER BY 1""", (name, product, vendor))
+        return cur.fetchall()
+
+def get_nvd_stamp():
+    """(число CVE, время последнего импорта) — меняется после каждого импорта, по нему сбрасывается кэш матчера."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*),MAX(imported_at) FROM nvd_cves")
+        return cur.fetchone()
+
+def insert_vulns(device_id, cves):
+    """Пачка insert_vuln одной транзакцией: cves — [{"cve","desc","severity","source"}]."""
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        for c in cves:
+            row = (c.get("desc", ""),c.get("severity", "MEDIUM"),c.get("source", "local"),now)
+            cur.execute("UPDATE vulnerabilities SET description=?,severity=?,source=?,last_seen=? WHERE device_id=? AND cve=?",
+                        row+(device_id,c.get("cve")))
+            if not cur.rowcount:
+                cur.execute("INSERT INTO vulnerabilities(device_id,cve,description,severity,source,first_seen,last_seen) VALUES(?,?,?,?,?,?,?)",
+                            (device_id,c.get("cve"))+row[:3]+(now,now))
+        conn.commit()
+
+def get_device_records(after_id=0, limit=500):
+    """
+    Записи устройств для повторного анализа без сети — пачка по id > after_id:
+    [{"device_id", "ip", "ports": {port: info}, "udp_ports": {port: info}, "snmp_system": {...} | None}].
+    Порты — открытые в последнем скане каждого порта (info из raw_json), кроме тех, что по port_state
+    с тех пор закрылись; snmp_system — из snmp_access (sysDescr и community последнего ответа).
+    """
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id,ip FROM devices WHERE id>? ORDER BY id LIMIT ?", (after_id,limit))
+        devices = cur.fetchall()
+        if not devices:
+            return []
+        ids = [d[0] for d in devices]
+        marks = ",".join("?"*len(ids))
+        out = {d: {"device_id": d, "ip": ip, "ports": {}, "udp_ports": {}, "snmp_system": None} for d, ip in devices}
+        # последняя строка scans по каждому порту (SQLite берёт остальные колонки из строки с MAX)
+        cur.execute(f"""SELECT device_id,service,port,state,raw_json,MAX(scan_time) FROM scans
+                        WHERE device_id IN ({marks}) GROUP BY device_id,service,port""", ids)
+        last = cur.fetchall()
+        cur.execute(f"SELECT device_id,proto,port,state FROM port_state WHERE device_id IN ({marks})", ids)
+        closed = {(d,proto,port) for d, proto, port, state in cur.fetchall() if state != "open"}
+        for d, proto, port, state, raw, _ in last:
+            if state != "open" or (d,proto,port) in closed or proto not in ("tcp","udp"):
+                continue
+            try:
+                info = json.loads(raw) if raw else {}
+            except ValueError:
+                info = {}
+            out[d]["ports" if proto == "tcp" else "udp_ports"][port] = info or {"state": state}
+        cur.execute(f"SELECT device_id,community,sysdescr,sysname FROM snmp_access WHERE device_id IN ({marks})", ids)
+        for d, community, sysdescr, sysname in cur.fetchall():
+            out[d]["snmp_system"] = {"community": community, "sysdescr": sysdescr, "sysname": sysname}
+        return [out[d] for d in ids]
+
+def save_reevaluation(results):
+    """
+    Итог повторного анализа пачки устройств одной транзакцией: results — [(device_id, cves, findings)],
+    cves/findings — None, если этот этап не пересчитывался. CVE и последняя находка MITRE по паре
+    (техника, правило) обновляются на месте, новые добавляются, а больше не подтверждающиеся —
+    удаляются (first_seen CVE сохраняется).
+    """
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        for device_id, cves, findings in results:
+            if cves is not None:
+                keep = [c.get("cve") for c in cves]
+                cur.execute(f"DELETE FROM vulnerabilities WHERE device_id=? AND cve NOT IN ({','.join('?'*len(keep))})",
+                            [device_id]+keep)
+                for c in cves:
+                    row = (c.get("desc", ""),c.get("severity", "MEDIUM"),c.get("source", "local"),now)
+                    cur.execute("UPDATE vulnerabilities SET description=?,severity=?,source=?,last_seen=? WHERE device_id=? AND cve=?",
+                                row+(device_id,c.get("cve")))
+                    if not cur.rowcount:
+                        cur.execute("INSERT INTO vulnerabilities(device_id,cve,description,severity,source,first_seen,last_seen) VALUES(?,?,?,?,?,?,?)",
+                                    (device_id,c.get("cve"))+row[:3]+(now,now))
+            if findings is not None:
+                cur.execute("SELECT id,technique_id,rule FROM mitre_findings WHERE device_id=? ORDER BY id", (device_id,))
+                existing = {}
+                for fid, tid, rule in cur.fetchall():
+                    existing.setdefault((tid,rule), []).append(fid)
+                wanted = {(f["technique_id"],f.get("rule", "")): f for f in findings}
+                stale = [fid for key, fids in existing.items() if key not in wanted for fid in fids]
+                cur.executemany("DELETE FROM mitre_findings WHERE id=?", [(fid,) for fid in stale])
+                for key, f in wanted.items():
+                    if key in existing:
+                        cur.execute("UPDATE mitre_findings SET technique_name=?,confidence=?,evidence=?,found_at=? WHERE id=?",
+                                    (f["technique_name"],f.get("confidence", ""),json.dumps(f,ensure_ascii=False),now,existing[key][-1]))
+                    else:
+                        cur.execute("INSERT INTO mitre_findings(device_id,technique_id,technique_name,rule,confidence,evidence,found_at) VALUES(?,?,?,?,?,?,?)",
+                                    (device_id,key[0],f["technique_name"],key[1],f.get("confidence", ""),json.dumps(f,ensure_ascii=False),now))
+        conn.commit()
+
 def insert_mitre(device_id, tid, name, rule, conf, evidence):
     with _get_conn() as conn:
         cur = conn.cursor()
@@ -145,3 +574,98 @@ def insert_history(device_id, etype, details):
         cur.execute("INSERT INTO history(device_id,event_time,event_type,details) VALUES(?,?,?,?)",
                     (device_id,int(time.time()),etype,json.dumps(details,ensure_ascii=False)))
         conn.commit()
+
+def get_backoff_hosts():
+    """IP, которые из-за backoff ещё надо пропустить: {ip: сколько прогонов осталось пропускать}."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT ip,skip_left FROM host_liveness WHERE skip_left>0")
+        return {ip: n for ip, n in cur.fetchall()}
+
+def update_host_liveness(alive_ips, dead_ips, skipped_ips=(), max_skip=24):
+    """
+    Итог прохода обнаружения:
+      - живые хосты сбрасывают серию "мёртвых" прогонов;
+      - мёртвые увеличивают серию N и получают skip_left = min(2^(N-1) - 1, max_skip);
+      - пропущенные по backoff уменьшают skip_left на 1.
+    """
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO host_liveness(ip,dead_streak,skip_left,last_alive,last_checked) VALUES(?,0,0,?,?)
+            ON CONFLICT(ip) DO UPDATE SET dead_streak=0,skip_left=0,last_alive=excluded.last_alive,last_checked=excluded.last_checked
+        """, [(ip,now,now) for ip in alive_ips])
+        cur.executemany("""
+            INSERT INTO host_liveness(ip,dead_streak,skip_left,last_alive,last_checked) VALUES(?,1,0,NULL,?)
+            ON CONFLICT(ip) DO UPDATE SET dead_streak=dead_streak+1,skip_left=MIN(?,(1<<MIN(dead_streak,30))-1),last_checked=excluded.last_checked
+        """, [(ip,now,max_skip) for ip in dead_ips])
+        cur.executemany("UPDATE host_liveness SET skip_left=skip_left-1 WHERE ip=? AND skip_left>0",
+                        [(ip,) for ip in skipped_ips])
+        conn.commit()
+
+def create_scan_job(target, params):
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO scan_jobs(target,params,status,created_at,updated_at) VALUES(?,?,?,?,?)",
+                    (target,json.dumps(params,ensure_ascii=False),"running",now,now))
+        conn.commit()
+        return cur.lastrowid
+
+def update_scan_job(job_id, status, report=None):
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE scan_jobs SET status=?,report=COALESCE(?,report),updated_at=? WHERE id=?",
+                    (status,report,int(time.time()),job_id))
+        conn.commit()
+
+def _job_row(row):
+    job_id, target, params, status, created_at, updated_at, report, done, partial, failed = row
+    return {"id": job_id, "target": target, "params": json.loads(params or "{}"), "status": status,
+            "created_at": created_at, "updated_at": updated_at, "report": report,
+            "hosts_done": done or 0, "hosts_partial": partial or 0, "hosts_failed": failed or 0}
+
+_JOB_SELECT = """SELECT j.id,j.target,j.params,j.status,j.created_at,j.updated_at,j.report,
+                        SUM(h.status='done'),SUM(h.status='partial'),SUM(h.status='failed')
+                 FROM scan_jobs j LEFT JOIN scan_job_hosts h ON h.job_id=j.id"""
+
+def get_scan_job(job_id):
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(_JOB_SELECT + " WHERE j.id=? GROUP BY j.id", (job_id,))
+        r = cur.fetchone()
+        return _job_row(r) if r else None
+
+def list_scan_jobs(limit=50):
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(_JOB_SELECT + " GROUP BY j.id ORDER BY j.id DESC LIMIT ?", (limit,))
+        return [_job_row(r) for r in cur.fetchall()]
+
+def interrupt_stale_jobs():
+    """После перезапуска процесса задачи в статусе running уже никто не выполняет."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE scan_jobs SET status='interrupted',updated_at=? WHERE status='running'", (int(time.time()),))
+        conn.commit()
+        return cur.rowcount
+
+def save_job_hosts(job_id, rows):
+    """rows: [(ip, status, cursor, ports_json, result_json), ...] — checkpoint хостов задачи."""
+    now = int(time.time())
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO scan_job_hosts(job_id,ip,status,cursor,ports,result,updated_at) VALUES(?,?,?,?,?,?,?)
+            ON CONFLICT(job_id,ip) DO UPDATE SET status=excluded.status,cursor=excluded.cursor,ports=excluded.ports,
+                result=excluded.result,updated_at=excluded.updated_at
+        """, [(job_id,ip,status,cursor,ports,result,now) for ip, status, cursor, ports, result in rows])
+        conn.commit()
+
+def get_job_hosts(job_id):
+    """{ip: (status, cursor, ports_json, result_json)} в порядке сохранения."""
+    with _get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT ip,status,cursor,ports,result FROM scan_job_hosts WHERE job_id=? ORDER BY rowid", (job_id,))
+        return {ip: (status, cursor, ports, result) for ip, status, cursor, ports, result in cur.fetchall()}
@@ -0,0 +1,278 @@
+# system/nvd_import.py — офлайн-импорт фидов NVD в SQLite (таблицы nvd_cves / nvd_ranges)
+#
+# Фиды NVD JSON 1.1 ("CVE_Items") и 2.0 ("vulnerabilities"), в т.ч. .json.gz и .json.zip,
+# читаются с диска потоково: в памяти только текущий кусок файла и одна запись CVE,
+# а не весь фид (json.load годового фида — это гигабайты). Сохраняются только CPE вендоров
+# сетевого оборудования (nvd_vendors в defaults.json) и продуктов из таблицы псевдонимов
+# (ALIASES_FILE: имя продукта в сигнатурах баннеров → пары vendor:product CPE — "Apache httpd"
+# → apache:http_server); CVE, не изменившиеся с прошлого импорта (lastModified), пропускаются.
+#
+#   python -m system.nvd_import nvdcve-2.0-2024.json.gz nvdcve-2.0-modified.json.gz
+import argparse
+import gzip
+import io
+import json
+import os
+import re
+import time
+import zipfile
+
+from system import db
+
+DEFAULTS_FILE = os.path.join("system", "defaults.json")
+ALIASES_FILE = os.path.join("data", "cpe_aliases.json")
+
+ITEM_ARRAYS = ("CVE_Items", "vulnerabilities")  # массив записей в фиде 1.1 / 2.0
+READ_CHUNK = 1 << 20   # символов за одно чтение фида
+IMPORT_BATCH = 1000    # записей CVE на одну транзакцию
+
+_ARRAY_RE = re.compile(r'"(?:%s)"\s*:\s*\[' % "|".join(ITEM_ARRAYS))
+_CPE_SPLIT_RE = re.compile(r"(?<!\\):")  # в CPE 2.3 двоеточие внутри поля экранируется "\:"
+_DECODER = json.JSONDecoder()
+
+
+def load_vendors(path=DEFAULTS_FILE):
+    """Вендоры CPE, которые импортируются ("nvd_vendors" в defaults.json)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            vendors = json.load(f).get("nvd_vendors") or []
+    except (OSError, ValueError):
+        vendors = []
+    return {v.lower() for v in vendors}
+
+
+def load_aliases(path=ALIASES_FILE):
+    """
+    Таблица псевдонимов: {имя продукта из сигнатур (нижний регистр): [(vendor, product), ...]},
+    product — как хранится в nvd_ranges (_cpe_product).
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    aliases = {}
+    for name, cpes in table.items():
+        pairs = []
+        for cpe in cpes:
+            vendor, _, product = cpe.partition(":")
+            if vendor and product:
+                pairs.append((vendor.lower(), _cpe_product(product)))
+        aliases[" ".join(name.lower().split())] = pairs
+    return aliases
+
+
+def alias_products(aliases):
+    """Пары (vendor, product) CPE из таблицы псевдонимов — импортируются помимо nvd_vendors."""
+    return {pair for pairs in aliases.values() for pair in pairs}
+
+
+def iter_array_items(f, chunk=READ_CHUNK):
+    """
+    Элементы массива записей фида (ITEM_ARRAYS) по одному, без чтения файла целиком:
+    кусок текста дочитывается, пока очередной элемент не разберётся raw_decode.
+    """
+    buf = ""
+    while True:
+        data = f.read(chunk)
+        if not data:
+            return  # массива нет — пустой фид
+        buf += data
+        m = _ARRAY_RE.search(buf)
+        if m:
+            buf = buf[m.end():]
+            break
+        buf = buf[-64:]  # ключ мог разрезаться границей куска
+
+    pos, eof = 0, False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf):
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = _DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                pos = end
+                continue
+        elif eof:
+            raise ValueError("фид NVD оборвался внутри массива записей")
+        data = f.read(chunk)
+        eof = not data
+        buf = buf[pos:] + data
+        pos = 0
+
+
+def iter_feed(path, chunk=READ_CHUNK):
+    """Записи CVE из файла фида: .json, .json.gz или .zip (все .json внутри)."""
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if name.endswith(".json"):
+                    with io.TextIOWrapper(z.open(name), encoding="utf-8") as f:
+                        yield from iter_array_items(f, chunk)
+        return
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        yield from iter_array_items(f, chunk)
+
+
+def _cpe_product(product):
+    """Имя продукта CPE → как в сигнатурах баннеров: "esr_firmware" → "esr", "ios_xe" → "ios xe"."""
+    name = " ".join(product.replace("\\", "").replace("_", " ").lower().split())
+    if name.endswith(" firmware"):
+        name = name[:-len(" firmware")]
+    return name
+
+
+def _cpe_matches(nodes):
+    for node in nodes or []:
+        yield from node.get("cpeMatch") or node.get("cpe_match") or []
+        yield from _cpe_matches(node.get("children"))
+
+
+def _ranges(configurations, vendors, products=frozenset()):
+    """Уязвимые диапазоны версий из конфигураций CVE — вендоров из vendors и пар (vendor, product) из products."""
+    if isinstance(configurations, dict):  # 1.1: {"nodes": [...]}, 2.0: [{"nodes": [...]}, ...]
+        configurations = [configurations]
+    out = []
+    for conf in configurations or []:
+        for m in _cpe_matches(conf.get("nodes")):
+            if not m.get("vulnerable", True):
+                continue
+            parts = _CPE_SPLIT_RE.split(m.get("criteria") or m.get("cpe23Uri") or "")
+            if len(parts) < 6:
+                continue
+            row = {"vendor": parts[3].lower(), "product": _cpe_product(parts[4])}
+            if row["vendor"] not in vendors and (row["vendor"], row["product"]) not in products:
+                continue
+            version = parts[5].replace("\\", "")
+            if version not in ("*", "-", ""):
+                update = parts[6].replace("\\", "") if len(parts) > 6 else "*"
+                # openssh:8.2:p1 — суффикс версии в поле update, а в баннере он слитно с версией: 8.2p1
+                row["version"] = version + update if update not in ("*", "-", "") else version
+            else:
+                for field, key in (("start_including", "versionStartIncluding"),
+                                   ("start_excluding", "versionStartExcluding"),
+                                   ("end_including", "versionEndIncluding"),
+                                   ("end_excluding", "versionEndExcluding")):
+                    if m.get(key):
+                        row[field] = m[key]
+            if row not in out:
+                out.append(row)
+    return out
+
+
+def _severity(item, cve):
+    metrics = cve.get("metrics") or {}
+    for key in ("cvssMetricV40", "cvssMetricV31", "cvssMetricV30"):
+        for m in metrics.get(key) or []:
+            if (m.get("cvssData") or {}).get("baseSeverity"):
+                return m["cvssData"]["baseSeverity"].upper()
+    for m in metrics.get("cvssMetricV2") or []:
+        if m.get("baseSeverity"):
+            return m["baseSeverity"].upper()
+    impact = item.get("impact") or {}
+    sev = (((impact.get("baseMetricV3") or {}).get("cvssV3") or {}).get("baseSeverity")
+           or (impact.get("baseMetricV2") or {}).get("severity"))
+    return (sev or "MEDIUM").upper()
+
+
+def parse_item(item, vendors, products=frozenset()):
+    """
+    Запись фида 1.1 или 2.0 → (cve_id, last_modified, record); record — None, если
+    CVE отозвана или не касается вендоров из vendors и продуктов из products.
+    """
+    cve = item.get("cve") or {}
+    if "CVE_data_meta" in cve:  # 1.1
+        cve_id = cve["CVE_data_meta"].get("ID")
+        modified = item.get("lastModifiedDate")
+        descs = (cve.get("description") or {}).get("description_data") or []
+        configurations = item.get("configurations")
+        rejected = False
+    else:  # 2.0
+        cve_id = cve.get("id")
+        modified = cve.get("lastModified")
+        descs = cve.get("descriptions") or []
+        configurations = cve.get("configurations")
+        rejected = cve.get("vulnStatus") == "Rejected"
+    desc = next((d.get("value", "") for d in descs if d.get("lang") == "en"), "")
+    if rejected or desc.startswith("** REJECT **"):
+        return cve_id, modified, None
+    ranges = _ranges(configurations, vendors, products)
+    if not ranges:
+        return cve_id, modified, None
+    return cve_id, modified, {
+        "cve": cve_id,
+        "severity": _severity(item, cve),
+        "description": desc,
+        "last_modified": modified,
+        "ranges": ranges,
+    }
+
+
+def _flush(batch, stats, full):
+    stored = db.get_nvd_modified(cve_id for cve_id, _, _ in batch)
+    records, removed = [], []
+    for cve_id, modified, record in batch:
+        if record is None:
+            if cve_id in stored:
+                removed.append(cve_id)  # отозвана или больше не касается наших вендоров
+            continue
+        stats["kept"] += 1
+        if not full and stored.get(cve_id) == modified:
+            stats["unchanged"] += 1
+            continue
+        records.append(record)
+    if records or removed:
+        db.save_nvd_cves(records, removed)
+    stats["updated"] += len(records)
+    stats["removed"] += len(removed)
+
+
+def import_feeds(paths, vendors=None, full=False, log=None):
+    """
+    Импортирует файлы фидов по порядку (старые годы — раньше "modified", как в NVD).
+    full=True — переписать и неизменившиеся CVE (например, после правки nvd_vendors или псевдонимов).
+    Возвращает {"items", "kept", "updated", "unchanged", "removed"}.
+    """
+    vendors = load_vendors() if vendors is None else {v.lower() for v in vendors}
+    products = alias_products(load_aliases())
+    db.init_db()
+    stats = {"items": 0, "kept": 0, "updated": 0, "unchanged": 0, "removed": 0}
+    for path in paths:
+        started = time.time()
+        batch = {}
+        for item in iter_feed(path):
+            stats["items"] += 1
+            cve_id, modified, record = parse_item(item, vendors, products)
+            if not cve_id:
+                continue
+            batch[cve_id] = (cve_id, modified, record)  # повтор CVE в одном фиде — берём последнюю
+            if len(batch) >= IMPORT_BATCH:
+                _flush(list(batch.values()), stats, full)
+                batch = {}
+        if batch:
+            _flush(list(batch.values()), stats, full)
+        if log:
+            log(f"{path}: {time.time() - started:.1f} с, итого {stats}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-импорт фидов NVD JSON 1.1/2.0 в локальную базу CVE")
+    parser.add_argument("feeds", nargs="+", help="файлы фидов (.json, .json.gz, .zip)")
+    parser.add_argument("--full", action="store_true", help="переимпортировать и неизменившиеся CVE")
+    parser.add_argument("--vendor", action="append", help="вендор CPE (по умолчанию — nvd_vendors из defaults.json)")
+    args = parser.parse_args(argv)
+    stats = import_feeds(args.feeds, vendors=args.vendor, full=args.full, log=print)
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
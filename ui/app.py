@@ -12,12 +12,16 @@ import time
 import os
 import glob
 import json
-import ipaddress
 import queue
+import random
 
 from system import integrator
 from system import db
 from core import python_scanner
+from core import cve_matcher
+from core import mitre_checks
+from core import targets
+from core.portscanner import ENGINES
 from core.monitor import get_system_metrics
 from apscheduler.schedulers.background import BackgroundScheduler  # APScheduler
 
@@ -30,6 +34,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))      # .../Project3/ui
 PROJECT_ROOT = os.path.dirname(BASE_DIR)                   # .../Project3
 REPORT_DIR = os.path.join(PROJECT_ROOT, "data", "reports") # .../Project3/data/reports
 os.makedirs(REPORT_DIR, exist_ok=True)
+REPORT_META_SUFFIX = ".meta.json"  # сведения о прогоне рядом с отчётом scan_*.json
 
 SCAN_STATE = {
     "running": False,
@@ -40,6 +45,18 @@ SCAN_STATE = {
     "thread": None,
     "mode": None,
 }
+# повторный анализ CVE/MITRE по истории сканов (/api/reevaluate) — сеть не трогает, идёт параллельно со сканом
+REEVAL_STATE = {
+    "running": False,
+    "stop": False,
+    "modules": [],
+    "started_at": None,
+    "finished_at": None,
+    "devices": 0,
+    "cves": 0,
+    "findings": 0,
+    "stopped": False,
+}
 LOCK = threading.Lock()
 log_queue = queue.Queue()
 STOP_SCAN = False
@@ -54,6 +71,8 @@ AUTO_SCHEDULE = {
     "mode": None,
     "custom_ports": None,
     "modules": [],
+    "exclude": None,
+    "order": None,
 }
 
 
@@ -118,13 +137,26 @@ HTML = """
       <label>Цель:
         <input id="target" placeholder="192.168.1.2,192.168.1.3-10,192.168.1.0/24" style="width:320px">
       </label>
+      <label>Исключить:
+        <input id="exclude" placeholder="192.168.1.1,192.168.1.250-254" style="width:220px">
+      </label>
+      <label>Порядок:
+        <select id="order">
+          <option value="sequential">по порядку</option>
+          <option value="random">случайный</option>
+          <option value="interleaved">вперемешку по /24</option>
+        </select>
+      </label>
     </div>
     <div style="margin-top:8px;">
       <label>Режим:
         <select id="scan_mode">
           <option value="quick">quick</option>
           <option value="special">special</option>
+          <option value="top:100">top:100</option>
+          <option value="top:1000">top:1000</option>
           <option value="full">full (1..65535)</option>
+          <option value="incremental">incremental (изменения)</option>
         </select>
       </label>
       <label>Персонализированные порты:
@@ -136,6 +168,7 @@ HTML = """
       <label><input type="checkbox" name="modules" value="cve" checked> CVE</label>
       <label><input type="checkbox" name="modules" value="mitre" checked> MITRE</label>
       <label><input type="checkbox" name="modules" value="tls"> TLS</label>
+      <label><input type="checkbox" name="modules" value="inventory"> Инвентаризация (SNMP)</label>
     </div>
     <div style="margin-top:10px;">
       <button onclick="startScan()"> Пуск</button>
@@ -195,6 +228,8 @@ HTML = """
       const t = document.getElementById('target').value.trim();
       const mode = document.getElementById('scan_mode').value;
       const custom = document.getElementById('custom_ports').value.trim() || null;
+      const exclude = document.getElementById('exclude').value.trim() || null;
+      const order = document.getElementById('order').value;
       const mods = [];
       document.querySelectorAll('input[name="modules"]:checked').forEach(cb => mods.push(cb.value));
 
@@ -207,7 +242,7 @@ HTML = """
       fetch('/api/scan', {
         method:'POST',
         headers:{'Content-Type':'application/json'},
-        body: JSON.stringify({ target: t, modules: mods, mode: mode, custom_ports: custom })
+        body: JSON.stringify({ target: t, modules: mods, mode: mode, custom_ports: custom, exclude: exclude, order: order })
       }).then(r=>r.json()).then(js=>{
         logLine("API", js.message || "запрос отправлен");
       });
@@ -223,6 +258,8 @@ HTML = """
       const t = document.getElementById('target').value.trim();
       const mode = document.getElementById('scan_mode').value;
       const custom = document.getElementById('custom_ports').value.trim() || null;
+      const exclude = document.getElementById('exclude').value.trim() || null;
+      const order = document.getElementById('order').value;
       const mods = [];
       document.querySelectorAll('input[name="modules"]:checked').forEach(cb => mods.push(cb.value));
 
@@ -251,7 +288,9 @@ HTML = """
           target: t,
           mode: mode,
           custom_ports: custom,
-          modules: mods
+          modules: mods,
+          exclude: exclude,
+          order: order
         })
       }).then(r=>r.json()).then(js=>{
         logLine("SCHED", js.message || "расписание обновлено");
@@ -322,7 +361,7 @@ HTML = """
 """
 
 
-def expand_target(target):
+def expand_target(target, exclude=None):
     """
     Поддерживает:
     - одиночный IP:      192.168.1.10
@@ -330,61 +369,28 @@ def expand_target(target):
     - диапазон по хостам 192.168.1.3-192.168.1.10 или 192.168.1.3-10
     - подсети:           192.168.1.0/24
     Можно комбинировать: 192.168.1.2,192.168.1.3-5,192.168.2.0/30
+    exclude — адреса в том же формате, которые трогать нельзя (ValueError, если не разбираются).
+    Возвращает targets.TargetSet: адреса не разворачиваются в список, обход — ленивый.
     """
-    parts = [p.strip() for p in target.split(",") if p.strip()]
-    all_ips = []
-
-    for part in parts:
-        # CIDR-подсеть
-        if "/" in part:
-            try:
-                net = ipaddress.ip_network(part, strict=False)
-                all_ips.extend(str(ip) for ip in net.hosts())
-            except ValueError:
-                continue
-            continue
-
-        # Диапазон: 192.168.1.3-192.168.1.10 или 192.168.1.3-10
-        if "-" in part:
-            start_str, end_str = [x.strip() for x in part.split("-", 1)]
-            try:
-                # вариант: 192.168.1.3-192.168.1.10
-                if "." in end_str:
-                    start_ip = ipaddress.ip_address(start_str)
-                    end_ip = ipaddress.ip_address(end_str)
-                    cur = start_ip
-                    while cur <= end_ip:
-                        all_ips.append(str(cur))
-                        cur += 1
-                else:
-                    # вариант: 192.168.1.3-10 (меняется только последний октет)
-                    start_ip = ipaddress.ip_address(start_str)
-                    octets = start_ip.exploded.split(".")
-                    base = ".".join(octets[:-1])
-                    start_last = int(octets[-1])
-                    end_last = int(end_str)
-                    if end_last < start_last:
-                        start_last, end_last = end_last, start_last
-                    for host in range(start_last, end_last + 1):
-                        all_ips.append(f"{base}.{host}")
-            except ValueError:
-                continue
-            continue
-
-        # Одиночный IP
-        try:
-            all_ips.append(str(ipaddress.ip_address(part)))
-        except ValueError:
-            continue
+    return targets.TargetSet.parse(target).exclude(exclude or "")
 
-    return sorted(set(all_ips))
 
-
-def scan_thread(target, modules, mode="quick", custom_ports=None):
+def scan_thread(target, modules, mode="quick", custom_ports=None, engine="threads",
+                discovery=True, scheduled=False, rate_limits=None, job_id=None, exclude=None,
+                order=targets.ORDER_SEQUENTIAL):
     """
     В отдельном потоке:
-    - разворачивает target в список IP
-    - по каждому вызывает python_scanner.scan_device(...)
+    - лениво обходит адреса target без exclude в порядке order (targets.ORDERS)
+    - (discovery=True) быстрым проходом отсеивает мёртвые адреса;
+      в плановых прогонах (scheduled=True) ещё и пропускает хосты на backoff
+    - по каждому живому вызывает python_scanner.scan_device(...)
+    - все пробы (обнаружение, порты, SNMP, TLS) идут через один RateGovernor (rate_limits)
+    - в режиме incremental[:N] перепроверяет известные открытые порты и очередной срез портов
+      (цикл хранится в БД по target); изменения состояния портов сразу уходят в лог
+    - ведёт задачу ScanJob: прогресс периодически сохраняется в БД, а job_id продолжает
+      прерванную задачу (готовые хосты пропускаются, отчёт — общий для всех запусков)
+    - (модуль "inventory") после скана снимает по SNMP интерфейсы, ENTITY-MIB и ARP с ответивших
+      устройств (python_scanner.collect_snmp_inventory → таблицы snmp_* в БД)
     - пишет результат в JSON-отчёт
     - кидает события в log_event (→ браузер и Telegram)
     """
@@ -411,28 +417,96 @@ def scan_thread(target, modules, mode="quick", custom_ports=None):
         f" Запуск сканирования {target} | Модули: {modules} | Режим: {mode} | custom_ports: {custom_ports}"
     )
 
-    ips = expand_target(target)
-    results = []
-
-    for ip in ips:
-        if STOP_SCAN:
-            log_event(" Сканирование прервано пользователем")
-            break
+    governor = python_scanner.rate_governor(rate_limits)
+    cycles = python_scanner.parse_incremental_mode(mode)
+
+    if "mitre" in modules:
+        problems = mitre_checks.rule_problems()
+        if problems["undefined"]:
+            log_event(f" MITRE: правила из маппингов не определены: {', '.join(problems['undefined'])}")
+        for rule, err in problems["errors"].items():
+            log_event(f" MITRE: ошибка в правиле {rule}: {err}")
+
+    if job_id is None:
+        # порядок портов и цикл фиксируем в задаче: при возобновлении курсоры хостов
+        # имеют смысл только в том же порядке обхода
+        port_order = None
+        if mode == "full" or python_scanner.parse_top_mode(mode):
+            port_order = python_scanner.history_port_order()
+        plan = python_scanner.incremental_plan(target, cycles) if cycles else None
+        job = python_scanner.ScanJob.create(target, {
+            "modules": modules, "mode": mode, "custom_ports": custom_ports, "engine": engine,
+            "discovery": discovery, "scheduled": scheduled, "rate_limits": rate_limits,
+            "port_order": port_order, "cycle": plan["cycle"] if plan else None,
+            "exclude": exclude, "order": order, "seed": random.getrandbits(32),
+        })
+        hosts = expand_target(target, exclude)
+    else:
+        job = python_scanner.ScanJob.load(job_id)
+        port_order = job.params.get("port_order")
+        plan = python_scanner.incremental_plan(target, cycles, cycle=job.params.get("cycle")) if cycles else None
+        log_event(f" Продолжаю задачу #{job.id}: готово хостов {len(job.results())}")
+        # готовые хосты вычитаются как ещё одно исключение
+        hosts = expand_target(target, exclude).exclude(job.done_hosts())
+
+    ips = hosts.iter_order(order, seed=job.params.get("seed"))
+    log_event(f" Адресов в цели: {len(hosts)} (порядок: {order})")
+
+    if plan:
+        log_event(
+            f" Инкрементальный прогон: цикл {plan['cycle'] + 1}/{cycles}, "
+            f"срез портов TCP {plan['slice'].to_spec()}, UDP {plan['udp_slice'].to_spec() or '-'} "
+            f"+ известные открытые порты"
+        )
+    results = job.results()
+    summary = {"total": len(hosts), "alive": None, "skipped_dead": 0, "skipped_backoff": 0}
 
-        log_event(f" Сканирую {ip} (mode={mode}) ...")
+    if discovery and hosts:
+        log_event(f" Обнаружение живых хостов: {len(hosts)} адрес(ов) ...")
         try:
-            # custom_ports используется только в quick режиме
-            if mode == "quick":
-                res = python_scanner.scan_device(
-                    ip, mode=mode, modules=modules, custom_ports=custom_ports
-                )
-            else:
-                res = python_scanner.scan_device(
-                    ip, mode=mode, modules=modules, custom_ports=None
-                )
+            ips, summary = python_scanner.discover_live_hosts(
+                ips, modules=modules, mode=mode, custom_ports=custom_ports, use_backoff=scheduled,
+                governor=governor,
+            )
+            log_event(
+                f" Живых: {summary['alive']} из {summary['total']} | "
+                f"пропущено (нет ответа): {summary['skipped_dead']} | "
+                f"пропущено (backoff): {summary['skipped_backoff']}"
+            )
+        except Exception as e:
+            log_event(f" Ошибка обнаружения хостов, сканирую все адреса: {e}")
+            ips = hosts.iter_order(order, seed=job.params.get("seed"))  # обход мог быть частично израсходован
+
+    # одинаковые прошивки/баннеры разных хостов сопоставляются с базой CVE один раз за прогон
+    cve_cache = cve_matcher.MatchCache() if "cve" in modules else None
+
+    # custom_ports используется только в quick режиме
+    scan_iter = python_scanner.scan_many(
+        ips,
+        mode=mode,
+        modules=modules,
+        custom_ports=custom_ports if mode == "quick" else None,
+        engine=engine,
+        should_stop=lambda: STOP_SCAN,
+        on_start=lambda ip: log_event(f" Сканирую {ip} (mode={mode}) ..."),
+        on_open=lambda ip, port, info: log_event(f"  {ip}: открыт {port}/tcp"),
+        governor=governor,
+        plan=plan,
+        on_change=lambda ip, change: log_event(f" ИЗМЕНЕНИЕ {ip}: {python_scanner.describe_change(change)}"),
+        port_order=port_order,
+        job=job,
+        cve_cache=cve_cache,
+    )
 
+    # результаты приходят в порядке завершения хостов
+    try:
+        for ip, res in scan_iter:
             results.append(res)
 
+            if res.get("error"):
+                log_event(f" Ошибка при сканировании {ip}: {res['error']}")
+                continue
+
             # лог по времени конкретного IP
             dur_ms = (res.get("timings") or {}).get("duration_ms")
             if isinstance(dur_ms, (int, float)):
@@ -448,19 +522,66 @@ def scan_thread(target, modules, mode="quick", custom_ports=None):
             log_event(
                 f" {ip}: alive={res.get('alive')} | risk={risk} | HIGH_CVE={','.join(high_cves) if high_cves else 'нет'}"
             )
-
+    except Exception:
+        # прогресс задачи уже в БД — её можно будет продолжить через /api/resume
+        job.set_status("failed")
+        with LOCK:
+            SCAN_STATE.update({"running": False, "last_message": "failed"})
+        raise
+
+    if cve_cache is not None:
+        st = cve_cache.stats()
+        log_event(f" CVE: сопоставлено различных прошивок/версий сервисов: {st['distinct']}, повторно использовано: {st['reused']}")
+
+    inventory = None
+    if "inventory" in modules and not STOP_SCAN:
+        snmp_ips = [r["ip"] for r in results if r.get("snmp_system")]
+        log_event(f" SNMP-инвентаризация: {len(snmp_ips)} устройств ...")
+        try:
+            inventory = python_scanner.collect_snmp_inventory(snmp_ips, governor=governor)
+            complete = sum(1 for tables in inventory.values() if all(tables.values()))
+            log_event(f" SNMP-инвентаризация: полностью снято {complete} из {len(snmp_ips)}")
         except Exception as e:
-            log_event(f" Ошибка при сканировании {ip}: {e}")
-            results.append({"ip": ip, "error": str(e)})
+            log_event(f" Ошибка SNMP-инвентаризации: {e}")
+
+    failed = job.failed_hosts()
+    status = "interrupted" if STOP_SCAN or failed else "done"
+    if STOP_SCAN:
+        log_event(" Сканирование прервано пользователем")
+    elif failed:
+        log_event(f" Не удалось просканировать хостов: {len(failed)} — при продолжении задачи они будут повторены")
+    if status == "interrupted":
+        log_event(f" Задача #{job.id} сохранена, продолжить: POST /api/resume {{\"job_id\": {job.id}}}")
 
     # Сохраняем отчёт
-    # Формат имени: scan_ГГГГ-ММ-ДД_ЧЧ-ММ-СС.json
+    # Формат имени: scan_ГГГГ-ММ-ДД_ЧЧ-ММ-СС.json — как и раньше, список результатов по хостам.
+    # Сведения о прогоне (задача, статус, лимиты, сводка, SNMP-инвентарь) — рядом, в scan_....meta.json
     timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")  # локальное время системы
     filename = f"scan_{timestamp}.json"
     out_path = os.path.join(REPORT_DIR, filename)
 
+    meta = {
+        "report": filename,
+        "job_id": job.id,
+        "status": status,
+        "target": target,
+        "exclude": exclude,
+        "order": order,
+        "mode": mode,
+        "modules": modules,
+        "started_at": started_wall,
+        "rate_limits": governor.limits(),
+        "incremental": {"cycle": plan["cycle"], "cycles": plan["cycles"], "slice": plan["slice"].to_spec(),
+                        "udp_slice": plan["udp_slice"].to_spec()}
+        if plan else None,
+        "summary": summary,
+        "inventory": inventory,
+    }
     with open(out_path, "w", encoding="utf-8") as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(REPORT_DIR, f"scan_{timestamp}{REPORT_META_SUFFIX}"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    job.set_status(status, report=filename)
 
     # общий runtime
     overall_t1 = time.perf_counter()
@@ -474,9 +595,66 @@ def scan_thread(target, modules, mode="quick", custom_ports=None):
         SCAN_STATE.update({"running": False, "last_message": "done"})
 
 
+def snmp_sweep_thread(target, modules, exclude=None, order=targets.ORDER_SEQUENTIAL, rate_limits=None):
+    """
+    SNMP-обнаружение диапазона без скана портов (python_scanner.sweep_snmp):
+    GET sysDescr на все адреса с одного UDP-сокета, CVE по sysDescr (модуль "cve").
+    Пишет отчёт snmp_sweep_*.json и кидает события в log_event.
+    """
+    t0 = time.perf_counter()
+    with LOCK:
+        SCAN_STATE.update({"running": True, "target": target, "modules": modules,
+                           "started_at": int(time.time()), "last_message": "snmp sweep", "mode": "snmp-sweep"})
+    try:
+        hosts = expand_target(target, exclude)
+        governor = python_scanner.rate_governor(rate_limits)
+        log_event(f" SNMP-обнаружение {target}: {len(hosts)} адрес(ов), лимиты {governor.limits()}")
+        found = python_scanner.sweep_snmp(targets.TargetOrder(hosts, order), modules=modules, governor=governor)
+        for ip, info in sorted(found.items()):
+            cves = ",".join(c.get("cve") for c in info["cves"]) or "нет"
+            log_event(f"  {ip}: {info['model'] or '-'} {info['fw_version'] or ''} | CVE={cves}")
+
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        filename = f"snmp_sweep_{timestamp}.json"
+        with open(os.path.join(REPORT_DIR, filename), "w", encoding="utf-8") as f:
+            json.dump({"target": target, "exclude": exclude, "modules": modules, "rate_limits": governor.limits(),
+                       "total": len(hosts), "responded": len(found), "results": found},
+                      f, indent=2, ensure_ascii=False)
+        total_ms = int((time.perf_counter() - t0) * 1000)
+        log_event(f"SNMP-обнаружение завершено за {total_ms} ms: ответили {len(found)} из {len(hosts)}")
+        log_event(filename)
+    finally:
+        with LOCK:
+            SCAN_STATE.update({"running": False, "last_message": "done"})
+
+
+def reevaluate_thread(modules):
+    """
+    Повторный анализ CVE/MITRE по истории сканов в БД (python_scanner.reevaluate_devices) —
+    после обновления базы CVE или правил MITRE, без сканирования сети.
+    """
+    t0 = time.perf_counter()
+    log_event(f" Повторный анализ по истории сканов: модули {modules}")
+
+    def progress(stats):
+        with LOCK:
+            REEVAL_STATE.update(stats)
+
+    try:
+        stats = python_scanner.reevaluate_devices(modules, should_stop=lambda: REEVAL_STATE["stop"], on_progress=progress)
+        total_ms = int((time.perf_counter() - t0) * 1000)
+        log_event(f" Повторный анализ {'прерван' if stats['stopped'] else 'завершён'} за {total_ms} ms: "
+                  f"устройств {stats['devices']}, CVE {stats['cves']}, находок MITRE {stats['findings']}")
+    except Exception as e:
+        log_event(f" Ошибка повторного анализа: {e}")
+    finally:
+        with LOCK:
+            REEVAL_STATE.update({"running": False, "finished_at": int(time.time())})
+
+
 # ---------- АВТОЗАПУСК ПО РАСПИСАНИЮ ----------
 
-def run_scheduled_scan(target, modules, mode="quick", custom_ports=None):
+def run_scheduled_scan(target, modules, mode="quick", custom_ports=None, exclude=None, order=targets.ORDER_SEQUENTIAL):
     """
     Запуск сканирования по расписанию.
     Проверяет, не идёт ли уже скан, чтобы не запустить два параллельно.
@@ -491,6 +669,7 @@ def run_scheduled_scan(target, modules, mode="quick", custom_ports=None):
     th = threading.Thread(
         target=scan_thread,
         args=(target, modules, mode, custom_ports),
+        kwargs={"scheduled": True, "exclude": exclude, "order": order},
         daemon=True,
     )
     SCAN_STATE["thread"] = th
@@ -536,7 +715,8 @@ def _reschedule_auto_job():
     trigger_kwargs = {
         "id": AUTO_JOB_ID,
         "replace_existing": True,
-        "args": (target, modules, mode, custom_ports),
+        "args": (target, modules, mode, custom_ports, AUTO_SCHEDULE["exclude"],
+                 AUTO_SCHEDULE["order"] or targets.ORDER_SEQUENTIAL),
     }
 
     if unit == "minutes":
@@ -578,11 +758,31 @@ def api_scan():
     data = request.get_json() or {}
     target = data.get("target")
     modules = data.get("modules", [])
-    mode = data.get("mode", "quick")         # quick|special|full
+    mode = data.get("mode", "quick")         # quick|special|top:N|full|incremental[:N]
     custom_ports = data.get("custom_ports")  # например "22,80,1000-1010"
+    engine = data.get("engine", "threads")   # threads|asyncio
+    discovery = bool(data.get("discovery", True))  # предварительный поиск живых хостов
+    rate_limits = data.get("rate")            # {"global": 5000, "subnet": 1500, "host": 300, "subnet_prefix": 24}
+    exclude = data.get("exclude") or None     # адреса/диапазоны, которые трогать нельзя
+    order = data.get("order") or targets.ORDER_SEQUENTIAL  # sequential|random|interleaved
 
     if not target:
         return {"ok": False, "message": "target required"}, 400
+    if engine not in ENGINES:
+        return {"ok": False, "message": f"unknown engine: {engine}"}, 400
+    if not python_scanner.is_valid_scan_mode(mode):
+        return {"ok": False, "message": f"unknown mode: {mode}"}, 400
+    if rate_limits is not None and not isinstance(rate_limits, dict):
+        return {"ok": False, "message": "rate must be an object"}, 400
+    if order not in targets.ORDERS:
+        return {"ok": False, "message": f"unknown order: {order}"}, 400
+    try:
+        python_scanner.rate_governor(rate_limits)
+        hosts = expand_target(target, exclude)
+    except ValueError as e:
+        return {"ok": False, "message": str(e)}, 400
+    if not hosts:
+        return {"ok": False, "message": "в цели не осталось адресов"}, 400
     if SCAN_STATE["running"]:
         return {"ok": False, "message": "скан уже запущен"}, 409
 
@@ -591,13 +791,52 @@ def api_scan():
         log_event(" Full scan (1..65535). Это может занять очень много времени.")
 
     th = threading.Thread(
-        target=scan_thread, args=(target, modules, mode, custom_ports), daemon=True
+        target=scan_thread,
+        args=(target, modules, mode, custom_ports, engine),
+        kwargs={"discovery": discovery, "rate_limits": rate_limits, "exclude": exclude, "order": order},
+        daemon=True,
     )
     SCAN_STATE["thread"] = th
     th.start()
     return {"ok": True, "message": f"Сканирование начато (mode={mode})"}
 
 
+@app.route("/api/snmp_sweep", methods=["POST"])
+def api_snmp_sweep():
+    data = request.get_json() or {}
+    target = data.get("target")
+    modules = data.get("modules", ["cve"])
+    exclude = data.get("exclude") or None
+    order = data.get("order") or targets.ORDER_SEQUENTIAL
+    rate_limits = data.get("rate")
+
+    if not target:
+        return {"ok": False, "message": "target required"}, 400
+    if order not in targets.ORDERS:
+        return {"ok": False, "message": f"unknown order: {order}"}, 400
+    if rate_limits is not None and not isinstance(rate_limits, dict):
+        return {"ok": False, "message": "rate must be an object"}, 400
+    try:
+        python_scanner.rate_governor(rate_limits)
+        hosts = expand_target(target, exclude)
+    except ValueError as e:
+        return {"ok": False, "message": str(e)}, 400
+    if not hosts:
+        return {"ok": False, "message": "в цели не осталось адресов"}, 400
+    if SCAN_STATE["running"]:
+        return {"ok": False, "message": "скан уже запущен"}, 409
+
+    th = threading.Thread(
+        target=snmp_sweep_thread,
+        args=(target, modules),
+        kwargs={"exclude": exclude, "order": order, "rate_limits": rate_limits},
+        daemon=True,
+    )
+    SCAN_STATE["thread"] = th
+    th.start()
+    return {"ok": True, "message": f"SNMP-обнаружение начато ({len(hosts)} адресов)"}
+
+
 @app.route("/api/schedule", methods=["GET", "POST"])
 def api_schedule():
     global AUTO_SCHEDULE
@@ -626,12 +865,22 @@ def api_schedule():
     mode = data.get("mode") or "quick"
     custom_ports = data.get("custom_ports") or None
     modules = data.get("modules") or []
+    exclude = data.get("exclude") or None
+    order = data.get("order") or targets.ORDER_SEQUENTIAL
 
     if enabled:
         if not target:
             return jsonify({"ok": False, "message": "Для включения автосканирования нужно указать цель."}), 400
         if not every or every <= 0:
             return jsonify({"ok": False, "message": "Период должен быть положительным числом."}), 400
+        if not python_scanner.is_valid_scan_mode(mode):
+            return jsonify({"ok": False, "message": f"Неизвестный режим: {mode}"}), 400
+        if order not in targets.ORDERS:
+            return jsonify({"ok": False, "message": f"Неизвестный порядок обхода: {order}"}), 400
+        try:
+            expand_target(target, exclude)
+        except ValueError as e:
+            return jsonify({"ok": False, "message": str(e)}), 400
 
     AUTO_SCHEDULE.update(
         {
@@ -642,6 +891,8 @@ def api_schedule():
             "mode": mode,
             "custom_ports": custom_ports,
             "modules": modules,
+            "exclude": exclude,
+            "order": order,
         }
     )
 
@@ -671,7 +922,8 @@ def api_schedule():
 @app.route("/api/reports")
 def api_reports():
     files = sorted(
-        [os.path.basename(p) for p in glob.glob(os.path.join(REPORT_DIR, "*.json"))],
+        [os.path.basename(p) for p in glob.glob(os.path.join(REPORT_DIR, "*.json"))
+         if not p.endswith(REPORT_META_SUFFIX)],
         reverse=True,
     )
     return jsonify([{"name": f} for f in files])
@@ -686,6 +938,51 @@ def rep(name):
     return send_from_directory(REPORT_DIR, name)
 
 
+@app.route("/api/inventory")
+def api_inventory():
+    ip = request.args.get("ip")
+    if not ip:
+        return {"ok": False, "message": "ip required"}, 400
+    return jsonify(db.get_snmp_inventory(ip))
+
+
+@app.route("/api/jobs")
+def api_jobs():
+    return jsonify(db.list_scan_jobs())
+
+
+@app.route("/api/resume", methods=["POST"])
+def api_resume():
+    data = request.get_json() or {}
+    job = db.get_scan_job(data.get("job_id"))
+    if not job:
+        return {"ok": False, "message": "job not found"}, 404
+    if job["status"] == "done":
+        return {"ok": False, "message": f"задача #{job['id']} уже завершена"}, 409
+    if SCAN_STATE["running"]:
+        return {"ok": False, "message": "скан уже запущен"}, 409
+
+    params = job["params"]
+    db.update_scan_job(job["id"], "running")
+    th = threading.Thread(
+        target=scan_thread,
+        args=(job["target"], params.get("modules") or [], params.get("mode") or "quick",
+              params.get("custom_ports"), params.get("engine") or "threads"),
+        kwargs={
+            "discovery": params.get("discovery", True),
+            "scheduled": params.get("scheduled", False),
+            "rate_limits": params.get("rate_limits"),
+            "job_id": job["id"],
+            "exclude": params.get("exclude"),
+            "order": params.get("order") or targets.ORDER_SEQUENTIAL,
+        },
+        daemon=True,
+    )
+    SCAN_STATE["thread"] = th
+    th.start()
+    return {"ok": True, "message": f"Задача #{job['id']} продолжена"}
+
+
 @app.route("/api/stop", methods=["POST"])
 def api_stop():
     global STOP_SCAN
@@ -694,6 +991,27 @@ def api_stop():
     return jsonify({"ok": True, "message": "Сканирование остановлено."})
 
 
+@app.route("/api/reevaluate", methods=["GET", "POST"])
+def api_reevaluate():
+    if request.method == "GET":
+        with LOCK:
+            return jsonify({k: v for k, v in REEVAL_STATE.items() if k != "stop"})
+    data = request.get_json() or {}
+    if data.get("stop"):
+        REEVAL_STATE["stop"] = True
+        return {"ok": True, "message": "Повторный анализ будет остановлен после текущей пачки."}
+    modules = data.get("modules", ["cve", "mitre"])
+    if not isinstance(modules, list) or not set(modules) & {"cve", "mitre"}:
+        return {"ok": False, "message": "modules: нужен хотя бы один из cve, mitre"}, 400
+    with LOCK:
+        if REEVAL_STATE["running"]:
+            return {"ok": False, "message": "повторный анализ уже идёт"}, 409
+        REEVAL_STATE.update({"running": True, "stop": False, "modules": modules, "started_at": int(time.time()),
+                             "finished_at": None, "devices": 0, "cves": 0, "findings": 0, "stopped": False})
+    threading.Thread(target=reevaluate_thread, args=(modules,), daemon=True).start()
+    return {"ok": True, "message": "Повторный анализ запущен"}
+
+
 @app.route("/api/system_load")
 def api_system_load():
     return jsonify(get_system_metrics())
@@ -701,6 +1019,7 @@ def api_system_load():
 
 if __name__ == "__main__":
     db.init_db()
+    db.interrupt_stale_jobs()  # задачи, оборванные прошлым запуском процесса, можно продолжить
     init_scheduler()  # запускаем планировщик
     print("Сканер запущен")
     # важно отключить reloader, чтобы не было двойного планировщика